@@ -0,0 +1,148 @@
+import os
+import struct
+import cv2
+import numpy as np
+
+# Landmark alignment: a similarity transform (rotation, uniform scale,
+# shift) maps each face's 5 detector landmarks (eyes, nose, mouth
+# corners; MTCNN and retinaface use the same order) onto a canonical
+# template, and cv2.warpAffine writes the aligned crop straight into a
+# preallocated batch. Also the array file format data_prep/align.py writes.
+
+# ArcFace's 112x112 reference points, the usual 5-point template
+REFERENCE_112 = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041],
+], dtype=np.float32)
+
+
+def reference_points(size=160, zoom=0.85):
+    """Template for size x size crops. zoom < 1 shrinks the face about the
+    crop centre, leaving a margin like MTCNN's margin=20 crops that
+    InceptionResnetV1 was trained on."""
+    centre = np.float32(112 / 2.0)
+    return ((REFERENCE_112 - centre) * zoom + centre) * np.float32(size / 112.0)
+
+
+def estimate_similarity(src, dst):
+    """Least-squares similarity transforms, batched: src (N, 5, 2) landmark
+    sets onto dst (5, 2). Returns (N, 2, 3) float32 affine matrices.
+
+    Closed form for x' = [[a, -b], [b, a]] x + t (Umeyama without
+    reflection)."""
+    src = np.asarray(src, dtype=np.float64).reshape(-1, 5, 2)
+    dst = np.asarray(dst, dtype=np.float64).reshape(5, 2)
+    src_mean = src.mean(axis=1, keepdims=True)
+    dst_mean = dst.mean(axis=0)
+    x = src - src_mean
+    y = dst - dst_mean
+    norm = np.maximum(np.einsum("nij,nij->n", x, x), 1e-12)
+    a = np.einsum("nij,ij->n", x, y) / norm
+    b = (x[..., 0] @ y[:, 1] - x[..., 1] @ y[:, 0]) / norm
+    m = np.empty((len(src), 2, 3), dtype=np.float64)
+    m[:, 0, 0], m[:, 0, 1] = a, -b
+    m[:, 1, 0], m[:, 1, 1] = b, a
+    m[:, :, 2] = dst_mean - np.einsum("nij,nj->ni", m[:, :, :2], src_mean[:, 0])
+    return m.astype(np.float32)
+
+
+def warp_faces(img, landmarks, size=160, out=None, zoom=0.85):
+    """Aligned (N, size, size, 3) uint8 crops of `img` (any channel order,
+    kept as is), written into out[:N] when given."""
+    landmarks = np.asarray(landmarks, dtype=np.float32).reshape(-1, 5, 2)
+    if out is None:
+        out = np.empty((len(landmarks), size, size, img.shape[2]), dtype=img.dtype)
+    mats = estimate_similarity(landmarks, reference_points(size, zoom))
+    for i, m in enumerate(mats):
+        cv2.warpAffine(img, m, (size, size), dst=out[i], flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+    return out[:len(landmarks)]
+
+
+def to_model_input(faces, bgr=True, out=None, mean=127.5, std=128.0):
+    """(N, H, W, 3) uint8 crops -> (N, 3, H, W) float32 RGB standardized as
+    (x - mean) / std in one pass; the defaults are MTCNN's post_process
+    (ArcFace uses std 127.5)."""
+    faces = np.asarray(faces)
+    if bgr:
+        faces = faces[..., ::-1]
+    if out is None:
+        out = np.empty((len(faces), 3) + faces.shape[1:3], dtype=np.float32)
+    np.subtract(faces.transpose(0, 3, 1, 2), np.float32(mean), out=out[:len(faces)])
+    out[:len(faces)] *= np.float32(1.0 / std)
+    return out[:len(faces)]
+
+
+# ---------- aligned array file ----------
+# <name>.npy: (N, size, size, 3) uint8 BGR crops, a plain .npy (np.load with
+# mmap_mode works) whose header is written last, so rows stream to disk.
+# <name>.meta.npz: per-row source path, name, sha256, score, landmarks, plus
+# the crop style ("aligned5"), size and zoom, which the embedding side checks.
+HEADER_SIZE = 128
+CROP_STYLE = "aligned5"
+
+
+def meta_path(path):
+    return os.path.splitext(path)[0] + ".meta.npz"
+
+
+class AlignedWriter:
+    def __init__(self, path, size=160, zoom=0.85):
+        self.path = path
+        self.size = size
+        self.zoom = zoom
+        self.n = 0
+        self.meta = {"paths": [], "names": [], "hashes": [], "scores": [], "landmarks": []}
+        self._f = open(path, "wb")
+        self._f.write(b"\0" * HEADER_SIZE)
+
+    def append(self, face, path, name, digest, score, landmarks):
+        self._f.write(np.ascontiguousarray(face, dtype=np.uint8).tobytes())
+        for key, value in zip(("paths", "names", "hashes", "scores", "landmarks"),
+                              (path, name, digest, score, landmarks)):
+            self.meta[key].append(value)
+        self.n += 1
+
+    def close(self):
+        header = "{'descr': '|u1', 'fortran_order': False, 'shape': %r, }" % ((self.n, self.size, self.size, 3),)
+        header = header.ljust(HEADER_SIZE - 11) + "\n"
+        self._f.seek(0)
+        self._f.write(np.lib.format.magic(1, 0) + struct.pack("<H", len(header)) + header.encode("latin1"))
+        self._f.close()
+        with open(meta_path(self.path), "wb") as f:
+            np.savez(f, crop=CROP_STYLE, size=self.size, zoom=self.zoom, paths=np.array(self.meta["paths"], dtype=str), names=np.array(self.meta["names"], dtype=str),
+                     hashes=np.array(self.meta["hashes"], dtype=str),
+                     scores=np.array(self.meta["scores"], dtype=np.float32),
+                     landmarks=np.array(self.meta["landmarks"], dtype=np.float32).reshape(-1, 5, 2))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def load_aligned(path):
+    """(faces memmap, meta dict) of a file written by AlignedWriter."""
+    faces = np.load(path, mmap_mode="r")
+    with np.load(meta_path(path)) as meta:
+        return faces, {k: meta[k] for k in meta.files}
+
+
+def check_aligned(faces, meta, pipeline):
+    """Raise ValueError unless the file holds the crops `pipeline` (a
+    FacePipeline) cuts itself: embeddings of other crops don't match the
+    gallery's or the queries'."""
+    if "crop" not in meta:
+        raise ValueError("aligned file has no crop record; re-run data_prep.align")
+    if not pipeline.align:
+        raise ValueError("aligned crops, but this gallery uses margin crops (set ALIGN_FACES=1 to use them)")
+    size, zoom = int(meta["size"]), float(meta["zoom"])
+    if str(meta["crop"]) != CROP_STYLE or size != pipeline.size or faces.shape[1:3] != (size, size):
+        raise ValueError(f"aligned crops are {str(meta['crop'])} {faces.shape[1]}px, "
+                         f"the embedder takes {CROP_STYLE} {pipeline.size}px (data_prep.align --size)")
+    if abs(zoom - pipeline.zoom) > 1e-6:
+        raise ValueError(f"aligned crops use zoom {zoom}, the pipeline {pipeline.zoom}")
@@ -0,0 +1,87 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from app.config import EMBED_BATCH_SIZE, BATCH_MAX_WAIT_MS
+from app.metrics import observe, SIZE_BUCKETS
+
+
+class MicroBatcher:
+    """Collects single items submitted from any thread or coroutine into
+    batches of up to max_batch_size (waiting at most max_wait_ms for
+    stragglers) and runs `fn` on them in one dedicated worker thread.
+
+    `fn` takes a list of items and returns a sequence of results in the
+    same order; each submitter gets its own Future."""
+
+    def __init__(self, fn, max_batch_size=EMBED_BATCH_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, name="micro-batcher"):
+        self.fn = fn
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.items = 0
+        self.seconds = 0.0  # total time in fn
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def submit(self, item) -> Future:
+        fut = Future()
+        self._queue.put((item, fut))
+        return fut
+
+    async def run(self, item):
+        return await asyncio.wrap_future(self.submit(item))
+
+    async def run_many(self, items):
+        return await asyncio.gather(*(asyncio.wrap_future(self.submit(x)) for x in items))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                # whatever is already queued is taken without waiting
+                entry = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)  # let _run see the stop marker after this batch
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            batch = [(x, f) for x, f in self._collect(entry) if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            items, futures = zip(*batch)
+            observe("batch_size", len(items), buckets=SIZE_BUCKETS, batcher=self.name)
+            t0 = time.perf_counter()
+            try:
+                results = self.fn(list(items))
+            except Exception as e:
+                for f in futures:
+                    f.set_exception(e)
+                continue
+            dt = time.perf_counter() - t0
+            observe("batch_seconds", dt, batcher=self.name)
+            self.seconds += dt
+            self.batches += 1
+            self.items += len(items)
+            for f, r in zip(futures, results):
+                f.set_result(r)
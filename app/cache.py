@@ -0,0 +1,93 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.config import EMBED_CACHE_SIZE, EMBED_CACHE_DIR, MODEL_VERSION
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: an in-process LRU in front of an
+    optional directory of .npy files. Keys are sha256(model version + input
+    bytes), so a model change never serves stale vectors.
+
+    A cached value of None means "no face in this input" and is a hit too."""
+
+    def __init__(self, capacity=EMBED_CACHE_SIZE, disk_dir=EMBED_CACHE_DIR, model_version=MODEL_VERSION):
+        self.capacity = capacity
+        self.disk_dir = disk_dir or None
+        self.model_version = model_version.encode()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def key(self, data) -> str:
+        h = hashlib.sha256(self.model_version)
+        h.update(b"\0")
+        h.update(data)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".npy")
+
+    def get(self, key):
+        """(hit, embedding-or-None)."""
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return True, self._lru[key]
+        if self.disk_dir and os.path.exists(self._path(key)):
+            arr = np.load(self._path(key))
+            value = None if arr.size == 0 else arr
+            if value is not None:
+                value.flags.writeable = False
+            self._remember(key, value)
+            with self._lock:
+                self.hits += 1
+                self.disk_hits += 1
+            return True, value
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        if value is not None:
+            value = np.array(value, dtype=np.float32)
+            value.flags.writeable = False
+        self._remember(key, value)
+        if self.disk_dir:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, np.zeros(0, np.float32) if value is None else value)
+            os.replace(tmp, path)
+
+    def _remember(self, key, value):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._lru[key] = value
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._lru),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
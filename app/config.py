@@ -1,10 +1,115 @@
 import os
 
-DB_PATH = os.environ.get("FACE_DB", "face_gallery.db")
+DB_PATH = os.environ.get("FACE_DB", "faces.db")
+# older SQLAlchemy gallery (app/models.py); its identities table is folded into DB_PATH
+LEGACY_DB_PATH = os.environ.get("LEGACY_FACE_DB", "face_gallery.db")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 5000))
 EMBED_DIM = 512
 MATCH_THRESHOLD = float(os.environ.get("MATCH_THRESHOLD", 0.45))  # cosine distance (lower = closer)
 TOP_K = int(os.environ.get("TOP_K", 5))
 DETECTOR_BACKEND = os.environ.get("DETECTOR_BACKEND", "mtcnn")  # options: mtcnn | insightface
-EMBEDDER_BACKEND = os.environ.get("EMBEDDER_BACKEND", "facenet")  # facenet | insightface
+EMBEDDER_BACKEND = os.environ.get("EMBEDDER_BACKEND", "facenet")  # facenet | insightface | onnx | onnx-int8
 DEVICE = "cpu"
 GALLERY_DIR = os.environ.get("GALLERY_DIR", "gallery_images")
+
+# gallery search index: flat (exact) | ivf | hnsw | template (per-identity, app/templates.py)
+INDEX_BACKEND = os.environ.get("INDEX_BACKEND", "flat")
+INDEX_PATH = os.environ.get("INDEX_PATH", os.path.splitext(DB_PATH)[0] + ".index")
+IVF_NLIST = int(os.environ.get("IVF_NLIST", 1024))
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", 16))
+HNSW_M = int(os.environ.get("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", 200))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 64))
+TEMPLATE_EXEMPLARS = int(os.environ.get("TEMPLATE_EXEMPLARS", 3))  # k-medoid exemplars kept next to each centroid
+TEMPLATE_TOP_IDENTITIES = int(os.environ.get("TEMPLATE_TOP_IDENTITIES", 8))  # identities re-ranked exactly
+# deleted / replaced gallery rows stay as tombstones until there are this many
+# (and this fraction of the gallery), then the matrix and index are compacted
+GALLERY_COMPACT_MIN = int(os.environ.get("GALLERY_COMPACT_MIN", 256))
+GALLERY_COMPACT_RATIO = float(os.environ.get("GALLERY_COMPACT_RATIO", 0.1))
+
+# max faces per InceptionResnetV1 forward pass
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 64))
+# micro-batching: how long the first queued face waits for others to join its batch
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 5))
+# on-disk embedding rows (app/store.py): float32 | float16
+EMBED_STORE_DTYPE = os.environ.get("EMBED_STORE_DTYPE", "float32")
+# compressed codes for the flat index: none | fp16 | int8 | pq
+QUANTIZATION = os.environ.get("QUANTIZATION", "none")
+PQ_M = int(os.environ.get("PQ_M", 64))  # PQ sub-vectors (must divide EMBED_DIM)
+RERANK_K = int(os.environ.get("RERANK_K", 100))  # shortlist re-scored with exact vectors
+
+# onnxruntime embedder (EMBEDDER_BACKEND=onnx); export with tools/convert_onnx.py
+ONNX_MODEL_PATH = os.environ.get("ONNX_MODEL_PATH", "models/facenet.onnx")
+ONNX_INT8_MODEL_PATH = os.environ.get("ONNX_INT8_MODEL_PATH", "models/facenet_int8.onnx")  # tools/quantize_int8.py
+ORT_INTRA_THREADS = int(os.environ.get("ORT_INTRA_THREADS", 0))  # 0 = one per physical core
+ORT_INTER_THREADS = int(os.environ.get("ORT_INTER_THREADS", 1))
+
+# longest side fed to the face detector; bigger uploads / frames are decoded
+# reduced (JPEG draft) or downscaled, and boxes mapped back to full resolution
+DETECT_MAX_SIDE = int(os.environ.get("DETECT_MAX_SIDE", 1024))
+# crops for the embedder (app/pipeline.py): 0 = MTCNN-style margin crops (what
+# the facenet galleries were enrolled with), 1 = 5-point similarity aligned.
+# The insightface embedder always gets aligned crops; re-enroll after switching.
+ALIGN_FACES = os.environ.get("ALIGN_FACES", "0") == "1"
+
+# quality gate (app/quality.py): faces failing any check are not embedded on
+# the recognition paths (rejected by the API, deferred by video tracks)
+QUALITY_GATE = os.environ.get("QUALITY_GATE", "1") == "1"
+QUALITY_MIN_SCORE = float(os.environ.get("QUALITY_MIN_SCORE", 0.90))  # detector confidence
+QUALITY_MIN_FACE = float(os.environ.get("QUALITY_MIN_FACE", 40))  # px, shorter box side at full resolution
+QUALITY_MIN_SHARPNESS = float(os.environ.get("QUALITY_MIN_SHARPNESS", 25))  # Laplacian variance of the 160x160 crop
+QUALITY_MAX_YAW = float(os.environ.get("QUALITY_MAX_YAW", 0.7))  # nose offset from the eye midpoint / half eye distance
+QUALITY_MAX_ROLL = float(os.environ.get("QUALITY_MAX_ROLL", 35))  # degrees, eye line vs horizontal
+
+# embedding cache (app/cache.py): in-process LRU entries, optional on-disk layer
+EMBED_CACHE_SIZE = int(os.environ.get("EMBED_CACHE_SIZE", 10000))
+EMBED_CACHE_DIR = os.environ.get("EMBED_CACHE_DIR", "")  # empty = memory only
+# part of every cache key; bump it when weights or preprocessing change
+_CROPS = "aligned5" if ALIGN_FACES or EMBEDDER_BACKEND == "insightface" else "mtcnn160m20"
+MODEL_VERSION = os.environ.get("MODEL_VERSION", f"{EMBEDDER_BACKEND}-vggface2-{_CROPS}-det{DETECT_MAX_SIDE}")
+
+# video streams (app/stream.py): run the detector every N frames, track in between
+STREAM_DETECT_EVERY = int(os.environ.get("STREAM_DETECT_EVERY", 5))
+STREAM_MAX_AGE = int(os.environ.get("STREAM_MAX_AGE", 15))  # frames without a detection before a track is lost
+STREAM_IOU = float(os.environ.get("STREAM_IOU", 0.3))
+STREAM_REEMBED_GAIN = float(os.environ.get("STREAM_REEMBED_GAIN", 1.25))  # re-embed when quality grows by this factor
+# sources /stream/recognize may open: scheme://host[:port] entries (comma
+# separated, e.g. "rtsp://cam1.local:554,https://video.example.com"); local
+# video files and camera indexes only with STREAM_ALLOW_LOCAL=1
+STREAM_ALLOWED_URLS = [u.strip() for u in os.environ.get("STREAM_ALLOWED_URLS", "").split(",") if u.strip()]
+STREAM_ALLOW_LOCAL = os.environ.get("STREAM_ALLOW_LOCAL", "0") == "1"
+
+# multi-process serving (python -m app.serve): uvicorn workers share the
+# embedding store mmap; torch threads are split across them
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", 1))
+TORCH_THREADS = int(os.environ.get("TORCH_THREADS", 0))  # 0 = cores // SERVE_WORKERS
+TORCH_INTEROP_THREADS = int(os.environ.get("TORCH_INTEROP_THREADS", 1))
+# how often each worker pulls faces added by the other workers
+GALLERY_SYNC_MS = float(os.environ.get("GALLERY_SYNC_MS", 500))
+
+# request path (app/main.py): threads for decode / MTCNN / search / file I/O,
+# and how many requests may be in flight before new ones get a 503
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", max(2, (os.cpu_count() or 4) // SERVE_WORKERS)))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", 64))
+
+# app/metrics.py: /metrics (Prometheus text) and stage timers; 0 turns them into no-ops
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"  # per-request Server-Timing header
+
+# model startup (app/model_loader.py)
+LAZY_MODEL_LOAD = os.environ.get("LAZY_MODEL_LOAD", "1") == "1"  # load in the background; /ready reports it
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", "")  # becomes TORCH_HOME; empty = torch's default
+MODEL_OFFLINE = os.environ.get("MODEL_OFFLINE", "0") == "1"  # never download weights
+TORCHSCRIPT_PATH = os.environ.get("TORCHSCRIPT_PATH", "")  # e.g. models/facenet_ts.pt; empty = eager model
+WARMUP_BATCH_SIZES = [int(b) for b in os.environ.get("WARMUP_BATCH_SIZES", f"1,8,{EMBED_BATCH_SIZE}").split(",") if b]
+
+# sharded gallery (app/shards.py): each shard server runs this app over its own
+# FACE_DB holding the identities that hash to SHARD_INDEX of SHARD_COUNT; a
+# coordinator (SHARD_URLS set) fans searches out to them and merges the top-k
+SHARD_INDEX = int(os.environ.get("SHARD_INDEX", 0))
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", 1))
+SHARD_URLS = [u.strip() for u in os.environ.get("SHARD_URLS", "").split(",") if u.strip()]
+SHARD_TIMEOUT_MS = float(os.environ.get("SHARD_TIMEOUT_MS", 250))  # a slower shard is left out of the merge
+SHARD_POOL_SIZE = int(os.environ.get("SHARD_POOL_SIZE", 32))  # keep-alive connections per shard
+SHARD_REFRESH_MS = int(os.environ.get("SHARD_REFRESH_MS", 5000))  # coordinator polls shard sizes in the background
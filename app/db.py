@@ -0,0 +1,287 @@
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+import numpy as np
+from app.config import DB_PATH, LEGACY_DB_PATH, DB_POOL_SIZE, DB_BUSY_TIMEOUT_MS
+
+# One repository over the faces table for the API, Matcher, enrollment and
+# the gallery loader. Connections come from a small per-file pool (WAL, so
+# readers never wait for the writer), SQL text is constant so sqlite3's
+# per-connection statement cache keeps every query prepared, and writes go
+# in as one transaction per batch.
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS faces (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    embedding BLOB,
+    image_path TEXT,
+    added_on TEXT,
+    emb_row INTEGER,
+    content_hash TEXT,
+    meta_info TEXT
+)'''
+# append-only log of gallery mutations; its highest version is the gallery
+# version, and GalleryIndex.sync replays the entries after the one it has
+CHANGES_SCHEMA = '''CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    face_id INTEGER NOT NULL,
+    name TEXT,
+    emb_row INTEGER,
+    at TEXT
+)'''
+COLUMNS = {"emb_row": "INTEGER", "content_hash": "TEXT", "meta_info": "TEXT"}
+INDEXES = {
+    "idx_faces_content_hash": "faces(content_hash)",
+    "idx_faces_name": "faces(name)",
+    "idx_faces_added_on": "faces(added_on)",
+    "idx_faces_emb_row": "faces(emb_row)",
+}
+
+# faces.emb holds the rows searches read; the float32 BLOB next to each
+# emb_row is the durable copy open_store() refills a lost or cut store from
+INSERT_FACE = ("INSERT INTO faces (name, embedding, emb_row, image_path, added_on, content_hash) "
+               "VALUES (?, ?, ?, ?, datetime('now'), ?)")
+SELECT_GALLERY = "SELECT id, name, emb_row FROM faces WHERE emb_row IS NOT NULL ORDER BY emb_row"
+SELECT_FACE = "SELECT id, name, emb_row FROM faces WHERE id = ?"
+SELECT_NAMED = "SELECT id, name, emb_row FROM faces WHERE name = ? COLLATE NOCASE AND emb_row IS NOT NULL ORDER BY id"
+SELECT_LIST = "SELECT id, name, image_path, added_on FROM faces ORDER BY id"
+SELECT_HASHES = "SELECT content_hash FROM faces WHERE content_hash IS NOT NULL"
+SELECT_FACE_HASHES = "SELECT id, content_hash FROM faces"
+# a new emb_row makes the old BLOB stale: it is replaced, or dropped if no
+# embedding is given (emb_row IS ? is true for a rename, which keeps it)
+UPDATE_FACE = ("UPDATE faces SET name = ?, embedding = COALESCE(?, CASE WHEN emb_row IS ? THEN embedding END), "
+               "emb_row = ?, image_path = COALESCE(?, image_path) WHERE id = ?")
+DELETE_FACE = "DELETE FROM faces WHERE id = ?"
+# ops: add / update (new name and/or emb_row) / delete
+INSERT_CHANGE = "INSERT INTO changes (op, face_id, name, emb_row, at) VALUES (?, ?, ?, ?, datetime('now'))"
+SELECT_CHANGES = "SELECT version, op, face_id, name, emb_row FROM changes WHERE version > ? ORDER BY version"
+SELECT_CHANGES_PAGE = SELECT_CHANGES + " LIMIT ?"
+SELECT_VERSION = "SELECT COALESCE(MAX(version), 0) FROM changes"
+SELECT_REMOVALS = "SELECT 1 FROM changes WHERE version > ? AND op != 'add' LIMIT 1"
+
+
+def prepare_schema(conn, legacy_db=None):
+    """Create / upgrade the faces table and fold in the old SQLAlchemy
+    `identities` table (app/models.py), from this file or from legacy_db."""
+    conn.execute(SCHEMA)
+    conn.execute(CHANGES_SCHEMA)
+    cols = [c[1] for c in conn.execute("PRAGMA table_info(faces)")]
+    for col, kind in COLUMNS.items():
+        if col not in cols:
+            conn.execute(f"ALTER TABLE faces ADD COLUMN {col} {kind}")
+    for name, target in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    conn.commit()
+    migrate_identities(conn, "main")
+    if legacy_db and os.path.exists(legacy_db) and os.path.abspath(legacy_db) != _db_file(conn):
+        conn.execute("ATTACH DATABASE ? AS legacy", (legacy_db,))
+        try:
+            migrate_identities(conn, "legacy")
+        finally:
+            conn.execute("DETACH DATABASE legacy")
+
+
+def migrate_identities(conn, schema="main"):
+    # embeddings are copied as BLOBs; store.migrate_blob_embeddings copies them
+    # into the embedding file. The old table is renamed, not dropped.
+    found = conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name='identities'").fetchone()
+    if not found:
+        return 0
+    with conn:
+        cur = conn.execute(
+            f"INSERT INTO main.faces (name, embedding, image_path, added_on, meta_info) "
+            f"SELECT name, embedding, image_path, added_on, meta_info FROM {schema}.identities ORDER BY id"
+        )
+        conn.execute(f"ALTER TABLE {schema}.identities RENAME TO identities_migrated")
+    return cur.rowcount
+
+
+@contextlib.contextmanager
+def migration_lock(path):
+    """Exclusive across processes (flock on <db>.lock): schema upgrades and
+    data migrations run in one worker at a time, and the next one finds
+    them done. No-op where fcntl is missing."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _db_file(conn):
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == "main":
+            return os.path.abspath(path) if path else None
+
+
+class Database:
+    def __init__(self, path=DB_PATH, pool_size=DB_POOL_SIZE, busy_timeout_ms=DB_BUSY_TIMEOUT_MS, legacy_db=None):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._created = 0
+        self._lock = threading.Lock()
+        with migration_lock(path), self.connection() as conn:
+            prepare_schema(conn, legacy_db)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000.0,
+                               check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints; WAL keeps it consistent
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a pooled connection; blocks when all pool_size are in use."""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self._pool.maxsize
+                if create:
+                    self._created += 1
+            conn = self._connect() if create else self._pool.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+    # ---------- reads ----------
+    def gallery_rows(self):
+        with self.connection() as conn:
+            return conn.execute(SELECT_GALLERY).fetchall()
+
+    def gallery_snapshot(self):
+        """Gallery rows and the change-log version they reflect, read in one
+        transaction (WAL: writers carry on meanwhile)."""
+        with self.connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                return conn.execute(SELECT_GALLERY).fetchall(), conn.execute(SELECT_VERSION).fetchone()[0]
+            finally:
+                conn.commit()
+
+    def version(self):
+        with self.connection() as conn:
+            return conn.execute(SELECT_VERSION).fetchone()[0]
+
+    def changes_after(self, version, limit=None):
+        # versions follow commit order (one sqlite writer at a time), so
+        # everything committed after a reader saw `version` is in here;
+        # with `limit`, only the first that many (a page)
+        with self.connection() as conn:
+            if limit is None:
+                return conn.execute(SELECT_CHANGES, (int(version),)).fetchall()
+            return conn.execute(SELECT_CHANGES_PAGE, (int(version), int(limit))).fetchall()
+
+    def removals_after(self, version):
+        # any delete / update since `version`, i.e. gallery rows that moved
+        with self.connection() as conn:
+            return conn.execute(SELECT_REMOVALS, (int(version),)).fetchone() is not None
+
+    def face(self, face_id):
+        with self.connection() as conn:
+            return conn.execute(SELECT_FACE, (int(face_id),)).fetchone()
+
+    def faces_named(self, name):
+        with self.connection() as conn:
+            return conn.execute(SELECT_NAMED, (name,)).fetchall()
+
+    def list_faces(self):
+        with self.connection() as conn:
+            return conn.execute(SELECT_LIST).fetchall()
+
+    def known_hashes(self):
+        with self.connection() as conn:
+            return {r[0] for r in conn.execute(SELECT_HASHES)}
+
+    def face_hashes(self):
+        # {face id: content_hash or None}
+        with self.connection() as conn:
+            return dict(conn.execute(SELECT_FACE_HASHES).fetchall())
+
+    # ---------- writes ----------
+    def insert_faces(self, rows, embeddings=None):
+        """rows: [(name, emb_row, image_path, content_hash)], written in one
+        transaction, with embeddings[i] (the store row's vector) as row i's
+        BLOB. Returns the new ids in order."""
+        with self.connection() as conn, conn:
+            ids = []
+            for i, (name, emb_row, image_path, content_hash) in enumerate(rows):
+                blob = _blob(embeddings, i)
+                face_id = conn.execute(INSERT_FACE, (name, blob, emb_row, image_path, content_hash)).lastrowid
+                conn.execute(INSERT_CHANGE, ("add", face_id, name, emb_row))
+                ids.append(face_id)
+            return ids
+
+    def insert_face(self, name, emb_row, image_path, content_hash=None, embedding=None):
+        return self.insert_faces([(name, emb_row, image_path, content_hash)],
+                                 None if embedding is None else [embedding])[0]
+
+    def update_faces(self, rows, embeddings=None):
+        """rows: [(face_id, name, emb_row, image_path or None)] (rename / new
+        embedding), one transaction; embeddings as for insert_faces.
+        Returns the ids that existed."""
+        with self.connection() as conn, conn:
+            done = []
+            for i, (face_id, name, emb_row, image_path) in enumerate(rows):
+                blob = _blob(embeddings, i)
+                if conn.execute(UPDATE_FACE, (name, blob, emb_row, emb_row, image_path, face_id)).rowcount:
+                    conn.execute(INSERT_CHANGE, ("update", face_id, name, emb_row))
+                    done.append(face_id)
+            return done
+
+    def delete_faces(self, face_ids):
+        with self.connection() as conn, conn:
+            done = []
+            for face_id in face_ids:
+                if conn.execute(DELETE_FACE, (int(face_id),)).rowcount:
+                    conn.execute(INSERT_CHANGE, ("delete", int(face_id), None, None))
+                    done.append(int(face_id))
+            return done
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def _blob(embeddings, i):
+    return None if embeddings is None else np.asarray(embeddings[i], dtype=np.float32).tobytes()
+
+
+def open_db(path=DB_PATH):
+    """The process-wide Database (and pool) for `path`. The configured
+    DB_PATH also absorbs LEGACY_DB_PATH's identities table."""
+    key = os.path.abspath(path)
+    with _databases_lock:
+        if key not in _databases:
+            legacy = LEGACY_DB_PATH if key == os.path.abspath(DB_PATH) else None
+            _databases[key] = Database(path, legacy_db=legacy)
+        return _databases[key]
+
+
+def as_db(db):
+    # most callers take either a path or a Database
+    return db if isinstance(db, Database) else open_db(db)
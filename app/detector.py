@@ -1,5 +1,7 @@
-from app.config import DEVICE, DETECTOR_BACKEND
+from app.config import DEVICE, DETECTOR_BACKEND, DETECT_MAX_SIDE
+import cv2
 import numpy as np
+from app.metrics import timer, inc
 
 # Option A: MTCNN via facenet-pytorch (good for prototype)
 try:
@@ -29,21 +31,39 @@ class Detector:
         else:
             raise ValueError("Unknown backend")
 
-    def detect(self, img_bgr):
-        # img_bgr: numpy BGR img
+    def detect(self, img_bgr, max_side=DETECT_MAX_SIDE):
+        # img_bgr: numpy BGR img. Large frames are detected at max_side and
+        # the boxes scaled back to full resolution.
+        h, w = img_bgr.shape[:2]
+        with timer("detect"):
+            if max_side and max(h, w) > max_side:
+                r = max_side / max(h, w)
+                small = cv2.resize(img_bgr, (int(w * r), int(h * r)), interpolation=cv2.INTER_AREA)
+                out = self._detect(small)
+                for d in out:
+                    d["box"] = [v / r for v in d["box"]]
+                    if d.get("landmarks") is not None:
+                        d["landmarks"] = [[x / r, y / r] for x, y in d["landmarks"]]
+            else:
+                out = self._detect(img_bgr)
+        inc("faces_detected_total", len(out))
+        return out
+
+    def _detect(self, img_bgr):
         if self.backend == "mtcnn":
-            boxes, probs = self.det.detect(img_bgr[..., ::-1])  # MTCNN expects RGB
+            boxes, probs, points = self.det.detect(img_bgr[..., ::-1], landmarks=True)  # MTCNN expects RGB
             if boxes is None:
                 return []
             out = []
-            for b, p in zip(boxes, probs):
+            for b, p, pts in zip(boxes, probs, points):
                 x1,y1,x2,y2 = map(float, b)
-                out.append({"box": [x1,y1,x2,y2], "score": float(p)})
+                out.append({"box": [x1,y1,x2,y2], "score": float(p), "landmarks": pts.tolist()})
             return out
         else:
             faces = self.det.get(img_bgr[..., ::-1])  # insightface expects RGB
             out = []
             for f in faces:
                 x1,y1,x2,y2 = f.bbox.astype(float)
-                out.append({"box": [float(x1),float(y1),float(x2),float(y2)], "score": float(f.det_score)})
+                kps = f.kps.tolist() if getattr(f, "kps", None) is not None else None
+                out.append({"box": [float(x1),float(y1),float(x2),float(y2)], "score": float(f.det_score), "landmarks": kps})
             return out
@@ -1,5 +1,6 @@
 import numpy as np
-from app.config import DEVICE, EMBEDDER_BACKEND
+from app.metrics import timer
+from app.config import DEVICE, EMBEDDER_BACKEND, ONNX_MODEL_PATH, ONNX_INT8_MODEL_PATH, ORT_INTRA_THREADS, ORT_INTER_THREADS
 # Option A: facenet-pytorch InceptionResnetV1
 try:
     from facenet_pytorch import InceptionResnetV1
@@ -11,45 +12,91 @@ try:
     from insightface.app import FaceAnalysis
 except Exception:
     FaceAnalysis = None
+# Option C: InceptionResnetV1 exported to ONNX (tools/convert_onnx.py), run by onnxruntime
+try:
+    import onnxruntime as ort
+except Exception:
+    ort = None
+
+def make_ort_session(model_path, intra_threads=ORT_INTRA_THREADS, inter_threads=ORT_INTER_THREADS):
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    opts.intra_op_num_threads = intra_threads
+    opts.inter_op_num_threads = inter_threads
+    return ort.InferenceSession(model_path, sess_options=opts, providers=["CPUExecutionProvider"])
+
+# crop size and (x - mean) / std standardization each backend's network
+# takes, as (N, 3, size, size) RGB float32
+INPUT_SPECS = {
+    "facenet": (160, 127.5, 128.0),
+    "onnx": (160, 127.5, 128.0),
+    "onnx-int8": (160, 127.5, 128.0),
+    "insightface": (112, 127.5, 127.5),  # ArcFace, 5-point aligned crops
+}
 
 class Embedder:
     def __init__(self, backend="facenet"):
         self.backend = backend
+        if backend in INPUT_SPECS:
+            self.size, self.mean, self.std = INPUT_SPECS[backend]
         if backend == "facenet":
             if InceptionResnetV1 is None:
                 raise RuntimeError("facenet-pytorch not installed")
-            self.net = InceptionResnetV1(pretrained='vggface2').eval().to(DEVICE)
+            from app.model_loader import load_facenet
+            self.net = load_facenet(DEVICE)
         elif backend == "insightface":
             if FaceAnalysis is None:
                 raise RuntimeError("insightface not installed")
-            self.net = FaceAnalysis(allowed_modules=['recognition'])
-            self.net.prepare(ctx_id=0)
+            # FaceAnalysis insists on a detection model; it is loaded but only
+            # app/pipeline.py uses it. Crops go straight to the ArcFace session.
+            self.net = FaceAnalysis(allowed_modules=['detection', 'recognition'], providers=['CPUExecutionProvider'])
+            self.net.prepare(ctx_id=0, det_thresh=0.5)
+            self.rec = self.net.models['recognition']
+        elif backend in ("onnx", "onnx-int8"):
+            if ort is None:
+                raise RuntimeError("onnxruntime not installed. pip install onnxruntime")
+            # onnx-int8: post-training quantized graph from tools/quantize_int8.py
+            self.net = make_ort_session(ONNX_INT8_MODEL_PATH if backend == "onnx-int8" else ONNX_MODEL_PATH)
+            self.input_name = self.net.get_inputs()[0].name
         else:
             raise ValueError("Unknown backend")
 
-    def get_embedding(self, face_img_rgb):
-        # face_img_rgb: numpy HWC RGB normalized to [0,1] or preprocessed depending
+    def get_embeddings(self, faces):
+        # faces: (N, 3, size, size) float32 CHW batch, already standardized
+        # (INPUT_SPECS) -> (N, 512) unit rows
+        with timer("embed"):
+            return self._get_embeddings(faces)
+
+    def _get_embeddings(self, faces):
         if self.backend == "facenet":
             import torch
+            with torch.no_grad():
+                embs = self.net(torch.as_tensor(faces, dtype=torch.float32).to(DEVICE)).cpu().numpy()
+        elif self.backend in ("onnx", "onnx-int8"):
+            embs = self.net.run(None, {self.input_name: np.ascontiguousarray(faces, dtype=np.float32)})[0]
+        else:
+            embs = self.rec.session.run(self.rec.output_names,
+                                        {self.rec.input_name: np.ascontiguousarray(faces, dtype=np.float32)})[0]
+        return embs / np.linalg.norm(embs, axis=1, keepdims=True)
+
+    def get_embedding(self, face_img_rgb):
+        # every path goes through get_embeddings once, which times "embed"
+        # face_img_rgb: numpy HWC RGB normalized to [0,1] or preprocessed depending
+        if self.backend in ("facenet", "onnx", "onnx-int8"):
             # expecting CHW tensor
             if len(face_img_rgb.shape)==3 and face_img_rgb.shape[2]==3:
                 # HWC -> CHW
                 x = np.transpose(face_img_rgb, (2,0,1))
             else:
                 x = face_img_rgb
-            x = torch.tensor(x, dtype=torch.float32).unsqueeze(0).to(DEVICE)
-            with torch.no_grad():
-                emb = self.net(x)
-            emb = emb.cpu().numpy().astype(np.float32).reshape(-1)
-            # L2 normalize
-            emb = emb / np.linalg.norm(emb)
-            return emb
+            # L2 normalized
+            return self.get_embeddings(np.asarray(x, dtype=np.float32)[None])[0]
         else:
-            # insightface extraction expects BGR or RGB depending; show example
-            # Here we expect a HWC RGB uint8 image
-            faces = self.net.get(np.asarray(face_img_rgb))
-            if len(faces)==0:
-                return None
-            emb = faces[0].embedding
-            emb = emb / np.linalg.norm(emb)
-            return emb
+            # HWC RGB uint8 crop, already aligned (app/align.py); no detection here
+            import cv2
+            from app.align import to_model_input
+            face = np.asarray(face_img_rgb)
+            if face.shape[:2] != (self.size, self.size):
+                face = cv2.resize(face, (self.size, self.size))
+            return self.get_embeddings(to_model_input(face[None], bgr=False, mean=self.mean, std=self.std))[0]
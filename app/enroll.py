@@ -0,0 +1,207 @@
+import collections
+import hashlib
+import multiprocessing
+import os
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from app.db import as_db
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+# Bulk enrollment: decode + detection in a process pool, embed in large
+# batches, one transaction per chunk. Every face row carries
+# the sha256 of its source file, so an interrupted run resumes by skipping
+# hashes that are already in the table.
+
+
+def name_from_filename(filename):
+    # gallery_images/<name>_<anything>.jpg
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    name = stem.rsplit("_", 1)[0] if "_" in stem else stem
+    return " ".join(name.split())
+
+
+def iter_sources(path):
+    """(image_path, name, payload) for a directory tree, .zip or .tar(.gz).
+    payload is None for files on disk (workers read them) or the member bytes."""
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for f in sorted(files):
+                if f.lower().endswith(IMAGE_EXTS):
+                    yield os.path.join(root, f), name_from_filename(f), None
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTS):
+                    yield info.filename, name_from_filename(info.filename), zf.read(info)
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as tf:
+            for m in tf:
+                if m.isfile() and m.name.lower().endswith(IMAGE_EXTS):
+                    yield m.name, name_from_filename(m.name), tf.extractfile(m).read()
+    else:
+        raise ValueError(f"{path} is not a directory, zip or tar archive")
+
+
+# ---------- pool workers ----------
+_pipeline = None
+_skip = frozenset()
+
+def _init_worker(skip_hashes):
+    global _pipeline, _skip
+    import torch
+    from app.pipeline import FacePipeline
+    torch.set_num_threads(1)  # one process per core instead
+    _pipeline = FacePipeline(embedder=None)  # detection + crops only
+    _skip = skip_hashes
+
+def _detect(job):
+    image_path, name, payload = job
+    if payload is None:
+        with open(image_path, "rb") as f:
+            payload = f.read()
+    digest = hashlib.sha256(payload).hexdigest()
+    if digest in _skip:
+        return image_path, name, digest, None, "known"
+    try:
+        faces = _pipeline.find_faces(payload)
+    except Exception:
+        # any decode failure (truncated file, DecompressionBombError,
+        # cv2.error, ...) is one bad image, not the end of the run
+        return image_path, name, digest, None, "unreadable"
+    if not len(faces):
+        return image_path, name, digest, None, "no_face"
+    return image_path, name, digest, _pipeline.crop(faces, [faces.largest()])[0], "ok"
+
+
+def enroll(source, db, store, embed_fn, workers=None, batch_size=64, chunk=4096,
+           save_dir=None, on_rows=None, progress=print, accept_name=None):
+    """Enroll every image under `source` (dir or archive).
+
+    embed_fn maps an (N, 3, S, S) float32 array of FacePipeline crops to
+    (N, 512) embeddings (FacePipeline.embed).
+    db is a path or app.db.Database. Archive members are written to save_dir (default: not kept). on_rows is
+    called with [(id, name, emb_row, embedding)] after each committed chunk.
+    accept_name (name -> bool), if given, picks the identities to enroll;
+    the other images are counted as "skipped" and never decoded.
+    Returns counts per outcome."""
+    db = as_db(db)
+    skip = frozenset(db.known_hashes())
+    counts = {"ok": 0, "known": 0, "duplicate": 0, "no_face": 0, "unreadable": 0}
+    if accept_name is not None:
+        counts["skipped"] = 0
+    seen = set()
+    pending = []
+
+    def flush():
+        if not pending:
+            return
+        crops = np.stack([p[3] for p in pending]).astype(np.float32)
+        embs = np.concatenate([embed_fn(crops[i:i + batch_size]) for i in range(0, len(crops), batch_size)])
+        rows = []
+
+        def commit(start):
+            rows.extend((name, start + i, image_path, digest) for i, (image_path, name, digest, _) in enumerate(pending))
+            return db.insert_faces(rows, embs)
+        _, ids = store.append_committed(embs, commit)
+        if on_rows is not None:
+            on_rows([(face_id, row[0], row[1], embs[i]) for i, (face_id, row) in enumerate(zip(ids, rows))])
+        counts["ok"] += len(pending)
+        progress(f"enrolled {counts['ok']} faces ({sum(counts.values())} images seen)")
+        pending.clear()
+
+    def accepted(jobs):
+        for job in jobs:
+            if accept_name(job[1]):
+                yield job
+            else:
+                counts["skipped"] += 1
+
+    jobs = iter_sources(source) if accept_name is None else accepted(iter_sources(source))
+    # spawn: forking a process that already runs torch threads can deadlock
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(skip,)) as pool:
+        window = 16 * (workers or os.cpu_count() or 1)
+        for job, (image_path, name, digest, face, status) in _bounded_map(pool, _detect, jobs, window):
+            if status != "ok":
+                counts[status] += 1
+                continue
+            if digest in seen:
+                counts["duplicate"] += 1
+                continue
+            seen.add(digest)
+            if job[2] is not None and save_dir is not None:
+                image_path = _save_member(save_dir, name, digest, image_path, job[2])
+            pending.append((image_path, name, digest, face))
+            if len(pending) >= chunk:
+                flush()
+        flush()
+    return counts
+
+
+def enroll_aligned(path, db, store, pipeline, batch_size=64, chunk=4096, on_rows=None, progress=print):
+    """Enroll an aligned array file from data_prep/align.py: crops are
+    already cut, so there is no decode or detection, only embedding.
+    Same arguments and counts as enroll(), with the FacePipeline that
+    embeds in place of embed_fn; the file must hold the crops it would
+    cut (app.align.check_aligned raises ValueError otherwise)."""
+    from app.align import load_aligned, check_aligned, to_model_input
+    db = as_db(db)
+    faces, meta = load_aligned(path)
+    check_aligned(faces, meta, pipeline)
+    embed_fn, mean, std = pipeline.embed, pipeline.mean, pipeline.std
+    skip = frozenset(db.known_hashes())
+    seen = set()
+    counts = {"ok": 0, "known": 0, "duplicate": 0}
+    buf = np.empty((batch_size, 3) + faces.shape[1:3], dtype=np.float32)
+    for s in range(0, len(faces), chunk):
+        rows = []
+        for i in range(s, min(s + chunk, len(faces))):
+            digest = str(meta["hashes"][i])
+            if digest in skip or digest in seen:
+                counts["known" if digest in skip else "duplicate"] += 1
+                continue
+            seen.add(digest)
+            rows.append(i)
+        if not rows:
+            continue
+        # batch_size crops at a time, standardized into one reused buffer
+        embs = np.concatenate([embed_fn(to_model_input(faces[rows[b:b + batch_size]], out=buf, mean=mean, std=std))
+                               for b in range(0, len(rows), batch_size)])
+        db_rows = []
+
+        def commit(start):
+            db_rows.extend((str(meta["names"][i]), start + j, str(meta["paths"][i]), str(meta["hashes"][i]))
+                           for j, i in enumerate(rows))
+            return db.insert_faces(db_rows, embs)
+        _, ids = store.append_committed(embs, commit)
+        if on_rows is not None:
+            on_rows([(face_id, row[0], row[1], embs[j]) for j, (face_id, row) in enumerate(zip(ids, db_rows))])
+        counts["ok"] += len(rows)
+        progress(f"enrolled {counts['ok']} faces ({sum(counts.values())} rows seen)")
+    return counts
+
+
+def _bounded_map(pool, fn, jobs, window):
+    # like pool.map, but only `window` jobs (and their bytes) in flight at once
+    inflight = collections.deque()
+    for job in jobs:
+        inflight.append((job, pool.submit(fn, job)))
+        if len(inflight) >= window:
+            job, fut = inflight.popleft()
+            yield job, fut.result()
+    while inflight:
+        job, fut = inflight.popleft()
+        yield job, fut.result()
+
+
+def _save_member(save_dir, name, digest, member, payload):
+    # archive members get a gallery file like /add_identity writes
+    os.makedirs(save_dir, exist_ok=True)
+    out = os.path.join(save_dir, f"{name}_{digest[:16]}{os.path.splitext(member)[1].lower()}")
+    if not os.path.exists(out):
+        with open(out, "wb") as f:
+            f.write(payload)
+    return out
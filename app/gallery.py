@@ -0,0 +1,436 @@
+import os
+import threading
+import numpy as np
+from app.config import EMBED_DIM, GALLERY_COMPACT_MIN, GALLERY_COMPACT_RATIO
+from app.db import as_db
+from app.index import FlatIndex
+
+LIVE = np.iinfo(np.int64).max  # _deleted_at of a row that was never deleted
+DEAD = 0  # _deleted_at of a row dead in every snapshot (store mode: never searched)
+
+
+class GallerySnapshot:
+    """What a reader searches: the first n rows as of gallery `version`.
+    Rows appended or tombstoned after it was taken don't change its results."""
+    __slots__ = ("version", "n", "embs", "sq_norms", "ids", "names", "deleted_at", "tombstones", "dead", "index")
+
+    def __init__(self, version, n, embs, sq_norms, ids, names, deleted_at, tombstones, dead, index):
+        self.version = version
+        self.n = n
+        self.embs = embs
+        self.sq_norms = sq_norms
+        self.ids = ids
+        self.names = names
+        self.deleted_at = deleted_at
+        self.tombstones = tombstones
+        self.dead = dead
+        self.index = index
+
+    def __len__(self):
+        return self.n - self.tombstones - self.dead
+
+    def search(self, query, k=5):
+        return self.search_batch(np.asarray(query, dtype=np.float32).reshape(1, -1), k)[0]
+
+    def search_batch(self, queries, k=5):
+        n = self.n
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.embs.shape[1])
+        if n == 0:
+            return [[] for _ in queries]
+        # backends don't know about tombstones: ask for enough extra rows
+        # (dead rows are out of the index, or at an infinite distance)
+        fetch = k + self.tombstones
+        results = []
+        # embs holds the first n rows, so the backend returns none appended since
+        for rows, d2 in self.index.search(self.embs, self.sq_norms, queries, fetch):
+            if self.tombstones or self.dead:
+                keep = self.deleted_at[rows] > self.version
+                rows, d2 = rows[keep], d2[keep]
+            rows, d2 = rows[:k], d2[:k]
+            dists = np.sqrt(np.maximum(d2, 0.0))
+            results.append([
+                {"id": int(self.ids[r]), "name": self.names[r], "distance": float(d)}
+                for r, d in zip(rows, dists)
+            ])
+        return results
+
+
+class GalleryIndex:
+    """Resident copy of the gallery: a contiguous float32 (N, EMBED_DIM) matrix
+    plus parallel id/name arrays, loaded once and kept current by replaying
+    the faces change log (app/db.py) in O(changes).
+
+    Deleted and replaced faces become tombstones (their row stays, marked
+    with the version that removed it) until compact() drops them. When the
+    rows map one-to-one onto an EmbeddingStore file, the matrix is the
+    store's memmap itself rather than a private copy, for good: there rows
+    are never dropped, compaction and loading mark them dead instead (out
+    of the index, infinite norm, DEAD in every snapshot)."""
+
+    def __init__(self, dim=EMBED_DIM, capacity=1024, index=None, index_factory=None):
+        self.dim = dim
+        # index_factory builds a fresh backend, so compaction can index off the lock
+        self.index_factory = index_factory
+        self.index = index if index is not None else (index_factory() if index_factory else FlatIndex())
+        self.store = None
+        self._embs = np.empty((capacity, dim), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._names = np.empty(capacity, dtype=object)
+        self._deleted_at = np.full(capacity, LIVE, dtype=np.int64)
+        self._size = 0
+        self._tombstones = 0
+        self._dead = 0  # store mode: rows kept in the matrix but never searched
+        self._row_of = None  # face id -> row, built on the first delete / update
+        self.version = 0  # change-log version the gallery reflects
+        self._compacting = False
+        # writers serialize on the lock; readers take a snapshot of the first
+        # _size rows, which an append never modifies in place
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def __len__(self):
+        return self._size - self._tombstones - self._dead
+
+    def _live(self, arr):
+        n = self._size
+        return arr[:n] if not (self._tombstones or self._dead) else arr[:n][self._deleted_at[:n] == LIVE]
+
+    @property
+    def embeddings(self):
+        return self._live(self._embs)
+
+    @property
+    def ids(self):
+        return self._live(self._ids)
+
+    @property
+    def names(self):
+        return self._live(self._names)
+
+    @property
+    def tombstones(self):
+        return self._tombstones
+
+    def load_from_db(self, db, store, index_path=None):
+        db = as_db(db)
+        rows, version = db.gallery_snapshot()
+
+        ids = np.array([r[0] for r in rows], dtype=np.int64)
+        emb_rows = np.array([r[2] for r in rows], dtype=np.int64)
+        names = [r[1] for r in rows]
+        view = store.view()
+        if len(emb_rows) and emb_rows.max() >= len(view):
+            # faces.emb lost rows open_store() had no BLOB to refill them from
+            lost = int(np.count_nonzero(emb_rows >= len(view)))
+            raise RuntimeError(f"{store.path}: {lost} faces point past its {len(view)} rows; "
+                               f"restore the file or re-enroll them")
+        gaps = len(view) - len(rows)
+        # store rows whose face was deleted stay in the memmap as dead rows
+        zero_copy = (store.dtype == np.float32
+                     and (len(rows) == 0 or (emb_rows[-1] < len(view) and np.all(np.diff(emb_rows) > 0))))
+        dead = None
+        if zero_copy and gaps:
+            full_ids = np.full(len(view), -1, dtype=np.int64)
+            full_ids[emb_rows] = ids
+            full_names = np.empty(len(view), dtype=object)
+            full_names[emb_rows] = names
+            dead = np.ones(len(view), dtype=bool)
+            dead[emb_rows] = False
+            ids, names = full_ids, full_names
+        embs = view if zero_copy else np.asarray(view[emb_rows], dtype=np.float32)
+        self.set(ids, names, embs, build_index=False, store=store if zero_copy else None,
+                 version=version, dead=dead)
+        if index_path is None or not self._index_file_usable(db, index_path):
+            with self._lock:
+                self._build_index(self._size)
+            if index_path is not None:
+                self.save_index(index_path)
+        else:
+            self.load_index(index_path)
+        return self
+
+    def set(self, ids, names, embs, build_index=True, store=None, version=0, dead=None, index=None):
+        """Replace the whole gallery. `dead` marks rows that are dead from
+        the start (store mode only); `index`, if given, is already built
+        over embs."""
+        n = len(ids)
+        with self._lock:
+            cap = max(1024, 1 << max(n - 1, 0).bit_length())
+            self.store = store
+            if store is not None:
+                self._embs = embs
+            else:
+                self._embs = np.empty((cap, self.dim), dtype=np.float32)
+                self._embs[:n] = embs
+            self._sq_norms = np.empty(cap, dtype=np.float32)
+            self._ids = np.empty(cap, dtype=np.int64)
+            self._names = np.empty(cap, dtype=object)
+            self._deleted_at = np.full(cap, LIVE, dtype=np.int64)
+            self._sq_norms[:n] = np.einsum("ij,ij->i", self._embs[:n], self._embs[:n])
+            self._ids[:n] = ids
+            self._names[:n] = names
+            self._tombstones = 0
+            self._dead = 0
+            if dead is not None:
+                rows = np.flatnonzero(dead)
+                self._deleted_at[rows] = DEAD
+                self._sq_norms[rows] = np.inf
+                self._dead = len(rows)
+            self._size = n
+            self._row_of = None
+            self.version = int(version)
+            if index is not None:
+                self.index = index
+            elif build_index:
+                self._build_index(n)
+        return self
+
+    def _build_index(self, n):
+        # identity-template backends also need each row's name
+        if getattr(self.index, "labelled", False):
+            self.index.build(self._embs[:n], self._names[:n])
+        else:
+            self.index.build(self._embs[:n])
+        if self._dead:
+            self.index.remove(self._dead_rows())
+
+    def _dead_rows(self):
+        return np.flatnonzero(self._deleted_at[:self._size] == DEAD)
+
+    def _bury(self, rows):
+        # caller holds _lock; store mode. Rows stay in the mapped matrix but
+        # leave every search: fresh arrays, so snapshots already taken keep
+        # seeing what they saw.
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return 0
+        tombstones = int(np.count_nonzero(self._deleted_at[rows] != DEAD))
+        deleted_at, sq_norms = self._deleted_at.copy(), self._sq_norms.copy()
+        deleted_at[rows] = DEAD
+        sq_norms[rows] = np.inf
+        self._deleted_at, self._sq_norms = deleted_at, sq_norms
+        self.index.remove(rows)
+        self._tombstones -= tombstones
+        self._dead += len(rows)
+        return len(rows)
+
+    def _grow(self, needed):
+        cap = self._ids.shape[0]
+        while cap < needed:
+            cap *= 2
+        # fresh arrays so snapshots held by concurrent readers stay valid
+        attrs = ("_sq_norms", "_ids", "_names", "_deleted_at") if self.store is not None else ("_embs", "_sq_norms", "_ids", "_names", "_deleted_at")
+        for attr in attrs:
+            old = getattr(self, attr)
+            new = np.empty((cap,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, attr, new)
+        self._deleted_at[self._size:] = LIVE
+
+    def _detach(self):
+        # stop reading the store file; continue from a private copy
+        embs = np.empty((self._ids.shape[0], self.dim), dtype=np.float32)
+        embs[:self._size] = self._embs[:self._size]
+        self._embs = embs
+        self.store = None
+
+    def _pad(self, row):
+        # caller holds _lock. Store rows before `row` that no face points at
+        # (a write that failed after its append) become dead placeholders, so
+        # gallery rows keep matching store rows.
+        n = self._size
+        if row > self._ids.shape[0]:
+            self._grow(row)
+        view = self.store.view()
+        gap = np.asarray(view[n:row], dtype=np.float32)
+        self._embs = view
+        self._sq_norms[n:row] = np.einsum("ij,ij->i", gap, gap)
+        self._ids[n:row] = -1
+        self._names[n:row] = None
+        self._deleted_at[n:row] = LIVE
+        if not getattr(self.index, "labelled", False):
+            # positional backends need an entry per row
+            for r in range(n, row):
+                self.index.add(r, gap[r - n])
+        self._size = row
+        self._bury(np.arange(n, row))
+
+    def _append(self, face_id, name, emb, row):
+        # caller holds _lock. Store rows are committed in order
+        # (EmbeddingStore.append_committed), so in zero-copy mode row >= n.
+        emb = np.asarray(emb, dtype=np.float32).reshape(self.dim)
+        if self.store is not None and row is not None and row > self._size:
+            self._pad(row)
+        n = self._size
+        if self.store is not None and row != n:
+            self._detach()
+        if n == self._ids.shape[0]:
+            self._grow(n + 1)
+        if self.store is not None:
+            self._embs = self.store.view()
+        else:
+            self._embs[n] = emb
+        self._sq_norms[n] = emb @ emb
+        self._ids[n] = face_id
+        self._names[n] = name
+        if getattr(self.index, "labelled", False):
+            self.index.add(n, emb, label=name)
+        else:
+            self.index.add(n, emb)
+        if self._row_of is not None:
+            self._row_of[int(face_id)] = n
+        self._size = n + 1
+
+    def _tombstone(self, face_id, version):
+        # caller holds _lock; returns False for faces this gallery never had
+        if self._row_of is None:
+            n = self._size
+            live = self._deleted_at[:n] == LIVE
+            self._row_of = dict(zip(self._ids[:n][live].tolist(), np.flatnonzero(live).tolist()))
+        row = self._row_of.pop(int(face_id), None)
+        if row is None:
+            return False
+        self._deleted_at[row] = version
+        self._tombstones += 1
+        if getattr(self.index, "labelled", False):
+            # identity templates drop the row now, not at compaction
+            self.index.remove([row])
+        return True
+
+    def add(self, face_id, name, emb, row=None, version=None):
+        """Append one face. `row` is its row in the backing store, if any;
+        the caller has already written it there."""
+        with self._lock:
+            self._append(face_id, name, emb, row)
+            if version is not None:
+                self.version = max(self.version, int(version))
+
+    def apply(self, changes, view):
+        """Replay change-log entries (version, op, face_id, name, emb_row)
+        in order; `view` is the store's matrix. Each entry becomes visible
+        to new snapshots atomically."""
+        for version, op, face_id, name, emb_row in changes:
+            if version <= self.version:
+                continue
+            with self._lock:
+                if op in ("update", "delete"):
+                    self._tombstone(face_id, version)
+                if op in ("add", "update") and emb_row is not None:
+                    self._append(face_id, name, view[emb_row], emb_row)
+                self.version = int(version)
+
+    def sync(self, db, store):
+        """Pull changes committed (by this or any other worker process) since
+        the gallery's version. Returns how many were applied."""
+        with self._sync_lock:
+            changes = as_db(db).changes_after(self.version)
+            if not changes:
+                return 0
+            # read after the changes: their store rows are written before the commit
+            self.apply(changes, store.view())
+        self.maybe_compact()
+        return len(changes)
+
+    def _compact_threshold(self, n):
+        return max(GALLERY_COMPACT_MIN, int(GALLERY_COMPACT_RATIO * n))
+
+    def maybe_compact(self):
+        # in the background: searches carry on over the current arrays
+        if self._tombstones <= self._compact_threshold(self._size) or self._compacting:
+            return False
+        self._compacting = True
+        threading.Thread(target=self.compact, name="gallery-compact", daemon=True).start()
+        return True
+
+    def compact(self):
+        """Drop tombstoned rows and rebuild the index over the live ones.
+        Change replay waits meanwhile; readers don't. In store mode the rows
+        stay mapped and are marked dead instead, no private copy."""
+        try:
+            with self._sync_lock:
+                with self._lock:
+                    n = self._size
+                    if not self._tombstones:
+                        return 0
+                    if self.store is not None:
+                        deleted_at = self._deleted_at[:n]
+                        return self._bury(np.flatnonzero((deleted_at != LIVE) & (deleted_at != DEAD)))
+                    live = np.flatnonzero(self._deleted_at[:n] == LIVE)
+                    embs = np.asarray(self._embs[live], dtype=np.float32)
+                    ids, names, version = self._ids[live], self._names[live], self.version
+                    dropped = n - len(live)
+                index = None
+                if self.index_factory is not None:
+                    index = self.index_factory()
+                    if getattr(index, "labelled", False):
+                        index.build(embs, names)
+                    else:
+                        index.build(embs)
+                # without a factory the old index object is rebuilt under the lock
+                self.set(ids, names, embs, build_index=index is None, version=version, index=index)
+                return dropped
+        finally:
+            self._compacting = False
+
+    def _index_file_usable(self, db, path):
+        """A saved index addresses rows by position. It still fits if it was
+        written over store-aligned rows and they are store-aligned again, or
+        if no face was deleted or replaced since it was written."""
+        try:
+            with open(f"{path}.version") as f:
+                saved_version, aligned = (int(v) for v in f.read().split())
+        except (OSError, ValueError):
+            return False
+        if saved_version > self.version:
+            return False
+        if aligned:
+            return self.store is not None
+        return not self._tombstones and not db.removals_after(saved_version)
+
+    def save_index(self, path):
+        # several worker processes may save at shutdown: write aside, then rename
+        with self._lock:
+            aligned = self.store is not None
+            if self._tombstones and not aligned:
+                return  # row positions won't survive a reload; rebuilt at startup
+            tmp = f"{path}.{os.getpid()}.tmp"
+            self.index.save(tmp)
+            version = self.version
+        if os.path.exists(tmp):
+            os.replace(tmp, path)
+            with open(f"{tmp}.version", "w") as f:
+                f.write(f"{version} {int(aligned)}\n")
+            os.replace(f"{tmp}.version", f"{path}.version")
+
+    def load_index(self, path):
+        """Restore a persisted search index, indexing any rows added after it
+        was saved; rebuilds from the matrix when the file is missing or stale."""
+        with self._lock:
+            n = self._size
+            indexed = self.index.load(path, n)
+            if indexed is None:
+                self._build_index(n)
+                self.index.save(path)
+                return self
+            for row in range(indexed, n):
+                if getattr(self.index, "labelled", False):
+                    self.index.add(row, self._embs[row], label=self._names[row])
+                else:
+                    self.index.add(row, self._embs[row])
+            if self._dead:
+                self.index.remove(self._dead_rows())
+        return self
+
+    def snapshot(self):
+        with self._lock:
+            n = self._size
+            return GallerySnapshot(self.version, n, self._embs[:n], self._sq_norms[:n], self._ids[:n],
+                                   self._names[:n], self._deleted_at, self._tombstones, self._dead, self.index)
+
+    def search(self, query, k=5):
+        """Top-k gallery rows by L2 distance, closest first."""
+        return self.snapshot().search(query, k)
+
+    def search_batch(self, queries, k=5):
+        return self.snapshot().search_batch(queries, k)
@@ -0,0 +1,351 @@
+import os
+import threading
+import time
+import numpy as np
+from app.config import INDEX_BACKEND, QUANTIZATION, IVF_NLIST, IVF_NPROBE, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH
+
+# Optional: hnswlib graph index (pip install hnswlib)
+try:
+    import hnswlib
+except Exception:
+    hnswlib = None
+
+# Search backends for GalleryIndex. They address gallery rows by position
+# (0..N-1) and, except for hnsw, read vectors straight from the gallery
+# matrix that is passed in, so the embeddings are never held twice.
+#
+# search() only ever returns rows < len(embs): a GallerySnapshot passes the
+# first n rows while the live gallery keeps adding to the same backend.
+# remove(rows) takes rows out for good (the gallery's dead rows, which also
+# get an infinite squared norm, so scans that can't skip them rank them last).
+
+
+def _topk(d2, rows, k):
+    k = min(k, len(rows))
+    if k == 0:
+        return rows[:0], d2[:0]
+    idx = np.argpartition(d2, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+    idx = idx[np.argsort(d2[idx])]
+    return rows[idx], d2[idx]
+
+
+def nearest_centroid(x, centroids, block=8192):
+    c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    out = np.empty(len(x), dtype=np.int64)
+    for s in range(0, len(x), block):
+        out[s:s + block] = np.argmin(c_sq - 2.0 * (x[s:s + block] @ centroids.T), axis=1)
+    return out
+
+
+def kmeans(x, k, iters=20, seed=0, max_points=256 * 1024):
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    if len(x) > max_points:
+        x = x[rng.choice(len(x), max_points, replace=False)]
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = nearest_centroid(x, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centroids[filled] = np.add.reduceat(x[order], starts, axis=0) / counts[filled, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            # re-seed dead centroids on random points
+            centroids[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+    return centroids
+
+
+class FlatIndex:
+    """Exact brute-force search over the gallery matrix."""
+    name = "flat"
+
+    def build(self, embs):
+        pass
+
+    def add(self, row, emb):
+        pass
+
+    def remove(self, rows):
+        pass  # dead rows have an infinite norm
+
+    def search(self, embs, sq_norms, queries, k):
+        rows = np.arange(len(embs))
+        d2 = sq_norms[None, :] - 2.0 * (queries @ embs.T) + np.einsum("ij,ij->i", queries, queries)[:, None]
+        return [_topk(d, rows, k) for d in d2]
+
+    def save(self, path):
+        pass
+
+    def load(self, path, n):
+        # returns how many gallery rows the loaded index covers, None if unusable
+        return n
+
+
+class IVFIndex:
+    """Inverted file: k-means coarse quantizer, exact distances inside the
+    nprobe closest lists."""
+    name = "ivf"
+
+    def __init__(self, nlist=IVF_NLIST, nprobe=IVF_NPROBE, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids = None
+        self.assign = np.empty(0, dtype=np.int64)
+        self._lists = []
+        self._pending = np.empty(0, dtype=np.int64)  # rows added before training
+
+    def _build_lists(self):
+        order = np.argsort(self.assign, kind="stable")
+        bounds = np.searchsorted(self.assign[order], np.arange(len(self.centroids) + 1))
+        self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def build(self, embs):
+        if len(embs) == 0:
+            self.centroids = None
+            self.assign = np.empty(0, dtype=np.int64)
+            self._pending = np.empty(0, dtype=np.int64)
+            return
+        # keep ~32+ points per list so small galleries still get sane clusters
+        nlist = max(1, min(self.nlist, len(embs) // 32))
+        self.centroids = kmeans(embs, nlist, seed=self.seed)
+        self.assign = nearest_centroid(embs, self.centroids)
+        self._pending = np.empty(0, dtype=np.int64)
+        self._build_lists()
+
+    def add(self, row, emb):
+        if self.centroids is None:
+            self._pending = np.append(self._pending, row)
+            return
+        c = int(nearest_centroid(emb[None, :], self.centroids)[0])
+        self.assign = np.append(self.assign, c)
+        self._lists[c] = np.append(self._lists[c], row)
+
+    def remove(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        self._pending = self._pending[~np.isin(self._pending, rows)]
+        if self.centroids is not None:
+            # list -1: in no list (and saved that way)
+            assign = self.assign.copy()
+            assign[rows[rows < len(assign)]] = -1
+            self.assign = assign
+            self._build_lists()
+
+    def search(self, embs, sq_norms, queries, k):
+        if self.centroids is None:
+            return FlatIndex().search(embs, sq_norms, queries, k)
+        nprobe = min(self.nprobe, len(self.centroids))
+        coarse = -2.0 * (queries @ self.centroids.T) + np.einsum("ij,ij->i", self.centroids, self.centroids)
+        probes = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+        n, pending = len(embs), self._pending
+        out = []
+        for q, probe in zip(queries, probes):
+            rows = np.concatenate([self._lists[c] for c in probe] + [pending])
+            rows = rows[rows < n]
+            d2 = sq_norms[rows] - 2.0 * (embs[rows] @ q) + q @ q
+            out.append(_topk(d2, rows, k))
+        return out
+
+    def save(self, path):
+        if self.centroids is not None:
+            # file handle so numpy doesn't append .npz to INDEX_PATH
+            with open(path, "wb") as f:
+                np.savez(f, centroids=self.centroids, assign=self.assign)
+
+    def load(self, path, n):
+        if not os.path.exists(path):
+            return None
+        data = np.load(path)
+        # an index built for a bigger (i.e. different) gallery is useless
+        if "assign" not in data or len(data["assign"]) > n:
+            return None
+        self.centroids = data["centroids"]
+        self.assign = data["assign"]
+        self._pending = np.empty(0, dtype=np.int64)
+        self._build_lists()
+        return len(self.assign)
+
+
+class _SharedLock:
+    """Many readers or one writer (writers wait for the readers to drain;
+    new readers wait for a waiting writer)."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting = 0
+
+    def read(self):
+        return _Held(self._acquire_read, self._release_read)
+
+    def write(self):
+        return _Held(self._acquire_write, self._release_write)
+
+    def _acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def _release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def _acquire_write(self):
+        with self._cond:
+            self._waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._writer = True
+
+    def _release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class _Held:
+    def __init__(self, acquire, release):
+        self._acquire, self._release = acquire, release
+
+    def __enter__(self):
+        self._acquire()
+
+    def __exit__(self, *exc):
+        self._release()
+        return False
+
+
+class HNSWIndex:
+    """HNSW graph via hnswlib; keeps its own copy of the vectors. Searches
+    run without the gallery's lock, and hnswlib can't resize or mark
+    deletions under a running knn_query, so those wait for the searches
+    in flight (and hold new ones back)."""
+    name = "hnsw"
+
+    def __init__(self, dim, M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH):
+        if hnswlib is None:
+            raise RuntimeError("hnswlib not installed. pip install hnswlib")
+        self.dim = dim
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._graph_lock = _SharedLock()
+        self._new(1024)
+
+    def _new(self, capacity):
+        self.index = hnswlib.Index(space="l2", dim=self.dim)
+        self.index.init_index(max_elements=capacity, ef_construction=self.ef_construction, M=self.M)
+        self.index.set_ef(self.ef_search)
+        self._deleted = set()  # labels marked deleted (knn_query can't return more than the rest)
+
+    def build(self, embs):
+        self._new(max(1024, len(embs)))
+        if len(embs):
+            self.index.add_items(embs, np.arange(len(embs)))
+
+    def add(self, row, emb):
+        if self.index.get_current_count() >= self.index.get_max_elements():
+            with self._graph_lock.write():
+                self.index.resize_index(2 * self.index.get_max_elements())
+        # hnswlib inserts concurrently with queries
+        with self._graph_lock.read():
+            self.index.add_items(emb[None, :], np.array([row]))
+
+    def remove(self, rows):
+        with self._graph_lock.write():
+            for row in np.asarray(rows, dtype=np.int64).tolist():
+                if row in self._deleted or row >= self.index.get_current_count():
+                    continue
+                try:
+                    self.index.mark_deleted(row)
+                except RuntimeError:
+                    pass  # already deleted in a loaded index file
+                self._deleted.add(row)
+
+    def search(self, embs, sq_norms, queries, k):
+        count = self.index.get_current_count()
+        alive = count - len(self._deleted)
+        n = min(count, len(embs))
+        k = min(k, n, alive)
+        if k == 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+        # rows added after the caller's n can take up to count - n of the hits
+        fetch = min(k + count - n, alive)
+        with self._graph_lock.read():
+            self.index.set_ef(max(self.ef_search, fetch))
+            labels, d2 = self.index.knn_query(queries, k=fetch)
+        out = []
+        for l, d in zip(labels, d2):
+            keep = l < n
+            out.append((l[keep][:k].astype(np.int64), d[keep][:k]))
+        return out
+
+    def save(self, path):
+        self.index.save_index(path)
+
+    def load(self, path, n):
+        if not os.path.exists(path):
+            return None
+        index = hnswlib.Index(space="l2", dim=self.dim)
+        index.load_index(path, max_elements=max(1024, n))
+        if index.get_current_count() > n:
+            return None
+        index.set_ef(self.ef_search)
+        self.index = index
+        self._deleted = set()  # the gallery removes its dead rows again
+        return index.get_current_count()
+
+
+def make_index(backend=INDEX_BACKEND, dim=512, quantization=QUANTIZATION):
+    if quantization != "none":
+        if backend != "flat":
+            raise ValueError("QUANTIZATION is only supported with INDEX_BACKEND=flat")
+        from app.quantize import make_quantized_index
+        return make_quantized_index(quantization)
+    if backend == "flat":
+        return FlatIndex()
+    elif backend == "ivf":
+        return IVFIndex()
+    elif backend == "hnsw":
+        return HNSWIndex(dim)
+    elif backend == "template":
+        from app.templates import TemplateIndex
+        return TemplateIndex()
+    else:
+        raise ValueError("Unknown index backend")
+
+
+def recall_report(index, embs, queries, k=5, repeats=1):
+    """Recall@k of `index` against exact search, plus mean per-query latency
+    (ms) of both, over the given gallery matrix."""
+    embs = np.asarray(embs, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    sq_norms = np.einsum("ij,ij->i", embs, embs)
+
+    def run(ix):
+        best = float("inf")
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            res = [ix.search(embs, sq_norms, q[None, :], k)[0] for q in queries]
+            best = min(best, time.perf_counter() - t0)
+        return res, 1000.0 * best / len(queries)
+
+    exact, exact_ms = run(FlatIndex())
+    approx, approx_ms = run(index)
+    hits = sum(len(np.intersect1d(a[0], e[0])) for a, e in zip(approx, exact))
+    total = sum(len(e[0]) for e in exact)
+    return {
+        "backend": index.name,
+        "k": k,
+        "recall": hits / max(total, 1),
+        "latency_ms": approx_ms,
+        "exact_latency_ms": exact_ms,
+    }
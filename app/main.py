@@ -1,15 +1,40 @@
 # main.py — FaceFenix Compatible Backend
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from facenet_pytorch import InceptionResnetV1, MTCNN
+from starlette.background import BackgroundTask
 from PIL import Image
 import torch
 import numpy as np
-import sqlite3
 import os
 import io
+import asyncio
+import hashlib
+import json
+import tempfile
+import shutil
+import functools
+import contextvars
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import uvicorn
+from typing import List
+from app.config import DB_PATH, TOP_K, INDEX_BACKEND, INDEX_PATH, EMBED_BATCH_SIZE, EMBEDDER_BACKEND, GALLERY_DIR, CPU_WORKERS, MAX_CONCURRENT_REQUESTS, SERVE_WORKERS, TORCH_THREADS, TORCH_INTEROP_THREADS, GALLERY_SYNC_MS, SERVER_TIMING, LAZY_MODEL_LOAD, WARMUP_BATCH_SIZES, DETECTOR_BACKEND, STREAM_DETECT_EVERY, SHARD_INDEX, SHARD_COUNT, SHARD_URLS, SHARD_REFRESH_MS
+from app.gallery import GalleryIndex
+from app.index import make_index
+from app.batcher import MicroBatcher
+from app.store import open_store
+from app.db import open_db
+from app.enroll import enroll
+from app.cache import EmbeddingCache
+from app import metrics
+from app.metrics import timer, inc
+from app.model_loader import warm_up
+from app.pipeline import FacePipeline
+from app.stream import FrameReader, StreamRecognizer, source_allowed
+from app.quality import QualityGate, LowQuality
+from app.shards import ShardedGallery, ShardsUnavailable, shard_for, decode_embeddings
 
 app = FastAPI(title="FaceFenix API", version="1.0")
 
@@ -21,124 +46,582 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database + folders
-DB_PATH = "faces.db"
-conn = sqlite3.connect(DB_PATH)
-
 os.makedirs("gallery_images", exist_ok=True)
 
-# Initialize models
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-mtcnn = MTCNN(image_size=160, margin=20, device=device)
-resnet = InceptionResnetV1(pretrained='vggface2').eval().to(device)
+# torch intra-op threads: this worker's share of the cores
+torch.set_num_threads(TORCH_THREADS or max(1, (os.cpu_count() or 1) // SERVE_WORKERS))
+try:
+    torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+except RuntimeError:
+    pass  # only settable before torch's first parallel op in this process
+
+# Models: built by load_models(), in a background thread at startup
+# (LAZY_MODEL_LOAD) so the process answers /health at once; /ready and the
+# model endpoints report 503 until it finishes.
+pipeline = None  # app/pipeline.FacePipeline: detector + embedder
+models_ready = threading.Event()
+models_error = None
+warmup_timings = {}
+
+def load_models():
+    global pipeline, models_error, warmup_timings
+    try:
+        t0 = time.perf_counter()
+        # DETECTOR_BACKEND + EMBEDDER_BACKEND (facenet through the local weight
+        # cache / TorchScript copy, onnx, onnx-int8 or insightface)
+        pipeline = FacePipeline(DETECTOR_BACKEND, EMBEDDER_BACKEND)
+        warmup_timings = warm_up(
+            embed_fn=pipeline.embed,
+            detect_fn=pipeline.detect,
+            batch_sizes=WARMUP_BATCH_SIZES,
+            size=pipeline.size,
+        )
+        warmup_timings["total"] = time.perf_counter() - t0
+        models_ready.set()
+    except Exception as e:
+        models_error = repr(e)
+        print(f"model loading failed: {models_error}")
+
+def require_models():
+    if not models_ready.is_set():
+        detail = f"Model loading failed: {models_error}" if models_error else "Models are loading, retry shortly."
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "2"})
 
 # ---------- Helpers ----------
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS faces (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT,
-        embedding BLOB,
-        image_path TEXT,
-        added_on TEXT
-    )''')
-    conn.commit()
-    conn.close()
-
-def get_embedding(image: Image.Image):
-    face = mtcnn(image)
-    if face is None:
-        raise HTTPException(status_code=400, detail="No face detected in image.")
-    with torch.no_grad():
-        emb = resnet(face.unsqueeze(0).to(device)).cpu().numpy().flatten()
+    db = open_db(DB_PATH)
+    # embeddings live in the append-only store file; faces.emb_row points into it
+    return db, open_store(db)
+
+async def run_cpu(fn, *args):
+    # decode / MTCNN / search / file I/O: never on the event loop.
+    # The context goes along so stage timers reach this request's Server-Timing.
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(cpu_pool, functools.partial(ctx.run, fn, *args))
+
+def decode_image(data: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+def detect_face(data: bytes, image: Image.Image = None, gate: QualityGate = None):
+    # the detector runs on a copy capped at DETECT_MAX_SIDE (JPEGs decoded reduced);
+    # full resolution is decoded only when the face is too small to crop there
+    faces = pipeline.find_faces(data, image)
+    if not len(faces):
+        return None
+    best = faces.largest()
+    if gate is not None:
+        reason = gate.check_detection(faces.boxes[best], faces.scores[best], faces.landmarks[best], faces.scale)
+        if reason:
+            raise LowQuality(reason)
+    crop = pipeline.crop(faces, [best])[0]
+    if gate is not None and gate.check_crop(crop):
+        raise LowQuality("blur")
+    return crop
+
+async def get_embedding(data: bytes, image: Image.Image = None, gate: QualityGate = None):
+    # keyed by upload content: a repeated image skips decode, detection and the embedder.
+    # None = no face (cached as well). With a gate, LowQuality is raised
+    # (and not cached) instead of embedding a poor face; a cached embedding
+    # has already been paid for and is returned as is.
+    key = emb_cache.key(data)
+    hit, emb = emb_cache.get(key)
+    if not hit:
+        face = await run_cpu(detect_face, data, image, gate)
+        if face is None:
+            emb = None
+        else:
+            with timer("embed_wait"):  # batcher queueing included; "embed" is the model alone
+                emb = await batcher.run(face)
+        await run_cpu(emb_cache.put, key, emb)  # may write to the disk layer
     return emb
 
-init_db()
+def detect_all(data: bytes, gate: QualityGate = None):
+    # -> (app.pipeline.Faces, faces with full-res boxes for the response).
+    # Faces failing the gate's detection checks are marked "rejected".
+    found = pipeline.find_faces(data)
+    faces = found.to_dicts()
+    if gate is not None:
+        for face, b, p, pts in zip(faces, found.boxes, found.scores, found.landmarks):
+            reason = gate.check_detection(b, p, pts, found.scale)
+            if reason:
+                face["rejected"] = reason
+    return found, faces
+
+NO_MATCH = {"match": None, "similarity": 0.0, "distance": 999.0}
+
+def match_result(matches):
+    best_match = matches[0]["name"]
+    best_distance = matches[0]["distance"]
+    similarity = max(0.0, 1.0 - best_distance)
+
+    # ✅ unified response for Streamlit
+    return {
+        "match": best_match if best_distance <= 0.8 else None,
+        "similarity": round(float(similarity), 4),
+        "distance": round(float(best_distance), 4)
+    }
+
+cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+in_flight = 0
+db, store = init_db()
+# concurrent /add_identity inserts share one transaction, off the event loop
+def write_faces(items):
+    # items: (name, embedding, image_path, content_hash). Store rows and the
+    # faces rows pointing at them go in under one lock, in the same order.
+    embs = np.stack([item[1] for item in items])
+    _, ids = store.append_committed(embs, lambda first: db.insert_faces(
+        [(name, first + i, path, digest) for i, (name, _, path, digest) in enumerate(items)], embs))
+    return ids
+
+db_writer = MicroBatcher(write_faces, name="db-writer")
+# the embedder runs only on the batcher's worker thread, never on the event loop
+batcher = MicroBatcher(lambda faces: pipeline.embed(np.stack(faces)))
+emb_cache = EmbeddingCache()
+quality_gate = QualityGate()
+if SHARD_URLS:
+    # coordinator: detection / embedding here, search and storage on the shards
+    gallery = ShardedGallery(SHARD_URLS)
+else:
+    # deletes / updates are replayed from the change log; the factory lets
+    # compaction build a fresh index while searches use the old one
+    gallery = GalleryIndex(index_factory=functools.partial(make_index, INDEX_BACKEND)).load_from_db(
+        db, store, index_path=INDEX_PATH)
+
+metrics.gauge("gallery_size", lambda: len(gallery), help="faces in this worker's gallery")
+metrics.gauge("queue_depth", batcher.qsize, help="items waiting for a batch", queue="embed")
+metrics.gauge("queue_depth", db_writer.qsize, queue="db_write")
+metrics.gauge("in_flight_requests", lambda: in_flight)
+metrics.gauge("embedding_cache_hits", lambda: emb_cache.hits)
+metrics.gauge("embedding_cache_misses", lambda: emb_cache.misses)
 
 # ---------- Endpoints ----------
+async def gallery_sync_loop():
+    # other uvicorn workers add faces too: pull what they committed
+    while True:
+        await asyncio.sleep(GALLERY_SYNC_MS / 1000.0)
+        try:
+            await run_cpu(gallery.sync, db, store)
+        except Exception as e:
+            print(f"gallery sync failed: {e}")
+
+@app.on_event("startup")
+async def start_model_loading():
+    if LAZY_MODEL_LOAD:
+        threading.Thread(target=load_models, name="model-loader", daemon=True).start()
+    else:
+        load_models()
+
+async def shard_sizes_loop():
+    # coordinator: len(gallery) reads these cached sizes, never the network
+    while True:
+        try:
+            await run_cpu(gallery.refresh_sizes)
+        except Exception as e:
+            print(f"shard size refresh failed: {e}")
+        await asyncio.sleep(SHARD_REFRESH_MS / 1000.0)
+
+@app.on_event("startup")
+async def start_shard_refresh():
+    if SHARD_URLS:
+        asyncio.get_running_loop().create_task(shard_sizes_loop())
+
+@app.exception_handler(ShardsUnavailable)
+async def shards_unavailable(request: Request, exc: ShardsUnavailable):
+    return JSONResponse({"detail": f"Gallery shards unavailable: {exc}"}, status_code=503,
+                        headers={"Retry-After": "2"})
+
+def gallery_empty():
+    # a coordinator that hasn't heard from any shard yet doesn't know; its
+    # search will answer (or raise ShardsUnavailable)
+    return len(gallery) == 0 and getattr(gallery, "reported", True)
+
+@app.on_event("startup")
+async def start_gallery_sync():
+    if SERVE_WORKERS > 1 and not SHARD_URLS:
+        asyncio.get_running_loop().create_task(gallery_sync_loop())
+
+@app.on_event("shutdown")
+def save_gallery_index():
+    batcher.close()
+    db_writer.close()
+    cpu_pool.shutdown()
+    gallery.save_index(INDEX_PATH)
+    if SHARD_URLS:
+        gallery.close()
+    db.close()
+
+@app.middleware("http")
+async def concurrency_limit(request: Request, call_next):
+    # backpressure: shed load with 503 instead of queueing without bound
+    global in_flight
+    if request.url.path in ("/health", "/metrics"):
+        return await call_next(request)
+    if in_flight >= MAX_CONCURRENT_REQUESTS:
+        return JSONResponse({"detail": "Server busy, retry later."}, status_code=503, headers={"Retry-After": "1"})
+    in_flight += 1
+    released = False
+
+    def release():
+        global in_flight
+        nonlocal released
+        if not released:
+            released = True
+            in_flight -= 1
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        release()
+        raise
+    # call_next returns before the body is produced (SSE streams run for
+    # minutes): hold the slot until the body is done or the client is gone
+    body = response.body_iterator
+
+    async def body_then_release():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            release()
+    response.body_iterator = body_then_release()
+    response.background = BackgroundTask(release)  # also runs after a disconnect
+    return response
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    if not metrics.registry.enabled:
+        return await call_next(request)
+    timings = metrics.request_timings() if SERVER_TIMING else None
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    dt = time.perf_counter() - t0
+    # the route template (/faces/{face_id}), not the raw path: one series per endpoint
+    route = request.scope.get("route")
+    path = getattr(route, "path", None) or "unmatched"
+    metrics.observe("request_seconds", dt, path=path)
+    inc("requests_total", path=path, status=response.status_code)
+    if timings is not None:
+        timings.append(("total", dt))
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+    return response
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
-def health():
-    return {"status": "ok"}
+async def health():
+    # liveness: the process answers; readiness is reported alongside (and on /ready)
+    return {"status": "ok", "ready": models_ready.is_set(), "in_flight": in_flight,
+            "gallery_version": gallery.version}
+
+@app.get("/ready")
+async def ready():
+    if not models_ready.is_set():
+        return JSONResponse({"ready": False, "error": models_error}, status_code=503)
+    return {"ready": True, "gallery_size": len(gallery),
+            "warmup_ms": {k: round(v * 1000.0, 1) for k, v in warmup_timings.items()}}
+
+@app.get("/cache_stats")
+def cache_stats():
+    return emb_cache.stats()
+
+@app.get("/quality_stats")
+def quality_stats():
+    # embedder cost per face from the batcher's own timing
+    per_face = batcher.seconds / batcher.items if batcher.items else None
+    return quality_gate.stats(per_face)
+
+def check_shard_owner(name):
+    # a shard server only enrolls identities that hash to it
+    if SHARD_COUNT > 1 and shard_for(name, SHARD_COUNT) != SHARD_INDEX:
+        raise HTTPException(status_code=409, detail=f"{name!r} belongs to shard {shard_for(name, SHARD_COUNT)}, "
+                                                    f"this is shard {SHARD_INDEX} of {SHARD_COUNT}.")
+
+@app.get("/shard/info")
+def shard_info():
+    return {"shard": SHARD_INDEX, "count": SHARD_COUNT, "size": len(gallery)}
+
+@app.post("/shard/search")
+async def shard_search(request: Request):
+    # called by a coordinator: query embeddings in, this slice's top-k out
+    body = await request.json()
+    embs = decode_embeddings(body["embeddings"])
+    with timer("search"):
+        results = await run_cpu(gallery.search_batch, embs, int(body.get("k", TOP_K)))
+    return {"results": results, "size": len(gallery)}
+
+@app.post("/shard/add")
+async def shard_add(request: Request):
+    body = await request.json()
+    if body.get("shard_count", SHARD_COUNT) != SHARD_COUNT:
+        raise HTTPException(status_code=409, detail=f"coordinator has {body['shard_count']} shards, this shard expects {SHARD_COUNT}.")
+    name = " ".join(body["name"].split())
+    check_shard_owner(name)
+    embedding = decode_embeddings(body["embedding"])[0]
+    face_id = await db_writer.run((name, embedding, body.get("image_path"), body.get("content_hash")))
+    await run_cpu(gallery.sync, db, store)
+    return {"id": face_id, "shard": SHARD_INDEX, "size": len(gallery)}
 
 @app.post("/add_identity")
 async def add_identity(name: str = Form(...), file: UploadFile = File(...)):
-    image = Image.open(io.BytesIO(await file.read())).convert("RGB")
-    embedding = get_embedding(image)
+    require_models()
+    name = " ".join(name.split())  # templates also match case-insensitively
+    if not name:
+        raise HTTPException(status_code=400, detail="Name is required.")
+    check_shard_owner(name)
+    data = await file.read()
+    image = await run_cpu(decode_image, data)
+    embedding = await get_embedding(data, image)
+    if embedding is None:
+        raise HTTPException(status_code=400, detail="No face detected in image.")
 
     image_filename = f"{name}_{os.urandom(8).hex()}.jpg"
     image_path = os.path.join("gallery_images", image_filename)
-    image.save(image_path)
+    if SHARD_URLS:
+        _, reply = await asyncio.gather(
+            run_cpu(image.save, image_path),
+            run_cpu(gallery.add, name, embedding, image_path, hashlib.sha256(data).hexdigest()))
+        return {"id": reply["id"], "name": name, "image_path": image_path, "shard": reply["shard"]}
+    with timer("write_files"):
+        await run_cpu(image.save, image_path)
+    with timer("db_write"):  # store append + insert, batched with concurrent adds
+        face_id = await db_writer.run((name, embedding, image_path, hashlib.sha256(data).hexdigest()))
+    # by id order, so rows other workers committed first are picked up too
+    await run_cpu(gallery.sync, db, store)
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO faces (name, embedding, image_path, added_on) VALUES (?, ?, ?, datetime('now'))",
-        (name, embedding.astype(np.float32).tobytes(), image_path),
-    )
-    conn.commit()
-    conn.close()
+    return {"id": face_id, "name": name, "image_path": image_path}
 
-    return {"id": cursor.lastrowid, "name": name, "image_path": image_path}
+@app.post("/bulk_enroll")
+async def bulk_enroll(file: UploadFile = File(...), workers: int = Form(None)):
+    require_models()
+    if SHARD_URLS:
+        raise HTTPException(status_code=400, detail="Bulk enrollment goes to the shards (tools/shard_cluster.py --split).")
+    # zip / tar archive laid out like gallery_images/<name>_*.jpg
+    # spooled upload -> temp file in chunks, off the event loop
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(file.filename or "")[1], delete=False) as tmp:
+        await run_cpu(shutil.copyfileobj, file.file, tmp, 1 << 20)
+    def on_rows(rows):
+        gallery.sync(db, store)
+    # at most this worker's share of the cores
+    workers = max(1, min(workers or CPU_WORKERS, CPU_WORKERS))
+    # a shard server only enrolls the identities that hash to it (check_shard_owner)
+    owned = (lambda name: shard_for(name, SHARD_COUNT) == SHARD_INDEX) if SHARD_COUNT > 1 else None
+    try:
+        counts = await asyncio.get_running_loop().run_in_executor(None, lambda: enroll(
+            tmp.name, db, store, pipeline.embed,
+            workers=workers, batch_size=EMBED_BATCH_SIZE, save_dir=GALLERY_DIR, on_rows=on_rows,
+            accept_name=owned,
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.unlink(tmp.name)
+    return counts
 
 @app.get("/list_identities")
 def list_identities():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, image_path, added_on FROM faces")
-    records = cursor.fetchall()
-    conn.close()
-
+    if SHARD_URLS:
+        return gallery.list_faces()
+    records = db.list_faces()
     return [
         {"id": r[0], "name": r[1], "image_path": r[2], "added_on": r[3]}
         for r in records
     ]
+# ---------- Gallery mutations ----------
+# Each write commits faces + change-log rows in one transaction, then this
+# worker replays the log (gallery.sync); other workers catch up on their
+# next sync. A changed face gets a new store row: the old row becomes a
+# tombstone, so snapshots taken before the change keep seeing it.
+
+def require_local_gallery():
+    if SHARD_URLS:
+        raise HTTPException(status_code=400, detail="Send gallery mutations to the shard that owns the identity.")
+
+async def delete_faces(face_ids):
+    deleted = await run_cpu(db.delete_faces, face_ids)
+    await run_cpu(gallery.sync, db, store)
+    return deleted
+
+async def update_faces(faces, name=None, embeddings=None, image_path=None):
+    # faces: [(id, name, emb_row)]; every one gets a fresh store row
+    if embeddings is None:
+        embeddings = store.view()[[f[2] for f in faces]]
+    embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(faces), -1)
+    _, updated = await run_cpu(store.append_committed, embeddings, lambda first: db.update_faces([
+        (face_id, name or old_name, first + i, image_path) for i, (face_id, old_name, _) in enumerate(faces)
+    ], embeddings))
+    await run_cpu(gallery.sync, db, store)
+    return updated
+
+@app.get("/gallery/version")
+def gallery_version():
+    # this worker's snapshot version vs. the latest committed one
+    return {"version": gallery.version, "committed": db.version(), "size": len(gallery),
+            "tombstones": getattr(gallery, "tombstones", 0)}
+
+@app.get("/gallery/changes")
+def gallery_changes(since: int = 0, limit: int = 10000):
+    # deltas for caches / replicas: apply in order, then resume from "version"
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive.")
+    changes = db.changes_after(since, min(limit, 10000))
+    return {
+        "changes": [{"version": v, "op": op, "id": face_id, "name": name} for v, op, face_id, name, _ in changes],
+        "version": changes[-1][0] if changes else since,
+    }
+
+@app.delete("/faces/{face_id}")
+async def delete_face(face_id: int):
+    require_local_gallery()
+    deleted = await delete_faces([face_id])
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Face not found.")
+    return {"deleted": deleted, "gallery_version": gallery.version}
+
+@app.delete("/identities/{name}")
+async def delete_identity(name: str):
+    require_local_gallery()
+    faces = await run_cpu(db.faces_named, " ".join(name.split()))
+    if not faces:
+        raise HTTPException(status_code=404, detail="Identity not found.")
+    deleted = await delete_faces([f[0] for f in faces])
+    return {"deleted": deleted, "gallery_version": gallery.version}
+
+@app.post("/identities/{name}/rename")
+async def rename_identity(name: str, new_name: str = Form(...)):
+    require_local_gallery()
+    new_name = " ".join(new_name.split())
+    if not new_name:
+        raise HTTPException(status_code=400, detail="Name is required.")
+    check_shard_owner(new_name)
+    faces = await run_cpu(db.faces_named, " ".join(name.split()))
+    if not faces:
+        raise HTTPException(status_code=404, detail="Identity not found.")
+    updated = await update_faces(faces, name=new_name)
+    return {"renamed": updated, "name": new_name, "gallery_version": gallery.version}
+
+@app.put("/faces/{face_id}/embedding")
+async def replace_embedding(face_id: int, file: UploadFile = File(...)):
+    require_models()
+    require_local_gallery()
+    face = await run_cpu(db.face, face_id)
+    if face is None:
+        raise HTTPException(status_code=404, detail="Face not found.")
+    data = await file.read()
+    image = await run_cpu(decode_image, data)
+    embedding = await get_embedding(data, image)
+    if embedding is None:
+        raise HTTPException(status_code=400, detail="No face detected in image.")
+    image_path = os.path.join("gallery_images", f"{face[1]}_{os.urandom(8).hex()}.jpg")
+    await run_cpu(image.save, image_path)
+    await update_faces([face], embeddings=embedding, image_path=image_path)
+    return {"id": face_id, "name": face[1], "image_path": image_path, "gallery_version": gallery.version}
+
 @app.post("/recognize")
 async def recognize(file: UploadFile = File(...)):
-    image = Image.open(io.BytesIO(await file.read())).convert("RGB")
-    face = mtcnn(image)
+    require_models()
+    try:
+        emb = await get_embedding(await file.read(), gate=quality_gate)
+    except LowQuality as e:
+        return dict(NO_MATCH, rejected=e.reason)
 
-    if face is None:
-        return {"match": None, "similarity": 0.0, "distance": 999.0}
+    if emb is None:
+        return dict(NO_MATCH)
+
+    snap = gallery.snapshot()
+    with timer("search"):
+        matches = await run_cpu(snap.search, emb, TOP_K)
+    if not matches:
+        raise HTTPException(status_code=400, detail="No registered faces found.")
 
-    with torch.no_grad():
-        emb = resnet(face.unsqueeze(0).to(device)).cpu().numpy().flatten()
+    return dict(match_result(matches), gallery_version=snap.version)
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, embedding FROM faces")
-    records = cursor.fetchall()
-    conn.close()
+@app.post("/recognize_batch")
+async def recognize_batch(files: List[UploadFile] = File(...)):
+    require_models()
+    # detect every face in every image, then embed all crops in one pass
+    blobs = [await file.read() for file in files]
+    detected = await asyncio.gather(*(run_cpu(detect_all, data, quality_gate) for data in blobs))
+    results = [{"filename": file.filename, "faces": faces} for file, (_, faces) in zip(files, detected)]
 
-    if not records:
+    # faces that passed the gate's detection checks, per image
+    keep = [[i for i, f in enumerate(faces) if "rejected" not in f] for _, faces in detected]
+    n = sum(len(k) for k in keep)
+    if n == 0:
+        for res in results:
+            for face in res["faces"]:
+                face.update(NO_MATCH)
+        return {"results": results}
+    if gallery_empty():
         raise HTTPException(status_code=400, detail="No registered faces found.")
 
-    best_match = None
-    best_distance = float("inf")
+    # every crop is standardized straight into its slot of one batch buffer
+    batch = np.empty((n, 3, pipeline.size, pipeline.size), dtype=np.float32)
+    jobs, start = [], 0
+    for (found, _), idx in zip(detected, keep):
+        if idx:
+            jobs.append(run_cpu(pipeline.crop, found, idx, batch[start:start + len(idx)]))
+            start += len(idx)
+    await asyncio.gather(*jobs)  # pipeline.crop times itself
+    # blur check on the crops; only the sharp ones reach the embedder
+    kept = [faces[i] for (_, faces), idx in zip(detected, keep) for i in idx]
+    reasons = await run_cpu(lambda: [quality_gate.check_crop(c) for c in batch])
+    for face, reason in zip(kept, reasons):
+        if reason:
+            face["rejected"] = reason
+    sharp = [row for row, reason in enumerate(reasons) if not reason]
+    if len(sharp) < n:
+        batch = batch[sharp]
+    snap = gallery.snapshot()  # every face in the request sees the same gallery
+    hits = iter(())
+    if len(batch):
+        with timer("embed_wait"):
+            embs = np.stack(await batcher.run_many(batch))
+        with timer("search"):
+            hits = iter(await run_cpu(snap.search_batch, embs, TOP_K))
+    for res in results:
+        for face in res["faces"]:
+            if "rejected" in face:
+                face.update(NO_MATCH)
+                continue
+            matches = next(hits)
+            face.update(match_result(matches))
+            face["top_k"] = [
+                {"id": m["id"], "name": m["name"], "distance": round(m["distance"], 4)}
+                for m in matches
+            ]
+    return {"results": results, "gallery_version": snap.version}
 
-    for db_name, db_embed in records:
-        db_embedding = np.frombuffer(db_embed, dtype=np.float32)
-        distance = np.linalg.norm(emb - db_embedding)
-        if distance < best_distance:
-            best_distance = distance
-            best_match = db_name
+@app.get("/stream/recognize")
+def stream_recognize(source: str, detect_every: int = STREAM_DETECT_EVERY):
+    require_models()
+    # Server-Sent Events: one "data: {...}" line per identity / lost / stats event.
+    # source is an rtsp:// or http(s):// URL, a local video file or a camera index.
+    if not source_allowed(source):
+        raise HTTPException(status_code=403, detail="Source not allowed (STREAM_ALLOWED_URLS / STREAM_ALLOW_LOCAL).")
+    if gallery_empty():
+        raise HTTPException(status_code=400, detail="No registered faces found.")
+    try:
+        reader = FrameReader(source)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    def embed(crops):
+        # crops share the batcher (and its batches) with the image endpoints
+        futures = [batcher.submit(c) for c in crops]
+        return np.stack([f.result() for f in futures])
 
-    similarity = max(0.0, 1.0 - best_distance)
+    # the pipeline detects on the frames and crops them for its embedder
+    recognizer = StreamRecognizer(pipeline, embed, lambda embs: gallery.search_batch(embs, TOP_K),
+                                  detect_every=detect_every, gate=quality_gate,
+                                  crop_fn=pipeline.crop_frame, size=pipeline.size)
 
-    # ✅ unified response for Streamlit
-    if best_distance <= 0.8:
-        return {
-            "match": best_match,
-            "similarity": round(float(similarity), 4),
-            "distance": round(float(best_distance), 4)
-        }
-    else:
-        return {
-            "match": None,
-            "similarity": round(float(similarity), 4),
-            "distance": round(float(best_distance), 4)
-        }
+    def events():
+        yield f"event: start\ndata: {json.dumps({'source': source, 'fps': reader.fps})}\n\n"
+        for ev in recognizer.run(reader):
+            yield f"data: {json.dumps(ev)}\n\n"
 
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 
 if __name__ == "__main__":
@@ -1,39 +1,51 @@
 
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from app.config import TOP_K, MATCH_THRESHOLD, INDEX_BACKEND, EMBED_DIM
+from app.gallery import GalleryIndex
+from app.index import make_index
+from app.db import as_db
+from app.store import open_store
+from app.metrics import timer
 
 class Matcher:
-    def __init__(self, db_session, top_k=5, threshold=0.45):
-        self.db_session = db_session
+    def __init__(self, db, store=None, top_k=TOP_K, threshold=MATCH_THRESHOLD, index_backend=INDEX_BACKEND):
+        # db: path or app.db.Database, the same faces table the API serves
+        self.db = as_db(db)
+        self.store = store if store is not None else open_store(self.db)
         self.top_k = top_k
         self.threshold = threshold
+        self.index_backend = index_backend
+        self.gallery = None
 
     def load_all_embeddings(self):
-        from models import Identity, bytes_to_embed
-        ids = []
-        names = []
-        embs = []
-        for row in self.db_session.query(Identity).all():
-            ids.append(row.id)
-            names.append(row.name)
-            embs.append(bytes_to_embed(row.embedding))
-        if len(embs)>0:
-            embs = np.vstack(embs)
+        rows = self.db.gallery_rows()
+        ids = [r[0] for r in rows]
+        names = [r[1] for r in rows]
+        if len(rows)>0:
+            embs = np.asarray(self.store.view()[[r[2] for r in rows]], dtype=np.float32)
         else:
-            embs = np.zeros((0,512), dtype=np.float32)
+            embs = np.zeros((0,EMBED_DIM), dtype=np.float32)
         return ids, names, embs
 
-    def match(self, query_emb):
+    def refresh(self):
         ids, names, embs = self.load_all_embeddings()
-        if embs.shape[0]==0:
-            return []
-        sims = cosine_similarity(query_emb.reshape(1,-1), embs).reshape(-1)  # cosine similarity in [-1,1]
-        idx_sorted = np.argsort(-sims)[:self.top_k]
+        # unit vectors: squared L2 distance = 2 - 2 * cosine similarity
+        embs = embs / np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+        self.gallery = GalleryIndex(index=make_index(self.index_backend)).set(ids, names, embs)
+        return self.gallery
+
+    def match(self, query_emb):
+        if self.gallery is None:
+            self.refresh()
+        q = np.asarray(query_emb, dtype=np.float32).reshape(-1)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        with timer("search"):
+            hits = self.gallery.search(q, self.top_k)
         results = []
-        for idx in idx_sorted:
-            score = float(sims[idx])
+        for hit in hits:
+            score = 1.0 - 0.5 * hit["distance"] ** 2  # cosine similarity in [-1,1]
             if score < (1 - self.threshold):  # if threshold is distance; adjust semantics as needed
                 # if using cosine similarity, threshold interpretation differs; here assume high=good
                 pass
-            results.append({"id": ids[idx], "name": names[idx], "score": score})
+            results.append({"id": hit["id"], "name": hit["name"], "score": score})
         return results
@@ -0,0 +1,158 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+from app.config import METRICS_ENABLED
+
+# In-process metrics rendered in the Prometheus text format on /metrics.
+# Stage timers also feed the per-request Server-Timing header when the
+# request opted in (see request_timings). With METRICS_ENABLED off, timer()
+# returns a shared no-op context and observe()/inc() return immediately.
+
+PREFIX = "facefenix_"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+_NOOP = contextlib.nullcontext()
+# list of (stage, seconds) for the current request, or None
+_timings = contextvars.ContextVar("server_timing", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last = +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Registry:
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}    # (name, labels) -> value
+        self.gauges = {}      # (name, labels) -> fn
+        self.help = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self.histograms.setdefault(key, Histogram(buckets))
+        hist.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, fn, help="", **labels):
+        # fn is called at scrape time
+        self.gauges[(name, tuple(sorted(labels.items())))] = fn
+        if help:
+            self.help[name] = help
+
+    def timer(self, stage):
+        if not self.enabled:
+            return _NOOP
+        return _Timer(self, stage)
+
+    def render(self):
+        lines, typed = [], set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {PREFIX}{name} {self.help[name]}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        for (name, labels), fn in sorted(self.gauges.items()):
+            try:
+                value = float(fn())
+            except Exception:
+                continue
+            header(name, "gauge")
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value:g}")
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value:g}")
+        for (name, labels), h in histograms:
+            header(name, "histogram")
+            with h._lock:
+                counts, total, count = list(h.counts), h.sum, h.count
+            cumulative = 0
+            for le, c in zip(h.buckets + ("+Inf",), counts):
+                cumulative += c
+                lines.append(f"{PREFIX}{name}_bucket{_labels(labels + (('le', f'{le:g}' if le != '+Inf' else le),))} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class _Timer:
+    __slots__ = ("registry", "stage", "t0")
+
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        dt = time.perf_counter() - self.t0
+        self.registry.observe("stage_seconds", dt, stage=self.stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((self.stage, dt))
+        return False
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def request_timings():
+    """Start collecting stage timings for the current request (context);
+    returns the list they are appended to."""
+    timings = []
+    _timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings):
+    # stages that ran more than once (e.g. per face) are summed
+    totals = {}
+    for stage, dt in timings:
+        totals[stage] = totals.get(stage, 0.0) + dt
+    return ", ".join(f"{stage};dur={dt * 1000.0:.2f}" for stage, dt in totals.items())
+
+
+registry = Registry()
+timer = registry.timer
+observe = registry.observe
+inc = registry.inc
+gauge = registry.gauge
+render = registry.render
@@ -0,0 +1,64 @@
+import glob
+import os
+import time
+import numpy as np
+from app.config import MODEL_CACHE_DIR, MODEL_OFFLINE, TORCHSCRIPT_PATH
+
+# Model construction for the API and the Embedder: weights resolved from a
+# local cache (no network when MODEL_OFFLINE=1), an optional TorchScript
+# copy of InceptionResnetV1 that reloads without facenet-pytorch's weight
+# handling, and warm-up passes so the first request isn't the slow one.
+
+
+def configure_weight_cache(cache_dir=MODEL_CACHE_DIR, offline=MODEL_OFFLINE):
+    # facenet-pytorch keeps its checkpoints under $TORCH_HOME/checkpoints and
+    # downloads only when the file is missing there
+    if cache_dir:
+        os.environ["TORCH_HOME"] = os.path.abspath(cache_dir)
+    if offline:
+        home = os.environ.get("TORCH_HOME", os.path.join(os.path.expanduser("~"), ".cache", "torch"))
+        if not glob.glob(os.path.join(home, "checkpoints", "*vggface2*")) and not _torchscript_ready():
+            raise RuntimeError(
+                f"MODEL_OFFLINE=1 but no vggface2 weights under {home}/checkpoints; "
+                "run once with network access (or copy the .pt there) first")
+
+
+def _torchscript_ready(path=TORCHSCRIPT_PATH):
+    return bool(path) and os.path.exists(path)
+
+
+def load_facenet(device="cpu", torchscript_path=TORCHSCRIPT_PATH):
+    """InceptionResnetV1 (vggface2) in eval mode. With torchscript_path set,
+    a saved frozen trace is loaded if present, otherwise written after the
+    first eager load."""
+    import torch
+    if _torchscript_ready(torchscript_path):
+        return torch.jit.load(torchscript_path, map_location=device).eval()
+    from facenet_pytorch import InceptionResnetV1
+    configure_weight_cache()
+    model = InceptionResnetV1(pretrained='vggface2').eval().to(device)
+    if torchscript_path:
+        with torch.no_grad():
+            traced = torch.jit.freeze(torch.jit.trace(model, torch.zeros(1, 3, 160, 160, device=device)))
+        os.makedirs(os.path.dirname(os.path.abspath(torchscript_path)), exist_ok=True)
+        tmp = f"{torchscript_path}.{os.getpid()}.tmp"
+        traced.save(tmp)
+        os.replace(tmp, torchscript_path)
+        return traced
+    return model
+
+
+def warm_up(embed_fn=None, detect_fn=None, batch_sizes=(1,), size=160):
+    """One pass per batch size (allocator, oneDNN kernels, ORT arenas) and
+    one detection on a blank frame. Returns seconds per step."""
+    timings = {}
+    if detect_fn is not None:
+        t0 = time.perf_counter()
+        detect_fn(np.zeros((480, 640, 3), dtype=np.uint8))
+        timings["detect"] = time.perf_counter() - t0
+    if embed_fn is not None:
+        for bs in batch_sizes:
+            t0 = time.perf_counter()
+            embed_fn(np.zeros((bs, 3, size, size), dtype=np.float32))
+            timings[f"embed_{bs}"] = time.perf_counter() - t0
+    return timings
@@ -3,7 +3,8 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import datetime
 import numpy as np
-import io
+from app.config import LEGACY_DB_PATH
+from app.store import decode_blob
 
 Base = declarative_base()
 
@@ -16,25 +17,20 @@ class Identity(Base):
     added_on = Column(DateTime, default=datetime.datetime.utcnow)
     meta_info = Column(String, nullable=True)  
 
-# DB helper
-def get_engine(db_path="face_gallery.db"):
+# DB helper (legacy: app/db.py migrates this identities table into faces)
+def get_engine(db_path=LEGACY_DB_PATH):
     engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
     return engine
 
-def create_db(db_path="face_gallery.db"):
+def create_db(db_path=LEGACY_DB_PATH):
     engine = get_engine(db_path)
     Base.metadata.create_all(engine)
     return engine
 
-# utils for embedding bytes
+# utils for embedding bytes: raw float32, same layout as the faces table
 def embed_to_bytes(arr: np.ndarray) -> bytes:
-    memfile = io.BytesIO()
-    np.save(memfile, arr)
-    memfile.seek(0)
-    return memfile.read()
+    return np.asarray(arr, dtype=np.float32).tobytes()
 
 def bytes_to_embed(b: bytes) -> np.ndarray:
-    memfile = io.BytesIO(b)
-    memfile.seek(0)
-    return np.load(memfile)
+    return decode_blob(b)
 
@@ -0,0 +1,209 @@
+import functools
+import io
+import cv2
+import numpy as np
+from PIL import Image
+from app.config import DETECTOR_BACKEND, EMBEDDER_BACKEND, ALIGN_FACES, DETECT_MAX_SIDE, EMBED_BATCH_SIZE
+from app.align import warp_faces, to_model_input
+from app.embedder import Embedder, INPUT_SPECS
+from app.metrics import timer, inc
+from app.utils import decode_for_detection, shrink_for_detection, crop_faces, margin_box
+
+# Detector + embedder as one pass, shared by the API, the stream and the
+# scripts: the detector runs once per image and returns boxes, scores and
+# the 5 landmarks together; crops (MTCNN-style margin boxes, or 5-point
+# aligned) are written straight into a preallocated (N, 3, S, S) float32
+# batch, already standardized the way the embedder's network expects
+# (INPUT_SPECS); that batch goes to the network as is. With insightface the
+# retinaface and ArcFace models are called directly, so nothing is
+# detected twice and one FaceAnalysis serves both.
+
+
+class Faces:
+    """Detections on one image. boxes (N, 4), scores (N,), landmarks (N, 5, 2)
+    are on `small`, the RGB image the detector saw; `scale` maps them to
+    full resolution, decoded by load_full() only if a crop needs it."""
+
+    def __init__(self, small, full_size, load_full, boxes, scores, landmarks):
+        self.small = small
+        self.full_size = full_size
+        self.load_full = load_full
+        self.boxes = boxes
+        self.scores = scores
+        self.landmarks = landmarks
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @property
+    def scale(self):
+        return self.full_size[0] / self.small.size[0]
+
+    def largest(self):
+        # the face mtcnn(image) would keep (select_largest)
+        return int(np.argmax((self.boxes[:, 2] - self.boxes[:, 0]) * (self.boxes[:, 3] - self.boxes[:, 1])))
+
+    def to_dicts(self):
+        # API form: full-resolution boxes
+        return [{"box": [round(float(v) * self.scale, 1) for v in b], "score": round(float(p), 4)}
+                for b, p in zip(self.boxes, self.scores)]
+
+
+class FacePipeline:
+    """detector / embedder: backend names, or None to load only the other
+    half (detection in pool workers, embedding of ready crops). crops_for
+    names the embedder backend crops are made for (default: embedder, or
+    EMBEDDER_BACKEND without one). Crops are aligned when `align` is set or
+    they are for ArcFace. With `cache` (app.cache.EmbeddingCache) embed()
+    looks each crop up by its bytes first, so scripts that see the same
+    faces again (and, with EMBED_CACHE_DIR, the same files on a later run)
+    skip the network."""
+
+    def __init__(self, detector=DETECTOR_BACKEND, embedder=EMBEDDER_BACKEND, align=ALIGN_FACES,
+                 max_side=DETECT_MAX_SIDE, zoom=None, crops_for=None, cache=None):
+        self.detector_backend = detector
+        self.max_side = max_side
+        self.embedder = Embedder(embedder) if embedder else None
+        self.cache = cache
+        crops_for = crops_for or embedder or EMBEDDER_BACKEND
+        self.size, self.mean, self.std = INPUT_SPECS[crops_for]
+        arcface = crops_for == "insightface"
+        self.align = align or arcface
+        # ArcFace crops use its template as is; facenet keeps MTCNN's margin
+        self.zoom = zoom if zoom is not None else (1.0 if arcface else 0.85)
+        self._mtcnn = self._retina = None
+        if detector == "insightface" and self.embedder is not None and self.embedder.backend == "insightface":
+            self._retina = self.embedder.net.det_model
+        elif detector:
+            from app.detector import Detector
+            det = Detector(detector).det
+            if detector == "mtcnn":
+                self._mtcnn = det
+            else:
+                self._retina = det.det_model
+
+    # ---------- detection ----------
+    def _run_detector(self, img, bgr=False):
+        # img: PIL RGB or HWC uint8 array -> boxes, scores, landmarks arrays
+        with timer("detect"):
+            if self._mtcnn is not None:
+                if bgr:
+                    img = np.ascontiguousarray(img[..., ::-1])
+                boxes, probs, points = self._mtcnn.detect(img, landmarks=True)
+                if boxes is None:
+                    boxes, probs, points = np.zeros((0, 4)), np.zeros(0), np.zeros((0, 5, 2))
+            else:
+                arr = np.asarray(img)
+                if not bgr:
+                    arr = arr[..., ::-1]  # retinaface takes BGR
+                det, points = self._retina.detect(np.ascontiguousarray(arr), max_num=0, metric="default")
+                boxes, probs = det[:, :4], det[:, 4]
+                if points is None:
+                    points = np.zeros((len(det), 5, 2))
+        inc("faces_detected_total", len(boxes))
+        return (np.asarray(boxes, dtype=np.float32), np.asarray(probs, dtype=np.float32),
+                np.asarray(points, dtype=np.float32).reshape(-1, 5, 2))
+
+    def find_faces(self, data: bytes = None, image: Image.Image = None) -> Faces:
+        """Every face in an upload (bytes) or a decoded RGB image. The
+        detector sees a copy capped at max_side (JPEGs decoded reduced)."""
+        with timer("decode"):
+            if image is None:
+                small, full_size = decode_for_detection(data, self.max_side)
+                load_full = functools.partial(_decode_full, data)
+            else:
+                small, full_size = shrink_for_detection(image, self.max_side), image.size
+                load_full = lambda: image
+        return Faces(small, full_size, load_full, *self._run_detector(small))
+
+    def detect(self, img_bgr):
+        """Same contract as app.detector.Detector.detect, for BGR frames:
+        [{"box", "score", "landmarks"}] at full resolution."""
+        h, w = img_bgr.shape[:2]
+        r = 1.0
+        if self.max_side and max(h, w) > self.max_side:
+            r = self.max_side / max(h, w)
+            img_bgr = cv2.resize(img_bgr, (int(w * r), int(h * r)), interpolation=cv2.INTER_AREA)
+        boxes, scores, points = self._run_detector(img_bgr, bgr=True)
+        return [{"box": (b / r).tolist(), "score": float(p), "landmarks": (pts / r).tolist()}
+                for b, p, pts in zip(boxes, scores, points)]
+
+    # ---------- crops ----------
+    def _batch(self, n, out):
+        if out is None:
+            out = np.empty((n, 3, self.size, self.size), dtype=np.float32)
+        return out
+
+    def crop(self, faces: Faces, rows=None, out=None):
+        """Crops of faces[rows] (default: all) written into out[:N] as the
+        embedder's input. Faces narrower than the crop on the detection
+        image are cut from the full-resolution decode instead."""
+        rows = np.arange(len(faces)) if rows is None else np.asarray(rows, dtype=np.int64)
+        out = self._batch(len(rows), out)
+        with timer("crop"):
+            if not self.align:
+                return crop_faces(faces.small, faces.boxes[rows], faces.full_size, faces.load_full, out,
+                                  size=self.size)
+            src, points = faces.small, faces.landmarks[rows]
+            boxes = faces.boxes[rows]
+            if faces.scale > 1.0 and len(rows) and (boxes[:, 2] - boxes[:, 0]).min() < self.size:
+                src, points = faces.load_full(), points * faces.scale
+            warped = warp_faces(np.asarray(src), points, self.size, zoom=self.zoom)
+            return to_model_input(warped, bgr=False, out=out, mean=self.mean, std=self.std)
+
+    def crop_frame(self, frame_bgr, boxes, landmarks=None, out=None):
+        """crop() for a decoded BGR frame and full-resolution boxes (the
+        stream). Without landmarks the margin crop is used."""
+        n = len(boxes)
+        out = self._batch(n, out)
+        if self.align and landmarks is not None and all(p is not None for p in landmarks):
+            warped = warp_faces(frame_bgr, landmarks, self.size, zoom=self.zoom)
+            return to_model_input(warped, bgr=True, out=out, mean=self.mean, std=self.std)
+        h, w = frame_bgr.shape[:2]
+        for i, box in enumerate(boxes):
+            x1, y1, x2, y2 = margin_box(box, 20, self.size, (w, h))
+            if x2 <= x1 or y2 <= y1:
+                out[i] = 0.0
+                continue
+            face = cv2.resize(frame_bgr[y1:y2, x1:x2], (self.size, self.size), interpolation=cv2.INTER_LINEAR)
+            to_model_input(face[None], bgr=True, out=out[i:i + 1], mean=self.mean, std=self.std)
+        return out[:n]
+
+    # ---------- embedding ----------
+    def embed(self, batch):
+        # (N, 3, S, S) crops from crop() -> (N, 512) unit rows, EMBED_BATCH_SIZE at a time
+        if not len(batch):
+            return np.zeros((0, 512), dtype=np.float32)
+        if self.cache is not None:
+            return self._embed_cached(batch)
+        return np.concatenate([self.embedder.get_embeddings(batch[i:i + EMBED_BATCH_SIZE])
+                               for i in range(0, len(batch), EMBED_BATCH_SIZE)])
+
+    def _embed_cached(self, batch):
+        # keyed on the backend and the standardized crop itself
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        prefix = f"{self.embedder.backend}:{batch.shape[1:]}:".encode()
+        keys = [self.cache.key(prefix + crop.tobytes()) for crop in batch]
+        out = np.empty((len(batch), 512), dtype=np.float32)
+        misses = []
+        for i, key in enumerate(keys):
+            hit, emb = self.cache.get(key)
+            if hit and emb is not None:
+                out[i] = emb
+            else:
+                misses.append(i)
+        for s in range(0, len(misses), EMBED_BATCH_SIZE):
+            rows = misses[s:s + EMBED_BATCH_SIZE]
+            out[rows] = self.embedder.get_embeddings(batch[rows])
+            for i in rows:
+                self.cache.put(keys[i], out[i])
+        return out
+
+    def __call__(self, data: bytes = None, image: Image.Image = None):
+        """(Faces, (N, 512) embeddings) for every face in one image."""
+        faces = self.find_faces(data, image)
+        return faces, self.embed(self.crop(faces))
+
+
+def _decode_full(data):
+    return Image.open(io.BytesIO(data)).convert("RGB")
@@ -0,0 +1,101 @@
+import threading
+from collections import Counter
+import numpy as np
+from app.config import (QUALITY_GATE, QUALITY_MIN_SCORE, QUALITY_MIN_FACE, QUALITY_MIN_SHARPNESS,
+                        QUALITY_MAX_YAW, QUALITY_MAX_ROLL)
+from app.metrics import inc
+
+# Cheap checks between detection and the embedder, cheapest first:
+# detector score and box size (numbers only), pose from the 5 landmarks,
+# then blur on the 160x160 crop. A face that fails is never embedded.
+
+
+class LowQuality(Exception):
+    def __init__(self, reason):
+        super().__init__(f"face quality too low: {reason}")
+        self.reason = reason
+
+
+def pose(landmarks):
+    """(yaw, roll) from the 5 points MTCNN / retinaface return (eyes, nose,
+    mouth corners). yaw: the nose's offset from the eye midpoint along the
+    eye line, in half eye-distances (0 frontal, ~1 near profile); roll in
+    degrees."""
+    p = np.asarray(landmarks, dtype=np.float32).reshape(5, 2)
+    left, right, nose = p[0], p[1], p[2]
+    axis = right - left
+    dist = float(np.hypot(axis[0], axis[1]))
+    if dist < 1e-6:
+        return float("inf"), 0.0
+    roll = float(np.degrees(np.arctan2(axis[1], axis[0])))
+    yaw = float(np.dot(nose - (left + right) / 2.0, axis / dist) / (dist / 2.0))
+    return yaw, roll
+
+
+def sharpness(crop):
+    # variance of the 4-neighbour Laplacian of the gray crop; crops are
+    # standardized to about [-1, 1], so scale back to pixel units
+    g = crop.mean(axis=0) * 128.0
+    lap = g[:-2, 1:-1] + g[2:, 1:-1] + g[1:-1, :-2] + g[1:-1, 2:] - 4.0 * g[1:-1, 1:-1]
+    return float(lap.var())
+
+
+class QualityGate:
+    def __init__(self, enabled=QUALITY_GATE, min_score=QUALITY_MIN_SCORE, min_face=QUALITY_MIN_FACE,
+                 min_sharpness=QUALITY_MIN_SHARPNESS, max_yaw=QUALITY_MAX_YAW, max_roll=QUALITY_MAX_ROLL):
+        self.enabled = enabled
+        self.min_score = min_score
+        self.min_face = min_face
+        self.min_sharpness = min_sharpness
+        self.max_yaw = max_yaw
+        self.max_roll = max_roll
+        self.counts = Counter()  # "passed" or rejection reason -> faces
+        self._lock = threading.Lock()
+
+    def _count(self, result):
+        with self._lock:
+            self.counts[result] += 1
+        inc("quality_faces_total", result=result)
+
+    def check_detection(self, box, score=None, landmarks=None, scale=1.0):
+        """Rejection reason before cropping, or None. box / landmarks may be
+        on a downscaled image; `scale` maps box sizes to full resolution."""
+        if not self.enabled:
+            return None
+        reason = None
+        if score is not None and score < self.min_score:
+            reason = "score"
+        elif min(box[2] - box[0], box[3] - box[1]) * scale < self.min_face:
+            reason = "size"
+        elif landmarks is not None:
+            yaw, roll = pose(landmarks)
+            if abs(yaw) > self.max_yaw:
+                reason = "yaw"
+            elif abs(roll) > self.max_roll:
+                reason = "roll"
+        if reason:
+            self._count(reason)
+        return reason
+
+    def check_crop(self, crop):
+        # crop: standardized (3, H, W) float32, as fed to the embedder
+        if not self.enabled:
+            return None
+        if sharpness(crop) < self.min_sharpness:
+            self._count("blur")
+            return "blur"
+        self._count("passed")
+        return None
+
+    def stats(self, embed_seconds_per_face=None):
+        with self._lock:
+            counts = dict(self.counts)
+        passed = counts.pop("passed", 0)
+        rejected = sum(counts.values())
+        out = {"enabled": self.enabled, "checked": passed + rejected, "passed": passed,
+               "rejected": rejected, "reasons": counts,
+               "rejected_fraction": round(rejected / max(passed + rejected, 1), 4)}
+        if embed_seconds_per_face is not None:
+            # embedder time the rejected faces would have cost
+            out["embed_seconds_saved"] = round(rejected * embed_seconds_per_face, 3)
+        return out
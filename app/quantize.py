@@ -0,0 +1,234 @@
+import os
+import numpy as np
+from app.config import PQ_M, RERANK_K
+from app.index import FlatIndex, kmeans, nearest_centroid, _topk
+
+# Compressed gallery codes for the flat index. Approximate distances are
+# computed on the codes; the best RERANK_K candidates are then re-scored
+# against the exact float32 rows (the store memmap, so only those pages
+# are touched).
+#
+# codec.distances(queries, codes, sq) returns squared L2 distances up to a
+# per-query constant, which is all the shortlist ranking needs.
+
+
+class Float16Codec:
+    name = "fp16"
+
+    def train(self, x):
+        pass
+
+    def encode(self, x):
+        return np.asarray(x, dtype=np.float16)
+
+    def decode(self, codes):
+        return codes.astype(np.float32)
+
+    def distances(self, queries, codes, sq):
+        return sq[None, :] - 2.0 * (queries @ codes.astype(np.float32).T)
+
+    def state(self):
+        return {}
+
+    def load_state(self, state):
+        pass
+
+
+class Int8Codec:
+    """Scalar quantization: each dimension mapped onto 0..255 between its
+    min and max over the training set."""
+    name = "int8"
+
+    def __init__(self):
+        self.lo = None
+        self.scale = None
+
+    def train(self, x):
+        self.lo = x.min(axis=0).astype(np.float32)
+        self.scale = np.maximum((x.max(axis=0) - self.lo) / 255.0, 1e-8).astype(np.float32)
+
+    def encode(self, x):
+        return np.clip(np.rint((x - self.lo) / self.scale), 0, 255).astype(np.uint8)
+
+    def decode(self, codes):
+        return self.lo + self.scale * codes.astype(np.float32)
+
+    def distances(self, queries, codes, sq):
+        # q.x = q.lo + (q * scale).c, without materializing the decoded rows
+        dots = (queries @ self.lo)[:, None] + (queries * self.scale) @ codes.astype(np.float32).T
+        return sq[None, :] - 2.0 * dots
+
+    def state(self):
+        return {"lo": self.lo, "scale": self.scale}
+
+    def load_state(self, state):
+        self.lo = state["lo"]
+        self.scale = state["scale"]
+
+
+class PQCodec:
+    """Product quantization: m sub-vectors, each coded as one of 256
+    k-means centroids; searched with asymmetric distance tables."""
+    name = "pq"
+
+    def __init__(self, m=PQ_M, ksub=256):
+        self.m = m
+        self.ksub = ksub
+        self.centroids = None  # (m, ksub, dsub)
+
+    def _split(self, x):
+        return x.reshape(len(x), self.m, -1)
+
+    def train(self, x):
+        if x.shape[1] % self.m:
+            raise ValueError("PQ_M must divide the embedding size")
+        ksub = min(self.ksub, len(x))
+        sub = self._split(x)
+        self.centroids = np.stack([
+            kmeans(sub[:, j], ksub, seed=j, max_points=64 * 1024) for j in range(self.m)
+        ])
+
+    def encode(self, x):
+        sub = self._split(np.asarray(x, dtype=np.float32))
+        codes = np.empty((len(x), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = nearest_centroid(np.ascontiguousarray(sub[:, j]), self.centroids[j])
+        return codes
+
+    def decode(self, codes):
+        return np.concatenate([self.centroids[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def distances(self, queries, codes, sq):
+        qsub = self._split(queries)
+        # (nq, m, ksub) squared distances from each query sub-vector to each centroid
+        tables = ((qsub[:, :, None, :] - self.centroids[None]) ** 2).sum(-1)
+        cols = np.arange(self.m)[None, :]
+        return np.stack([t[cols, codes].sum(axis=1) for t in tables])
+
+    def state(self):
+        return {"centroids": self.centroids}
+
+    def load_state(self, state):
+        self.centroids = state["centroids"]
+        self.m = self.centroids.shape[0]
+
+
+CODECS = {"fp16": Float16Codec, "int8": Int8Codec, "pq": PQCodec}
+
+
+class QuantizedIndex:
+    """Flat scan over quantized codes plus exact re-ranking."""
+
+    def __init__(self, codec, rerank=RERANK_K, block=64 * 1024):
+        self.codec = codec
+        self.name = f"flat-{codec.name}"
+        self.rerank = rerank
+        self.block = block
+        self.trained = False
+        self._codes = None
+        self._sq = None
+        self._n = 0
+        self._removed = None  # bool per code slot, once anything was removed
+
+    @property
+    def codes(self):
+        return self._codes[:self._n]
+
+    def nbytes(self):
+        return self.codes.nbytes + self._sq[:self._n].nbytes if self._n else 0
+
+    def _set_codes(self, codes):
+        # squared norms of the decoded rows, for the fp16/int8 dot-product form
+        self._sq = np.empty(len(codes), dtype=np.float32)
+        for s in range(0, len(codes), self.block):
+            dec = self.codec.decode(codes[s:s + self.block])
+            self._sq[s:s + len(dec)] = np.einsum("ij,ij->i", dec, dec)
+        self._codes = codes
+        self._n = len(codes)
+        self._removed = None
+
+    def build(self, embs):
+        if len(embs) == 0:
+            self.trained = False
+            self._n = 0
+            return
+        embs = np.asarray(embs, dtype=np.float32)
+        self.codec.train(embs)
+        self.trained = True
+        self._set_codes(np.concatenate([self.codec.encode(embs[s:s + self.block]) for s in range(0, len(embs), self.block)]))
+
+    def add(self, row, emb):
+        if not self.trained:
+            return
+        code = self.codec.encode(emb[None, :])
+        if self._n == len(self._codes):
+            grown = np.empty((max(1024, 2 * self._n),) + self._codes.shape[1:], dtype=self._codes.dtype)
+            grown[:self._n] = self._codes[:self._n]
+            sq = np.empty(len(grown), dtype=np.float32)
+            sq[:self._n] = self._sq[:self._n]
+            if self._removed is not None:
+                removed = np.zeros(len(grown), dtype=bool)
+                removed[:self._n] = self._removed[:self._n]
+                self._removed = removed
+            self._codes, self._sq = grown, sq
+        dec = self.codec.decode(code)[0]
+        self._codes[self._n] = code[0]
+        self._sq[self._n] = dec @ dec
+        self._n += 1
+
+    def remove(self, rows):
+        # dead rows must not crowd the shortlist; exact scans use the norms
+        if not self.trained:
+            return
+        rows = np.asarray(rows, dtype=np.int64)
+        if self._removed is None:
+            self._removed = np.zeros(len(self._codes), dtype=bool)
+        self._removed[rows[rows < self._n]] = True
+
+    def search(self, embs, sq_norms, queries, k):
+        if not self.trained or self._n < len(embs):
+            # untrained, or rows added before training: exact scan
+            return FlatIndex().search(embs, sq_norms, queries, k)
+        n = len(embs)  # codes past it were added after the caller's snapshot
+        r = max(k, self.rerank)
+        cand_rows = [[] for _ in queries]
+        cand_d = [[] for _ in queries]
+        removed = self._removed
+        for s in range(0, n, self.block):
+            d2 = self.codec.distances(queries, self._codes[s:min(s + self.block, n)], self._sq[s:min(s + self.block, n)])
+            if removed is not None:
+                d2[:, removed[s:s + d2.shape[1]]] = np.inf
+            rows = np.arange(s, s + d2.shape[1])
+            for i, d in enumerate(d2):
+                top_rows, top_d = _topk(d, rows, r)
+                cand_rows[i].append(top_rows)
+                cand_d[i].append(top_d)
+        out = []
+        for q, rows_i, d_i in zip(queries, cand_rows, cand_d):
+            rows, _ = _topk(np.concatenate(d_i), np.concatenate(rows_i), r)
+            # exact re-rank of the shortlist
+            d2 = sq_norms[rows] - 2.0 * (np.asarray(embs[rows], dtype=np.float32) @ q) + q @ q
+            out.append(_topk(d2, rows, k))
+        return out
+
+    def save(self, path):
+        if self.trained:
+            with open(path, "wb") as f:
+                np.savez(f, codec=self.codec.name, codes=self.codes, **self.codec.state())
+
+    def load(self, path, n):
+        if not os.path.exists(path):
+            return None
+        data = np.load(path)
+        if "codec" not in data or str(data["codec"]) != self.codec.name or len(data["codes"]) > n:
+            return None
+        self.codec.load_state({k: data[k] for k in data.files if k not in ("codec", "codes")})
+        self.trained = True
+        self._set_codes(data["codes"])
+        return self._n
+
+
+def make_quantized_index(kind, rerank=RERANK_K):
+    if kind not in CODECS:
+        raise ValueError("Unknown quantization")
+    return QuantizedIndex(CODECS[kind](), rerank=rerank)
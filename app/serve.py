@@ -0,0 +1,54 @@
+"""Multi-process serving.
+
+    python -m app.serve --workers 8
+    python -m app.serve --workers 8 --host 0.0.0.0 --port 8000
+
+Runs app.main:app in --workers uvicorn processes. Each worker:
+  - maps the embedding store (faces.emb) read-only, so the gallery matrix
+    lives once in the page cache however many workers there are;
+  - gets cores // workers torch (and onnxruntime) threads instead of every
+    worker spinning up one thread per core;
+  - replays gallery changes (adds, deletes, renames) made by the other
+    workers every GALLERY_SYNC_MS (GalleryIndex.sync), and right after its
+    own writes.
+Schema upgrades and BLOB migrations run here once, before the workers
+start (they also take app.db.migration_lock, for workers started otherwise).
+"""
+import argparse
+import os
+import uvicorn
+
+
+def thread_env(workers, cores=None):
+    # env vars rather than torch calls: they must be set before the workers
+    # import torch / onnxruntime. Explicit settings win.
+    per_worker = str(max(1, (cores or os.cpu_count() or 1) // workers))
+    env = {"SERVE_WORKERS": str(workers)}
+    for key in ("TORCH_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS", "ORT_INTRA_THREADS"):
+        env[key] = os.environ.get(key, per_worker)
+    return env
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 4) // 4))
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    args = ap.parse_args()
+
+    # migrate before forking: the workers then find nothing left to do
+    from app.config import DB_PATH
+    from app.db import open_db
+    from app.store import open_store
+    db = open_db(DB_PATH)
+    open_store(db)
+    db.close()
+
+    env = thread_env(args.workers)
+    os.environ.update(env)
+    print(f"{args.workers} workers x {env['TORCH_THREADS']} torch threads")
+    uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import base64
+import hashlib
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+from app.config import EMBED_DIM, SHARD_TIMEOUT_MS, SHARD_POOL_SIZE
+from app.metrics import observe, inc
+from app.templates import identity_key
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
+
+# Scatter-gather over shard servers. Identities are partitioned by a stable
+# hash of their normalized name, every shard runs app.main over its own
+# FACE_DB, and the coordinator sends each query batch to all shards at once
+# over keep-alive connections, merging the per-shard top-k lists. A shard
+# that misses SHARD_TIMEOUT_MS is dropped from that merge, not waited for.
+
+
+class ShardsUnavailable(RuntimeError):
+    # no shard answered: the API reports 503, not an empty gallery
+    pass
+
+
+def shard_for(name, n_shards):
+    # stable across processes and restarts, unlike hash()
+    if n_shards <= 1:
+        return 0
+    digest = hashlib.blake2b(identity_key(name).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % n_shards
+
+
+def encode_embeddings(embs):
+    embs = np.ascontiguousarray(np.asarray(embs, dtype=np.float32).reshape(-1, EMBED_DIM))
+    return {"n": len(embs), "data": base64.b64encode(embs.tobytes()).decode("ascii")}
+
+
+def decode_embeddings(payload):
+    return np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32).reshape(int(payload["n"]), EMBED_DIM)
+
+
+def merge_topk(lists, k):
+    # each shard's list is already sorted by distance
+    return list(itertools.islice(heapq.merge(*lists, key=lambda m: m["distance"]), k))
+
+
+class ShardedGallery:
+    """Coordinator-side stand-in for GalleryIndex: same search / search_batch
+    / len, answered by the shard servers at `urls` (shard i = urls[i])."""
+
+    def __init__(self, urls, timeout_ms=SHARD_TIMEOUT_MS, pool_size=SHARD_POOL_SIZE):
+        if requests is None:
+            raise RuntimeError("SHARD_URLS needs the requests package")
+        self.urls = [u.rstrip("/") for u in urls]
+        self.timeout = timeout_ms / 1000.0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.urls), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="shard")
+        self.sizes = [None] * len(self.urls)  # last reported gallery size per shard
+        self.version = None  # each shard versions its own slice
+
+    def __len__(self):
+        # cached, never a network call: refresh_sizes() runs in the background
+        return sum(s or 0 for s in self.sizes)
+
+    @property
+    def reported(self):
+        # whether any shard has reported a size yet (until then len() is 0)
+        return any(s is not None for s in self.sizes)
+
+    def _call(self, shard, method, path, timeout, **kwargs):
+        resp = self.session.request(method, self.urls[shard] + path, timeout=timeout, **kwargs)
+        resp.raise_for_status()
+        return resp.json()
+
+    def _scatter(self, method, path, timeout, **kwargs):
+        """Same request to every shard in parallel. Returns {shard: json} for
+        the shards that answered within `timeout`."""
+        futures = {self._pool.submit(self._call, i, method, path, timeout, **kwargs): i
+                   for i in range(len(self.urls))}
+        done, not_done = wait(futures, timeout=timeout)
+        out = {}
+        for fut in done:
+            shard = futures[fut]
+            try:
+                out[shard] = fut.result()
+            except Exception as e:
+                inc("shard_errors_total", shard=shard)
+                print(f"shard {shard} ({self.urls[shard]}) failed: {e!r}")
+        for fut in not_done:
+            fut.cancel()  # its socket read times out on its own
+            inc("shard_timeouts_total", shard=futures[fut])
+        return out
+
+    def refresh_sizes(self):
+        for shard, info in self._scatter("GET", "/shard/info", max(self.timeout, 2.0)).items():
+            self.sizes[shard] = info["size"]
+        return self.sizes
+
+    def search(self, query, k=5):
+        return self.search_batch(np.asarray(query, dtype=np.float32).reshape(1, EMBED_DIM), k)[0]
+
+    def search_batch(self, queries, k=5):
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, EMBED_DIM)
+        body = {"embeddings": encode_embeddings(queries), "k": k}
+        replies = self._scatter("POST", "/shard/search", self.timeout, json=body)
+        observe("shards_answered", len(replies), buckets=tuple(range(1, len(self.urls) + 1)))
+        if not replies:
+            raise ShardsUnavailable(f"none of the {len(self.urls)} shards answered")
+        per_query = [[] for _ in queries]
+        for shard, reply in replies.items():
+            self.sizes[shard] = reply["size"]
+            for lst, matches in zip(per_query, reply["results"]):
+                for m in matches:
+                    m["shard"] = shard  # face ids are only unique within a shard
+                lst.append(matches)
+        return [merge_topk(lists, k) for lists in per_query]
+
+    def add(self, name, emb, image_path, content_hash=None):
+        """Enroll one face on the shard that owns `name`; returns its reply
+        ({"id", "shard"}). Raises when that shard is unreachable."""
+        shard = shard_for(name, len(self.urls))
+        body = {"name": name, "embedding": encode_embeddings(emb), "image_path": image_path,
+                "content_hash": content_hash, "shard": shard, "shard_count": len(self.urls)}
+        reply = self._call(shard, "POST", "/shard/add", max(self.timeout, 10.0), json=body)
+        self.sizes[shard] = reply["size"]
+        return reply
+
+    def list_faces(self):
+        replies = self._scatter("GET", "/list_identities", max(self.timeout, 10.0))
+        if not replies:
+            raise ShardsUnavailable(f"none of the {len(self.urls)} shards answered")
+        faces = []
+        for shard, rows in sorted(replies.items()):
+            faces.extend(dict(r, shard=shard) for r in rows)
+        return faces
+
+    # GalleryIndex hooks the API calls; shards keep their own indexes
+    def snapshot(self):
+        return self
+
+    def sync(self, db=None, store=None):
+        return 0
+
+    def save_index(self, path):
+        pass
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,153 @@
+import io
+import os
+import struct
+import threading
+import numpy as np
+from app.config import EMBED_DIM, EMBED_STORE_DTYPE
+
+try:
+    import fcntl  # serializes appends across worker processes (POSIX only)
+except ImportError:
+    fcntl = None
+
+# Append-only embedding file:
+#   64-byte header: magic, version, dim, dtype code, row count
+#   row i at HEADER_SIZE + i * dim * itemsize
+# SQLite keeps only metadata plus each face's row number (faces.emb_row).
+MAGIC = b"FFXEMB\x00\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIQ")
+HEADER_SIZE = 64
+DTYPES = {1: np.float32, 2: np.float16}
+DTYPE_CODES = {np.dtype(v): k for k, v in DTYPES.items()}
+
+
+class EmbeddingStore:
+    def __init__(self, path, dim=EMBED_DIM, dtype=EMBED_STORE_DTYPE):
+        self.path = path
+        self._lock = threading.Lock()
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, dim, DTYPE_CODES[np.dtype(dtype)], 0).ljust(HEADER_SIZE, b"\0"))
+        magic, version, self.dim, code, _ = self._read_header()
+        if magic != MAGIC or version != VERSION:
+            raise RuntimeError(f"{path} is not a v{VERSION} embedding store")
+        self.dtype = np.dtype(DTYPES[code])
+        self.row_bytes = self.dim * self.dtype.itemsize
+
+    def _read_header(self):
+        with open(self.path, "rb") as f:
+            return HEADER.unpack(f.read(HEADER.size))
+
+    def __len__(self):
+        return self._read_header()[4]
+
+    def view(self):
+        """Read-only (count, dim) memmap of the whole file; O(1), shared
+        page cache across processes."""
+        n = len(self)
+        if n == 0:
+            return np.zeros((0, self.dim), dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode="r", offset=HEADER_SIZE, shape=(n, self.dim))
+
+    def append(self, embs):
+        """Append rows, returning the row number of the first one."""
+        return self.append_committed(embs)[0]
+
+    def append_committed(self, embs, commit=None):
+        """append(), then commit(first_row) -- the database write that points
+        at the rows -- before the append lock is released. Rows reach the
+        change log in store order, across worker processes too, which is what
+        lets GalleryIndex keep mapping the file. Returns (first_row, what
+        commit returned). If commit raises, the rows stay behind unreferenced
+        and the gallery skips them."""
+        embs = np.ascontiguousarray(np.asarray(embs).reshape(-1, self.dim), dtype=self.dtype)
+        with self._lock, open(self.path, "r+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                magic, version, dim, code, n = HEADER.unpack(f.read(HEADER.size))
+                # rows first, then the count: readers never see a partial row
+                f.seek(HEADER_SIZE + n * self.row_bytes)
+                f.write(embs.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+                f.seek(0)
+                f.write(HEADER.pack(magic, version, dim, code, n + len(embs)))
+                f.flush()
+                result = commit(n) if commit is not None else None
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        return n, result
+
+
+def decode_blob(b):
+    # raw float32 bytes, or the older np.save (.npy) encoding
+    if b[:6] == b"\x93NUMPY":
+        return np.load(io.BytesIO(b))
+    return np.frombuffer(b, dtype=np.float32)
+
+
+def store_path(db_path):
+    return os.path.splitext(db_path)[0] + ".emb"
+
+
+def migrate_blob_embeddings(conn, store):
+    """Copy embeddings held as BLOBs in the faces table (raw float32 or
+    legacy .npy) into the store, one append and one transaction. The BLOBs
+    are kept, and every write stores one (Database.insert_faces /
+    update_faces), so rows whose emb_row is past the end of the store
+    (faces.emb lost or cut short) are copied in again; this runs before
+    anything else appends to a store. Faces without a BLOB can't be
+    recovered that way, and the gallery refuses to load while they point
+    past the end. Blobs that aren't `dim` floats are skipped, with a warning.
+    Each row moved is logged in the change log, so galleries already loaded
+    in other workers replay it. Callers hold app.db.migration_lock."""
+    from app.db import INSERT_CHANGE
+    cols = [c[1] for c in conn.execute("PRAGMA table_info(faces)")]
+    if not cols:
+        return 0
+    if "emb_row" not in cols:
+        conn.execute("ALTER TABLE faces ADD COLUMN emb_row INTEGER")
+    rows = conn.execute(
+        "SELECT id, name, emb_row, embedding FROM faces WHERE embedding IS NOT NULL AND (emb_row IS NULL OR emb_row >= ?) "
+        "ORDER BY id", (len(store),)
+    ).fetchall()
+    found, embs = [], []
+    for face_id, name, emb_row, blob in rows:
+        try:
+            emb = decode_blob(blob).reshape(-1)
+        except Exception:
+            emb = None
+        if emb is None or emb.size != store.dim:
+            print(f"faces.id={face_id}: embedding BLOB is not {store.dim} floats, skipped")
+            continue
+        found.append((face_id, name, emb_row))
+        embs.append(emb)
+    if not found:
+        return 0
+    embs = np.vstack(embs).astype(store.dtype)
+
+    def commit(start):
+        # the rows are fsynced; read them back before pointing at them
+        if not np.array_equal(np.asarray(store.view()[start:start + len(found)]), embs):
+            raise RuntimeError(f"{store.path}: rows {start}+ do not read back as written")
+        with conn:
+            for i, (face_id, name, emb_row) in enumerate(found):
+                conn.execute("UPDATE faces SET emb_row = ? WHERE id = ?", (start + i, face_id))
+                # a face whose old row is gone from the store gets a new one
+                conn.execute(INSERT_CHANGE, ("add" if emb_row is None else "update", face_id, name, start + i))
+    store.append_committed(embs, commit)
+    return len(found)
+
+
+def open_store(db, dim=EMBED_DIM, dtype=EMBED_STORE_DTYPE):
+    """The store that sits next to the database (path or app.db.Database),
+    with any BLOB rows migrated in."""
+    from app.db import as_db, migration_lock
+    db = as_db(db)
+    store = EmbeddingStore(store_path(db.path), dim=dim, dtype=dtype)
+    with migration_lock(db.path), db.connection() as conn:
+        migrate_blob_embeddings(conn, store)
+    return store
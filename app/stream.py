@@ -0,0 +1,283 @@
+import itertools
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from urllib.parse import urlsplit
+from app.config import (STREAM_DETECT_EVERY, STREAM_MAX_AGE, STREAM_IOU, STREAM_REEMBED_GAIN,
+                        STREAM_ALLOWED_URLS, STREAM_ALLOW_LOCAL)
+from app.utils import preprocess_batch
+
+# Video recognition: a producer thread decodes frames, the detector runs
+# only every `detect_every` frames, and tracks carry faces in between
+# (IoU association on detection frames, Lucas-Kanade flow shift on the
+# rest). Each track is embedded once, and again only when a clearly better
+# view of the face shows up.
+
+
+STREAM_SCHEMES = ("rtsp", "rtmp", "http", "https")
+
+
+def _origin(url):
+    # (scheme, host, port) of a URL, or None when the port is malformed
+    parts = urlsplit(url)
+    try:
+        return parts.scheme.lower(), (parts.hostname or "").lower(), parts.port
+    except ValueError:
+        return None
+
+
+def source_allowed(source, allowed=STREAM_ALLOWED_URLS, allow_local=STREAM_ALLOW_LOCAL):
+    """Whether a caller may have the server open `source`: network streams
+    whose scheme, host and port match an allowed entry exactly; camera
+    indexes and existing local files only with allow_local. Anything else
+    (other schemes, GStreamer pipelines, ...) is refused."""
+    source = str(source)
+    if urlsplit(source).scheme.lower() in STREAM_SCHEMES:
+        origin = _origin(source)
+        return origin is not None and any(origin == _origin(a) for a in allowed)
+    return allow_local and (source.isdigit() or os.path.isfile(source))
+
+
+class FrameReader:
+    """cv2.VideoCapture in a background thread feeding a bounded queue.
+    Live sources (rtsp/http) drop the oldest frame when the consumer falls
+    behind; files block so no frame is skipped."""
+
+    def __init__(self, source, maxsize=8):
+        self.source = source
+        self.live = isinstance(source, str) and source.startswith(("rtsp://", "rtmp://", "http://", "https://"))
+        self.cap = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+        if not self.cap.isOpened():
+            raise ValueError(f"cannot open video source {source!r}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 25.0
+        self.frames = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="frame-reader", daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self.live:
+                    try:
+                        self.frames.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _run(self):
+        for idx in itertools.count():
+            if self._stop.is_set():
+                break
+            ok, frame = self.cap.read()
+            if not ok:
+                break
+            self._put((idx, frame))
+        self._put(None)
+        self.cap.release()
+
+    def __iter__(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                return
+            yield item
+
+    def close(self):
+        self._stop.set()
+
+
+def iou_matrix(a, b):
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def face_quality(box, score):
+    # bigger, more confident detections make better embeddings
+    w, h = box[2] - box[0], box[3] - box[1]
+    return float(score) * float(np.sqrt(max(w, 0.0) * max(h, 0.0)))
+
+
+class Track:
+    _ids = itertools.count(1)
+
+    def __init__(self, box, score, frame_idx, landmarks=None):
+        self.id = next(Track._ids)
+        self.box = np.asarray(box, dtype=np.float32)
+        self.score = score
+        self.landmarks = landmarks  # from the last detection frame
+        self.last_seen = frame_idx  # last detection match; drives "lost"
+        self.flowed_at = None  # last frame the box was moved by optical flow
+        self.best_quality = 0.0  # quality of the view last embedded
+        self.identity = None
+        self.distance = None
+
+
+class IoUTracker:
+    def __init__(self, iou_threshold=STREAM_IOU, max_age=STREAM_MAX_AGE):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.tracks = {}
+
+    def update(self, detections, frame_idx):
+        """Associate detections with tracks greedily by IoU. Returns
+        (tracks seen in this frame, tracks dropped as lost)."""
+        tracks = list(self.tracks.values())
+        boxes = [d["box"] for d in detections]
+        matched_t, matched_d = set(), set()
+        if tracks and boxes:
+            ious = iou_matrix([t.box for t in tracks], boxes)
+            for flat in np.argsort(-ious, axis=None):
+                ti, di = divmod(int(flat), len(boxes))
+                if ious[ti, di] < self.iou_threshold:
+                    break
+                if ti in matched_t or di in matched_d:
+                    continue
+                matched_t.add(ti)
+                matched_d.add(di)
+                t = tracks[ti]
+                t.box = np.asarray(boxes[di], dtype=np.float32)
+                t.score = detections[di]["score"]
+                t.landmarks = detections[di].get("landmarks")
+                t.last_seen = frame_idx
+        for di, d in enumerate(detections):
+            if di not in matched_d:
+                t = Track(d["box"], d["score"], frame_idx, d.get("landmarks"))
+                self.tracks[t.id] = t
+        lost = [t for t in self.tracks.values() if frame_idx - t.last_seen > self.max_age]
+        for t in lost:
+            del self.tracks[t.id]
+        return [t for t in self.tracks.values() if t.last_seen == frame_idx], lost
+
+    def propagate(self, prev_gray, gray, frame_idx):
+        """Shift every live track by the median Lucas-Kanade flow of corners
+        inside its box, for frames where the detector is skipped."""
+        for t in self.tracks.values():
+            x1, y1, x2, y2 = t.box.astype(int)
+            h, w = gray.shape
+            x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+            if x2 - x1 < 8 or y2 - y1 < 8:
+                continue
+            pts = cv2.goodFeaturesToTrack(prev_gray[y1:y2, x1:x2], maxCorners=20, qualityLevel=0.01, minDistance=3)
+            if pts is None:
+                continue
+            pts = (pts + np.array([x1, y1], dtype=np.float32)).astype(np.float32)
+            nxt, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, pts, None, winSize=(15, 15), maxLevel=2)
+            ok = status.reshape(-1) == 1
+            if ok.sum() < 3:
+                continue
+            dx, dy = np.median((nxt - pts).reshape(-1, 2)[ok], axis=0)
+            t.box += np.array([dx, dy, dx, dy], dtype=np.float32)
+            t.flowed_at = frame_idx  # flow alone never keeps a track alive
+
+
+class StreamRecognizer:
+    """Runs detection / tracking / recognition over a FrameReader and
+    yields events:
+
+      {"type": "identity", "track", "frame", "name", "distance", "box"}
+          when a track is (re-)identified
+      {"type": "lost", "track", "frame", "name"}
+          when a track has not been seen for max_age frames
+      {"type": "stats", ...} every `stats_every` frames
+
+    embed_fn: list of CHW float32 crops -> (N, 512); search_fn: (N, 512) ->
+    per-row list of matches (GalleryIndex.search_batch). crop_fn(frame,
+    boxes, landmarks, out) writes the embedder's crops into out
+    (FacePipeline.crop_frame; default a plain box crop). With a `gate`
+    (app/quality.QualityGate), faces failing it are deferred: the track
+    stays unidentified and is tried again on the next detection frame."""
+
+    def __init__(self, detector, embed_fn, search_fn, detect_every=STREAM_DETECT_EVERY,
+                 reembed_gain=STREAM_REEMBED_GAIN, max_distance=0.8, tracker=None, stats_every=100, gate=None,
+                 crop_fn=None, size=160):
+        self.detector = detector
+        self.embed_fn = embed_fn
+        self.search_fn = search_fn
+        self.detect_every = max(1, detect_every)
+        self.reembed_gain = reembed_gain
+        self.max_distance = max_distance
+        self.tracker = tracker or IoUTracker()
+        self.stats_every = stats_every
+        self.gate = gate
+        self.crop_fn = crop_fn or (lambda frame, boxes, landmarks, out: preprocess_batch(frame, boxes, (size, size), out))
+        self.size = size
+        self.detections_run = 0
+        self.embeds = 0
+        self.deferred = 0
+        self._batch = None  # crop buffer, reused across detection frames
+
+    def _identify(self, frame, tracks, frame_idx):
+        h, w = frame.shape[:2]
+        todo = [t for t in tracks
+                if face_quality(t.box, t.score) > t.best_quality * self.reembed_gain
+                and min(t.box[2], w) - max(t.box[0], 0) >= 1 and min(t.box[3], h) - max(t.box[1], 0) >= 1]
+        if self.gate is not None:
+            ready = [t for t in todo if not self.gate.check_detection(t.box, t.score, t.landmarks)]
+            self.deferred += len(todo) - len(ready)
+            todo = ready
+        if not todo:
+            return []
+        if self._batch is None or len(self._batch) < len(todo):
+            self._batch = np.empty((max(len(todo), 8), 3, self.size, self.size), dtype=np.float32)
+        # embed_fn has consumed the crops by the time it returns
+        crops = self.crop_fn(frame, [t.box for t in todo], [t.landmarks for t in todo], self._batch)
+        if self.gate is not None:
+            sharp = [i for i, c in enumerate(crops) if not self.gate.check_crop(c)]
+            self.deferred += len(todo) - len(sharp)
+            if not sharp:
+                return []
+            if len(sharp) < len(todo):
+                todo, crops = [todo[i] for i in sharp], crops[sharp]
+        embs = self.embed_fn(list(crops))
+        self.embeds += len(todo)
+        events = []
+        for t, matches in zip(todo, self.search_fn(np.asarray(embs))):
+            t.best_quality = face_quality(t.box, t.score)
+            best = matches[0] if matches else None
+            name = best["name"] if best and best["distance"] <= self.max_distance else None
+            t.distance = best["distance"] if best else None
+            t.identity = name
+            events.append({
+                "type": "identity", "track": t.id, "frame": frame_idx, "name": name,
+                "distance": round(t.distance, 4) if t.distance is not None else None,
+                "box": [round(float(v), 1) for v in t.box],
+            })
+        return events
+
+    def run(self, reader):
+        prev_gray = None
+        t0 = time.perf_counter()
+        try:
+            for frame_idx, frame in reader:
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                if frame_idx % self.detect_every == 0:
+                    self.detections_run += 1
+                    seen, lost = self.tracker.update(self.detector.detect(frame), frame_idx)
+                    for ev in self._identify(frame, seen, frame_idx):
+                        yield ev
+                    for t in lost:
+                        yield {"type": "lost", "track": t.id, "frame": frame_idx, "name": t.identity}
+                elif prev_gray is not None and self.tracker.tracks:
+                    self.tracker.propagate(prev_gray, gray, frame_idx)
+                prev_gray = gray
+                if self.stats_every and (frame_idx + 1) % self.stats_every == 0:
+                    dt = time.perf_counter() - t0
+                    yield {"type": "stats", "frame": frame_idx, "fps": round((frame_idx + 1) / dt, 2),
+                           "detections_run": self.detections_run, "embeds": self.embeds, "deferred": self.deferred,
+                           "tracks": len(self.tracker.tracks)}
+        finally:
+            reader.close()
@@ -0,0 +1,180 @@
+import threading
+import unicodedata
+import numpy as np
+from app.config import TEMPLATE_EXEMPLARS, TEMPLATE_TOP_IDENTITIES
+from app.index import FlatIndex, _topk
+
+# Identity templates (INDEX_BACKEND=template): rows are grouped by
+# normalized name, each identity gets a centroid plus up to
+# TEMPLATE_EXEMPLARS k-medoid exemplars, and a query is first scored
+# against those few rows per person, then re-ranked exactly against the
+# individual embeddings of the TEMPLATE_TOP_IDENTITIES best identities.
+
+
+def identity_key(name):
+    # "Kinnu", " kinnu", "KINNU" -> "kinnu"
+    return " ".join(unicodedata.normalize("NFKC", str(name or "")).split()).casefold()
+
+
+def kmedoids(x, k, iters=10):
+    """Row indices of k medoids of x (L2), seeded most-central-first then
+    farthest-first, refined by alternating assignment / medoid update."""
+    n = len(x)
+    if n <= k:
+        return np.arange(n)
+    sq = np.einsum("ij,ij->i", x, x)
+    d2 = np.maximum(sq[:, None] + sq[None, :] - 2.0 * (x @ x.T), 0.0)
+    medoids = [int(np.argmin(d2.sum(axis=1)))]
+    while len(medoids) < k:
+        medoids.append(int(np.argmax(d2[:, medoids].min(axis=1))))
+    medoids = np.array(medoids)
+    for _ in range(iters):
+        assign = np.argmin(d2[:, medoids], axis=1)
+        new = medoids.copy()
+        for j in range(k):
+            members = np.flatnonzero(assign == j)
+            if len(members):
+                new[j] = members[np.argmin(d2[np.ix_(members, members)].sum(axis=1))]
+        if np.array_equal(new, medoids):
+            break
+        medoids = new
+    return medoids
+
+
+class TemplateIndex:
+    """Two-stage search over identity templates. Needs row labels (names),
+    which GalleryIndex passes to backends that set `labelled`."""
+    name = "template"
+    labelled = True
+
+    def __init__(self, exemplars=TEMPLATE_EXEMPLARS, top_identities=TEMPLATE_TOP_IDENTITIES):
+        self.exemplars = exemplars
+        self.top_identities = top_identities
+        self.slots = 1 + exemplars  # centroid + exemplars, per identity
+        self._lock = threading.Lock()
+        self._reset(0)
+
+    def _reset(self, dim):
+        self.keys = {}      # identity key -> identity number
+        self.members = []   # identity number -> [gallery rows]
+        self.identity_of = {}  # gallery row -> identity number
+        self._member_rows = []
+        self._dirty = set()
+        self.templates = np.zeros((0, dim), dtype=np.float32)
+        self.template_sq = np.zeros(0, dtype=np.float32)
+
+    def _identity(self, label):
+        key = identity_key(label)
+        i = self.keys.get(key)
+        if i is None:
+            i = self.keys[key] = len(self.members)
+            self.members.append([])
+            self._member_rows.append(np.empty(0, dtype=np.int64))
+        return i
+
+    # members and _dirty change only under _lock: searches run _refresh
+    # without the gallery's lock, and a dirty mark lost between its
+    # read and reset would leave an identity without a template
+    def build(self, embs, labels=()):
+        with self._lock:
+            self._reset(embs.shape[1])
+            for row, label in enumerate(labels):
+                i = self.identity_of[row] = self._identity(label)
+                self.members[i].append(row)
+            self._dirty = set(range(len(self.members)))
+            self._refresh_locked(embs)
+
+    def add(self, row, emb, label=None):
+        with self._lock:
+            if self.templates.shape[1] != len(emb):
+                self.templates = np.zeros((0, len(emb)), dtype=np.float32)
+            i = self.identity_of[row] = self._identity(label)
+            self.members[i].append(row)
+            self._dirty.add(i)  # templates are recomputed on the next search
+
+    def remove(self, rows):
+        with self._lock:
+            for row in np.asarray(rows, dtype=np.int64).tolist():
+                i = self.identity_of.pop(row, None)
+                if i is not None:
+                    self.members[i].remove(row)
+                    self._dirty.add(i)
+
+    def _refresh(self, embs):
+        with self._lock:
+            self._refresh_locked(embs)
+
+    def _refresh_locked(self, embs):
+        # caller holds _lock
+        dirty, self._dirty = sorted(self._dirty), set()
+        if not dirty:
+            return
+        n_ids, dim = len(self.members), embs.shape[1]
+        if len(self.templates) < n_ids * self.slots:
+            cap = max(1024, 1 << (n_ids * self.slots - 1).bit_length())
+            # fresh arrays: a concurrent search keeps its old snapshot
+            templates = np.zeros((cap, dim), dtype=np.float32)
+            templates[:len(self.templates)] = self.templates
+            template_sq = np.zeros(cap, dtype=np.float32)
+            template_sq[:len(self.template_sq)] = self.template_sq
+            self.templates, self.template_sq = templates, template_sq
+        n = len(embs)
+        for i in dirty:
+            rows = np.asarray(self.members[i], dtype=np.int64)
+            s = i * self.slots
+            if not len(rows):
+                # every row removed: no template, the identity can't match
+                self.templates[s:s + self.slots] = 0.0
+                self.template_sq[s:s + self.slots] = 0.0
+                self._member_rows[i] = rows
+                continue
+            if rows[-1] >= n:
+                # rows past a snapshot's n: finish on a later search
+                self._dirty.add(i)
+                rows = rows[rows < n]
+                if not len(rows):
+                    continue
+            x = np.asarray(embs[rows], dtype=np.float32)
+            norms = np.linalg.norm(x, axis=1)
+            centroid = x.mean(axis=0)
+            # same scale as the rows (unit rows -> unit centroid)
+            centroid *= norms.mean() / max(float(np.linalg.norm(centroid)), 1e-12)
+            block = np.repeat(centroid[None, :], self.slots, axis=0)
+            if self.exemplars and len(rows) > 1:
+                med = kmedoids(x, min(self.exemplars, len(rows)))
+                block[1:1 + len(med)] = x[med]
+            self.templates[s:s + self.slots] = block
+            self.template_sq[s:s + self.slots] = np.einsum("ij,ij->i", block, block)
+            self._member_rows[i] = rows
+
+    def search(self, embs, sq_norms, queries, k):
+        if self._dirty:
+            self._refresh(embs)
+        n_ids = len(self._member_rows)
+        if n_ids == 0:
+            return FlatIndex().search(embs, sq_norms, queries, k)
+        templates = self.templates[:n_ids * self.slots]
+        template_sq = self.template_sq[:n_ids * self.slots]
+        q_sq = np.einsum("ij,ij->i", queries, queries)
+        # stage 1: nearest template per identity
+        d2_id = (template_sq[None, :] - 2.0 * (queries @ templates.T) + q_sq[:, None])
+        d2_id = d2_id.reshape(len(queries), n_ids, self.slots).min(axis=2)
+        # identities with no template yet (only rows past n) can't match
+        d2_id[:, template_sq[::self.slots] == 0] = np.inf
+        top = min(self.top_identities, n_ids)
+        shortlist = np.argpartition(d2_id, top - 1, axis=1)[:, :top] if top < n_ids else np.tile(np.arange(n_ids), (len(queries), 1))
+        # stage 2: exact distances to those identities' own rows
+        n = len(embs)
+        out = []
+        for q, qq, ids in zip(queries, q_sq, shortlist):
+            rows = np.concatenate([self._member_rows[i] for i in ids])
+            rows = rows[rows < n]
+            d2 = sq_norms[rows] - 2.0 * (embs[rows] @ q) + qq
+            out.append(_topk(d2, rows, k))
+        return out
+
+    def save(self, path):
+        pass  # rebuilt from the gallery matrix, which is cheap
+
+    def load(self, path, n):
+        return None
@@ -1,10 +1,16 @@
-
+import io
 import cv2
 import numpy as np
+from PIL import Image
+from app.config import DETECT_MAX_SIDE
+
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
 
-def read_image_bytes(file_bytes) -> np.ndarray:
+def read_image_bytes(file_bytes, reduce=1) -> np.ndarray:
+    # reduce=2/4/8: libjpeg decodes straight to 1/reduce size (much cheaper)
     arr = np.frombuffer(file_bytes, np.uint8)
-    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+    img = cv2.imdecode(arr, REDUCED_FLAGS[reduce])
     return img
 
 def crop_box(img, box):
@@ -15,12 +21,74 @@ def crop_box(img, box):
     return img[y1:y2, x1:x2]
 
 # basic resize + normalization for embedder
-def preprocess_for_embedding(cropped_face, size=(160,160)):
+def preprocess_for_embedding(cropped_face, size=(160,160), out=None):
     face = cv2.resize(cropped_face, size)
-    face = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
-    face = face.astype('float32') / 255.0
-    # mean/std normalization if required by model
-    face = (face - 0.5) / 0.5
-    # CHW
-    face = np.transpose(face, (2,0,1))
-    return face
+    if out is None:
+        out = np.empty((3, size[1], size[0]), dtype=np.float32)
+    # BGR HWC uint8 -> RGB CHW float in one pass, then (x/255 - 0.5)/0.5 in place
+    np.multiply(face[..., ::-1].transpose(2, 0, 1), 1.0 / 127.5, out=out)
+    out -= 1.0
+    return out
+
+def preprocess_batch(img, boxes, size=(160,160), out=None):
+    """Crop every box of a BGR frame into one (N, 3, H, W) float32 batch,
+    reusing `out` when it is big enough. Empty crops stay zero."""
+    n = len(boxes)
+    if out is None or out.shape[0] < n:
+        out = np.empty((n, 3, size[1], size[0]), dtype=np.float32)
+    for i, box in enumerate(boxes):
+        crop = crop_box(img, box)
+        if crop.size:
+            preprocess_for_embedding(crop, size, out=out[i])
+        else:
+            out[i] = 0.0
+    return out[:n]
+
+# ---------- PIL / MTCNN request path ----------
+def decode_for_detection(data: bytes, max_side=DETECT_MAX_SIDE):
+    """RGB image no larger than max_side for the detector, plus the full
+    (w, h). JPEGs are decoded at 1/2, 1/4 or 1/8 scale by libjpeg (draft)
+    instead of decoding 12 MP and shrinking afterwards."""
+    img = Image.open(io.BytesIO(data))
+    full_size = img.size
+    if max_side and max(full_size) > max_side:
+        r = max_side / max(full_size)
+        img.draft("RGB", (int(full_size[0] * r), int(full_size[1] * r)))
+    img = img.convert("RGB")
+    if max_side and max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.BILINEAR)
+    return img, full_size
+
+def shrink_for_detection(image: Image.Image, max_side=DETECT_MAX_SIDE):
+    # same as decode_for_detection, for an image that is already decoded
+    if not max_side or max(image.size) <= max_side:
+        return image
+    small = image.copy()
+    small.thumbnail((max_side, max_side), Image.BILINEAR)
+    return small
+
+def margin_box(box, margin, size, wh):
+    # facenet_pytorch extract_face: margin is given in output pixels
+    mx = margin * (box[2] - box[0]) / (size - margin)
+    my = margin * (box[3] - box[1]) / (size - margin)
+    return (int(max(box[0] - mx / 2, 0)), int(max(box[1] - my / 2, 0)),
+            int(min(box[2] + mx / 2, wh[0])), int(min(box[3] + my / 2, wh[1])))
+
+def crop_faces(small, boxes, full_size, load_full, out, margin=20, size=160):
+    """Crops for boxes detected on `small`, standardized like MTCNN's
+    post_process ((x - 127.5) / 128) and written in place into out[:N].
+
+    Faces at least `size` px wide in `small` are cut from it directly;
+    otherwise load_full() is decoded once and the boxes are mapped back
+    to full resolution so small faces keep their detail."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    src = small
+    scale = full_size[0] / small.size[0]
+    if scale > 1.0 and len(boxes) and (boxes[:, 2] - boxes[:, 0]).min() < size:
+        src, boxes = load_full(), boxes * scale
+    for i, box in enumerate(boxes):
+        face = src.crop(margin_box(box, margin, size, src.size)).resize((size, size), Image.BILINEAR)
+        dst = out[i]
+        np.subtract(np.asarray(face).transpose(2, 0, 1), 127.5, out=dst)
+        dst *= 1.0 / 128.0
+    return out[:len(boxes)]
@@ -1,29 +1,30 @@
 # compare.py
 import numpy as np
 import sqlite3
-from facenet_pytorch import InceptionResnetV1, MTCNN
 from PIL import Image
-import torch
+from app.cache import EmbeddingCache
+from app.pipeline import FacePipeline
+from app.store import open_store
 
-# Load models
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-resnet = InceptionResnetV1(pretrained='vggface2').eval().to(device)
-mtcnn = MTCNN(image_size=160, margin=20, device=device)
+# Load models (DETECTOR_BACKEND / EMBEDDER_BACKEND); set EMBED_CACHE_DIR to
+# reuse embeddings across runs
+pipeline = FacePipeline(cache=EmbeddingCache())
 
 # Load DB face
+store = open_store("faces.db")
 conn = sqlite3.connect("faces.db")
 cursor = conn.cursor()
-cursor.execute("SELECT name, embedding FROM faces LIMIT 1")
+cursor.execute("SELECT name, emb_row FROM faces WHERE emb_row IS NOT NULL LIMIT 1")
 row = cursor.fetchone()
 conn.close()
 
-name, db_embed = row
-db_embedding = np.frombuffer(db_embed, dtype=np.float32)
+name, emb_row = row
+db_embedding = np.asarray(store.view()[emb_row], dtype=np.float32)
 
 # New image to compare
 image = image = Image.open(r"C:\Users\ndsha\Desktop\face_frs\gallery_images\kinnu_8fc39bab00a871c6.jpg").convert("RGB")
-face = mtcnn(image)
-emb = resnet(face.unsqueeze(0).to(device)).detach().cpu().numpy().flatten()
+faces = pipeline.find_faces(image=image)
+emb = pipeline.embed(pipeline.crop(faces, [faces.largest()]))[0]
 
 # Compute cosine similarity
 sim = np.dot(emb, db_embedding) / (np.linalg.norm(emb) * np.linalg.norm(db_embedding))
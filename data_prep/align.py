@@ -1,19 +1,117 @@
-# pip install face-alignment
-import face_alignment
+"""Align faces to the canonical 5-point template, one image or a whole folder.
+
+    python -m data_prep.align /data/faces aligned.npy --workers 8
+    python -m data_prep.align faces.zip aligned.npy --size 160
+
+The detector's own landmarks (MTCNN detect(..., landmarks=True), or
+retinaface's kps with DETECTOR_BACKEND=insightface), from the detection
+half of app/pipeline.FacePipeline, drive a similarity warp (app/align.py),
+so no second landmark model is loaded. Size and zoom default to the
+embedder's (EMBEDDER_BACKEND: 160 for facenet, 112 for insightface) and
+are recorded with the crops; enrolment refuses crops that don't match.
+Folder mode
+decodes and detects in a process pool and streams one aligned crop per
+image (the largest face) into aligned.npy, with names, sha256s and
+landmarks in aligned.meta.npz. The file feeds tools.bulk_enroll and
+tools.evaluate --aligned without running detection again.
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import cv2
 import numpy as np
-from skimage import io
+from app.align import warp_faces, AlignedWriter
+from app.config import DETECTOR_BACKEND
+from app.enroll import iter_sources, _bounded_map
+
+
+def largest(detections):
+    return max(detections, key=lambda d: (d["box"][2] - d["box"][0]) * (d["box"][3] - d["box"][1]))
 
-fa = face_alignment.FaceAlignment(face_alignment.LandmarksType._2D, device='cpu')
 
-def align_and_crop(img_bgr, output_size=(160,160)):
-    # face_alignment expects RGB
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    preds = fa.get_landmarks(img_rgb)
-    if preds is None or len(preds)==0:
+def align_and_crop(img_bgr, output_size=(160, 160), detector=None):
+    """Aligned BGR crop of the largest face in img_bgr, or None."""
+    if detector is None:
+        from app.pipeline import FacePipeline
+        detector = FacePipeline(DETECTOR_BACKEND, embedder=None)
+    faces = [d for d in detector.detect(img_bgr) if d.get("landmarks") is not None]
+    if not faces:
         return None
-    lm = preds[0]  # (68,2) or (5,2) depending
-    # compute transformation using eye centers and nose; use similarity transform
-    # For brevity you can use a standardized alignment warp (open-source code available)
-    # Save cropped aligned face
-    # ...
+    return warp_faces(img_bgr, [largest(faces)["landmarks"]], size=output_size[0], zoom=getattr(detector, "zoom", 0.85))[0]
+
+
+# ---------- pool workers ----------
+_detector = None
+_size = 160
+_zoom = 0.85
+
+def _init_worker(size, zoom):
+    global _detector, _size, _zoom
+    import torch
+    from app.pipeline import FacePipeline
+    torch.set_num_threads(1)  # one process per core instead
+    _detector = FacePipeline(DETECTOR_BACKEND, embedder=None)
+    _size, _zoom = size, zoom
+
+def _align(job):
+    image_path, name, payload = job
+    if payload is None:
+        with open(image_path, "rb") as f:
+            payload = f.read()
+    digest = hashlib.sha256(payload).hexdigest()
+    img = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return digest, None, "unreadable"
+    faces = [d for d in _detector.detect(img) if d.get("landmarks") is not None]
+    if not faces:
+        return digest, None, "no_face"
+    best = largest(faces)
+    return digest, (warp_faces(img, [best["landmarks"]], size=_size, zoom=_zoom)[0], best["score"], best["landmarks"]), "ok"
+
+
+def align_folder(source, out_path, workers=None, size=None, progress=print):
+    """Align every image under `source` (dir or archive) into out_path.
+    size defaults to the embedder's input. Returns counts per outcome."""
+    from app.pipeline import FacePipeline
+    crops = FacePipeline(detector=None, embedder=None)  # crop geometry only, no models
+    size = size or crops.size
+    counts = {"ok": 0, "duplicate": 0, "no_face": 0, "unreadable": 0}
+    seen = set()
+    with AlignedWriter(out_path, size, crops.zoom) as writer, ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(size, crops.zoom)) as pool:
+        window = 16 * (workers or os.cpu_count() or 1)
+        for (image_path, name, _), (digest, result, status) in _bounded_map(pool, _align, iter_sources(source), window):
+            if status == "ok" and digest in seen:
+                status = "duplicate"
+            counts[status] += 1
+            if status != "ok":
+                continue
+            seen.add(digest)
+            face, score, landmarks = result
+            writer.append(face, image_path, name, digest, score, landmarks)
+            if counts["ok"] % 1000 == 0:
+                progress(f"aligned {counts['ok']} faces ({sum(counts.values())} images seen)")
+    return counts
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("source", help="directory, .zip or .tar(.gz)")
+    ap.add_argument("out", help="aligned crops, .npy")
+    ap.add_argument("--workers", type=int, default=None, help="detection processes (default: all cores)")
+    ap.add_argument("--size", type=int, default=None, help="crop size (default: the embedder's input)")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    counts = align_folder(args.source, args.out, workers=args.workers, size=args.size)
+    dt = time.perf_counter() - t0
+    print(", ".join(f"{k}: {v}" for k, v in counts.items()))
+    print(f"{dt:.1f} s, {counts['ok'] / max(dt, 1e-9):.1f} faces/s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,6 @@
 import os
 import streamlit as st
 import requests, io, base64
-from PIL import Image
 from datetime import datetime
 
 API_BASE = "http://127.0.0.1:8000"
@@ -55,6 +54,7 @@ def post_recognize(img_bytes: bytes):
         return None
 
 def pil_from_bytes(b):
+    from PIL import Image  # only when an image is shown, keeps dashboard start light
     return Image.open(io.BytesIO(b)).convert("RGB")
 
 def make_thumb_bytes(pil_img, size=(96, 96)):
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from app.gallery import GalleryIndex
+from app.index import hnswlib, make_index
+
+# A GallerySnapshot shares the live backend: rows the gallery appends after
+# snapshot() must not reach (or break) the snapshot's search.
+
+BACKENDS = [("flat", "none"), ("ivf", "none"), ("template", "none"), ("hnsw", "none"),
+            ("flat", "fp16"), ("flat", "int8"), ("flat", "pq")]
+
+
+def unit_rows(rng, n, dim):
+    x = rng.standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("backend,quantization", BACKENDS)
+def test_append_between_snapshot_and_search(backend, quantization):
+    if backend == "hnsw" and hnswlib is None:
+        pytest.skip("hnswlib not installed")
+    rng = np.random.default_rng(0)
+    dim, n = 64, 600
+    embs = unit_rows(rng, n, dim)
+    gallery = GalleryIndex(dim=dim, index=make_index(backend, dim=dim, quantization=quantization))
+    gallery.set(np.arange(n), [f"person{i % 40}" for i in range(n)], embs)
+    queries = unit_rows(rng, 8, dim)
+
+    snap = gallery.snapshot()
+    before = snap.search_batch(queries, k=5)
+    # exact copies of the queries, under old and new names: each would be
+    # every query's nearest row
+    for i, q in enumerate(np.repeat(queries, 25, axis=0)):
+        gallery.add(n + i, f"person{i % 60}", q)
+    after = snap.search_batch(queries, k=5)
+
+    assert after == before
+    assert all(m["id"] < n for matches in after for m in matches)
+    # the live gallery does see them
+    assert all(matches[0]["id"] >= n for matches in gallery.search_batch(queries, k=5))
+
+
+@pytest.mark.parametrize("backend,quantization", BACKENDS)
+def test_compaction_keeps_the_store_mapped(tmp_path, backend, quantization):
+    if backend == "hnsw" and hnswlib is None:
+        pytest.skip("hnswlib not installed")
+    from app.db import open_db
+    from app.store import open_store
+    rng = np.random.default_rng(1)
+    db = open_db(str(tmp_path / "faces.db"))
+    store = open_store(db)
+    embs = unit_rows(rng, 400, 512)
+    _, ids = store.append_committed(embs, lambda first: db.insert_faces(
+        [(f"person{i % 30}", first + i, None, None) for i in range(len(embs))], embs))
+    factory = lambda: make_index(backend, quantization=quantization)
+    gallery = GalleryIndex(index=factory(), index_factory=factory).load_from_db(db, store)
+    db.delete_faces(ids[:300])
+    gallery.sync(db, store)
+    gallery.compact()
+
+    for g in (gallery, GalleryIndex(index=factory(), index_factory=factory).load_from_db(db, store)):
+        assert g.store is not None  # still the mapped store file, no private copy
+        assert len(g) == 100
+        found = [matches[0]["id"] for matches in g.search_batch(embs[:310], k=1)]
+        assert not set(found) & set(ids[:300])
+        assert found[300:] == ids[300:310]
@@ -0,0 +1,217 @@
+"""CPU benchmarks for the recognition hot paths.
+
+    python -m tools.benchmark_cpu --out bench.json
+    python -m tools.benchmark_cpu --stages search --search-sizes 1000 100000 1000000
+    python -m tools.benchmark_cpu --compare base.json bench.json --tolerance 0.10
+
+Stages (each skipped with a note if its dependencies are missing):
+  decode    utils.read_image_bytes (cv2, full and 1/4) vs PIL vs the reduced
+            decode_for_detection path, on gallery_images/
+  detect    Detector("mtcnn") vs Detector("insightface")
+  embed     Embedder(EMBEDDER_BACKEND) at batch sizes 1..64
+  search    GalleryIndex on synthetic embeddings, 1k..1M rows
+  e2e       /recognize through the FastAPI TestClient
+
+Every case reports p50/p95/p99 latency (ms), throughput (items/s) and the
+process peak RSS (MB) after it ran. --compare diffs two result files and
+exits non-zero when a p50 or throughput regressed past --tolerance.
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import numpy as np
+from app.config import EMBED_DIM, TOP_K, GALLERY_DIR, EMBEDDER_BACKEND, INDEX_BACKEND
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == "darwin" else rss / 1024.0
+
+
+def measure(fn, repeats=50, warmup=3, items=1):
+    for _ in range(warmup):
+        fn()
+    times = np.empty(repeats)
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - t0
+    p50, p95, p99 = np.percentile(times * 1000.0, [50, 95, 99])
+    return {
+        "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+        "throughput": float(items * repeats / times.sum()),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def image_files(folder=GALLERY_DIR, limit=16):
+    paths = sorted(glob.glob(os.path.join(folder, "*.jpg")) + glob.glob(os.path.join(folder, "*.png")))
+    return paths[:limit]
+
+
+def bench_decode(args):
+    import io
+    from PIL import Image
+    from app.utils import read_image_bytes, decode_for_detection
+    blobs = [open(p, "rb").read() for p in image_files()]
+    if not blobs:
+        return {"skipped": f"no images in {GALLERY_DIR}"}
+    cv2_blobs, cv2_reduced, pil_blobs, draft_blobs = (itertools.cycle(blobs) for _ in range(4))
+    return {
+        "cv2": measure(lambda: read_image_bytes(next(cv2_blobs)), args.repeats),
+        "cv2_reduced_4": measure(lambda: read_image_bytes(next(cv2_reduced), reduce=4), args.repeats),
+        "pil": measure(lambda: Image.open(io.BytesIO(next(pil_blobs))).convert("RGB").load(), args.repeats),
+        "pil_detect_input": measure(lambda: decode_for_detection(next(draft_blobs)), args.repeats),
+    }
+
+
+def bench_detect(args):
+    import cv2
+    from app.detector import Detector
+    paths = image_files(limit=4)
+    if not paths:
+        return {"skipped": f"no images in {GALLERY_DIR}"}
+    imgs = [cv2.imread(p) for p in paths]
+    out = {}
+    for backend in ("mtcnn", "insightface"):
+        try:
+            det = Detector(backend)
+        except Exception as e:
+            out[backend] = {"skipped": str(e)}
+            continue
+        frames = itertools.cycle(imgs)
+        out[backend] = measure(lambda: det.detect(next(frames)), max(5, args.repeats // 5))
+    return out
+
+
+def bench_embed(args):
+    from app.embedder import Embedder
+    try:
+        emb = Embedder(EMBEDDER_BACKEND)
+    except Exception as e:
+        return {"skipped": str(e)}
+    out = {"backend": EMBEDDER_BACKEND}
+    rng = np.random.default_rng(0)
+    for bs in args.batch_sizes:
+        faces = rng.standard_normal((bs, 3, 160, 160)).astype(np.float32)
+        r = measure(lambda: emb.get_embeddings(faces), max(3, args.repeats // bs), items=bs)
+        r["ms_per_face"] = r["p50_ms"] / bs
+        out[f"batch_{bs}"] = r
+    return out
+
+
+def bench_search(args):
+    from app.gallery import GalleryIndex
+    from app.index import make_index
+    from tools.index_report import synthetic_gallery, noisy_queries
+    out = {"backend": INDEX_BACKEND}
+    for n in args.search_sizes:
+        embs = synthetic_gallery(n, EMBED_DIM)
+        gallery = GalleryIndex(index=make_index(INDEX_BACKEND)).set(np.arange(n), [str(i) for i in range(n)], embs)
+        del embs
+        queries = itertools.cycle(noisy_queries(gallery.embeddings, 64))
+        out[f"n_{n}"] = measure(lambda: gallery.search(next(queries), TOP_K), args.repeats)
+        del gallery
+    return out
+
+
+def bench_e2e(args):
+    try:
+        from fastapi.testclient import TestClient
+        from app.main import app
+    except Exception as e:
+        return {"skipped": str(e)}
+    paths = image_files(limit=4)
+    if not paths:
+        return {"skipped": f"no images in {GALLERY_DIR}"}
+    blobs = itertools.cycle([open(p, "rb").read() for p in paths])
+    with TestClient(app) as client:
+        def run():
+            r = client.post("/recognize", files={"file": ("face.jpg", next(blobs), "image/jpeg")})
+            if r.status_code not in (200, 400):
+                raise RuntimeError(r.text)
+        return {"recognize": measure(run, max(5, args.repeats // 5))}
+
+
+STAGES = {"decode": bench_decode, "detect": bench_detect, "embed": bench_embed,
+          "search": bench_search, "e2e": bench_e2e}
+
+
+def flatten(d, prefix=""):
+    for k, v in d.items():
+        if isinstance(v, dict):
+            yield from flatten(v, f"{prefix}{k}.")
+        else:
+            yield f"{prefix}{k}", v
+
+
+def compare(base_path, new_path, tolerance):
+    base = dict(flatten(json.load(open(base_path))["results"]))
+    new = dict(flatten(json.load(open(new_path))["results"]))
+    regressions = 0
+    for key in sorted(base.keys() & new.keys()):
+        b, n = base[key], new[key]
+        if not isinstance(b, (int, float)) or not isinstance(n, (int, float)) or not b:
+            continue
+        if key.endswith(("p50_ms", "p95_ms", "p99_ms", "throughput")):
+            change = (n - b) / b
+            # latency going up or throughput going down is a regression
+            worse = change if not key.endswith("throughput") else -change
+            flag = ""
+            if worse > tolerance and not key.endswith(("p95_ms", "p99_ms")):
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{key:45s} {b:12.3f} -> {n:12.3f}  {change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    ap.add_argument("--repeats", type=int, default=50)
+    ap.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    ap.add_argument("--search-sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    ap.add_argument("--out", help="write results as JSON")
+    ap.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"))
+    ap.add_argument("--tolerance", type=float, default=0.10)
+    args = ap.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.tolerance) else 0)
+
+    results = {}
+    for stage in args.stages:
+        print(f"== {stage}", flush=True)
+        try:
+            results[stage] = STAGES[stage](args)
+        except ImportError as e:
+            results[stage] = {"skipped": str(e)}
+        for key, v in flatten(results[stage]):
+            if key.endswith(("p50_ms", "throughput", "skipped")):
+                print(f"  {key:40s} {v:.3f}" if isinstance(v, float) else f"  {key:40s} {v}")
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "embedder": EMBEDDER_BACKEND,
+            "index": INDEX_BACKEND,
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
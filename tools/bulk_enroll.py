@@ -0,0 +1,51 @@
+"""Bulk-enroll a folder tree or archive laid out like gallery_images/<name>_*.jpg.
+
+    python -m tools.bulk_enroll /data/new_faces --db faces.db --workers 8
+    python -m tools.bulk_enroll faces.zip --save-dir gallery_images
+    python -m tools.bulk_enroll aligned.npy     # from data_prep.align, embedding only
+
+Decode + detection (app/pipeline.py) run in a process pool, crops are embedded in batches and
+rows are written with one transaction per --chunk. Re-running
+skips images whose sha256 is already enrolled, so an interrupted run can
+simply be started again. A running API picks the new rows up on restart
+(or use its /bulk_enroll endpoint instead).
+"""
+import argparse
+import time
+from app.config import EMBED_BATCH_SIZE, DB_PATH
+from app.pipeline import FacePipeline
+from app.db import open_db
+from app.enroll import enroll, enroll_aligned
+from app.store import open_store
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("source", help="directory, .zip, .tar(.gz) or an aligned .npy from data_prep.align")
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--workers", type=int, default=None, help="detection processes (default: all cores)")
+    ap.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    ap.add_argument("--chunk", type=int, default=4096, help="faces per committed transaction")
+    ap.add_argument("--save-dir", default=None, help="where to write archive members (default: don't keep them)")
+    args = ap.parse_args()
+
+    db = open_db(args.db)
+    store = open_store(db)
+    pipeline = FacePipeline(detector=None)  # the pool workers detect
+
+    t0 = time.perf_counter()
+    if args.source.endswith(".npy"):
+        try:
+            counts = enroll_aligned(args.source, db, store, pipeline, batch_size=args.batch_size, chunk=args.chunk)
+        except ValueError as e:
+            raise SystemExit(f"{args.source}: {e}")
+    else:
+        counts = enroll(args.source, db, store, pipeline.embed, workers=args.workers,
+                        batch_size=args.batch_size, chunk=args.chunk, save_dir=args.save_dir)
+    dt = time.perf_counter() - t0
+    print(", ".join(f"{k}: {v}" for k, v in counts.items()))
+    print(f"{dt:.1f} s, {counts['ok'] / max(dt, 1e-9):.1f} faces/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Export the facenet InceptionResnetV1 (vggface2) embedder to ONNX.
+
+    python -m tools.convert_onnx --out models/facenet.onnx
+
+The graph takes a (batch, 3, 160, 160) float32 input named "input" with a
+dynamic batch axis and returns (batch, 512) "embedding". With --check the
+export is run through onnxruntime and compared with torch.
+"""
+import argparse
+import os
+import time
+import numpy as np
+import torch
+from facenet_pytorch import InceptionResnetV1
+from app.config import ONNX_MODEL_PATH
+
+
+def export(out_path, opset=17):
+    net = InceptionResnetV1(pretrained='vggface2').eval()
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    dummy = torch.randn(2, 3, 160, 160)
+    torch.onnx.export(
+        net, dummy, out_path,
+        input_names=["input"], output_names=["embedding"],
+        dynamic_axes={"input": {0: "batch"}, "embedding": {0: "batch"}},
+        opset_version=opset, do_constant_folding=True,
+    )
+    return net
+
+
+def check(net, out_path, batch_sizes=(1, 8, 32), repeats=10):
+    from app.embedder import make_ort_session
+    sess = make_ort_session(out_path)
+    for bs in batch_sizes:
+        x = torch.randn(bs, 3, 160, 160)
+        with torch.no_grad():
+            t0 = time.perf_counter()
+            for _ in range(repeats):
+                ref = net(x).numpy()
+            torch_ms = 1000.0 * (time.perf_counter() - t0) / repeats
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            got = sess.run(None, {"input": x.numpy()})[0]
+        ort_ms = 1000.0 * (time.perf_counter() - t0) / repeats
+        cos = np.sum(ref * got, axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(got, axis=1))
+        print(f"batch {bs:3d}: max |diff| {np.abs(ref - got).max():.2e}, min cosine {cos.min():.6f}, "
+              f"torch {torch_ms / bs:.2f} ms/face, onnxruntime {ort_ms / bs:.2f} ms/face")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", default=ONNX_MODEL_PATH)
+    ap.add_argument("--opset", type=int, default=17)
+    ap.add_argument("--check", action="store_true", help="compare onnxruntime against torch after export")
+    args = ap.parse_args()
+
+    net = export(args.out, args.opset)
+    print(f"wrote {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB)")
+    if args.check:
+        check(net, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Offline 1:1 verification metrics for a labelled face folder.
+
+    python -m tools.evaluate --images gallery_images
+    python -m tools.evaluate --images /data/lfw --layout dirs --out eval.json
+    python -m tools.evaluate --aligned lfw_aligned.npy    # crops from data_prep.align
+
+Labels come from sub-directories (--layout dirs, root/<name>/*.jpg) or from
+the file name prefix as in gallery_images/<name>_<hex>.jpg (--layout
+prefix). Faces are detected and embedded in batches; embeddings are cached
+in an .npz next to --out (or --cache) and only new files are embedded on
+later runs.
+
+All genuine / impostor pairs are scored block by block (one GEMM per
+block) into fixed-width histograms, so memory stays O(block^2) and there is
+no per-pair Python work. Reports ROC, TAR@FAR, EER and the best threshold
+as cosine distance and as L2 distance (embeddings are unit length, so
+l2 = sqrt(2 * cosine_distance)), plus how the thresholds currently in use
+perform: MATCH_THRESHOLD and the 0.8 L2 cut-off in /recognize.
+"""
+import argparse
+import glob
+import json
+import os
+import numpy as np
+from app.config import MATCH_THRESHOLD, EMBEDDER_BACKEND, EMBED_BATCH_SIZE
+
+RECOGNIZE_L2_THRESHOLD = 0.8  # app/main.py match_result
+FARS = [1e-1, 1e-2, 1e-3, 1e-4, 1e-5, 1e-6]
+
+
+def list_images(root, layout):
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(root, "**", f"*.{ext}"), recursive=True))
+    if layout == "dirs":
+        labels = [os.path.basename(os.path.dirname(p)) for p in paths]
+    else:
+        labels = [os.path.basename(p).rsplit("_", 1)[0] for p in paths]
+    return paths, [l.strip().casefold() for l in labels]
+
+
+def embed_images(paths, batch_size=EMBED_BATCH_SIZE):
+    from app.pipeline import FacePipeline
+    pipeline = FacePipeline()
+    embs = np.full((len(paths), 512), np.nan, dtype=np.float32)
+    batch = np.empty((batch_size, 3, pipeline.size, pipeline.size), dtype=np.float32)
+    idx = []
+
+    def flush():
+        if idx:
+            embs[idx] = pipeline.embed(batch[:len(idx)])
+            idx.clear()
+
+    for i, p in enumerate(paths):
+        with open(p, "rb") as f:
+            faces = pipeline.find_faces(f.read())
+        if len(faces):
+            # the largest face, cropped straight into its batch slot
+            pipeline.crop(faces, [faces.largest()], batch[len(idx):])
+            idx.append(i)
+        if len(idx) == batch_size:
+            flush()
+        if (i + 1) % 500 == 0:
+            print(f"  {i + 1}/{len(paths)} images", flush=True)
+    flush()
+    return embs
+
+
+def embed_aligned(path, batch_size=EMBED_BATCH_SIZE):
+    # crops from data_prep.align: no detection, names from its meta file
+    from app.align import load_aligned, check_aligned, to_model_input
+    from app.pipeline import FacePipeline
+    pipeline = FacePipeline(detector=None)
+    faces, meta = load_aligned(path)
+    check_aligned(faces, meta, pipeline)
+    buf = np.empty((batch_size, 3) + faces.shape[1:3], dtype=np.float32)
+    embs = np.concatenate([pipeline.embed(to_model_input(faces[s:s + batch_size], out=buf,
+                                                         mean=pipeline.mean, std=pipeline.std))
+                           for s in range(0, len(faces), batch_size)]) if len(faces) else np.zeros((0, 512), np.float32)
+    return embs, [str(n).strip().casefold() for n in meta["names"]]
+
+
+def load_embeddings(paths, cache_path):
+    """Embeddings for `paths`, reusing rows cached for unchanged files.
+    Rows for images without a detectable face are NaN."""
+    mtimes = np.array([os.path.getmtime(p) for p in paths])
+    embs = np.full((len(paths), 512), np.nan, dtype=np.float32)
+    todo = np.ones(len(paths), dtype=bool)
+    if cache_path and os.path.exists(cache_path):
+        cache = np.load(cache_path, allow_pickle=False)
+        cached = {p: i for i, p in enumerate(cache["paths"])}
+        for i, p in enumerate(paths):
+            j = cached.get(p)
+            if j is not None and cache["mtimes"][j] == mtimes[i] and cache["backend"] == EMBEDDER_BACKEND:
+                embs[i] = cache["embs"][j]
+                todo[i] = False
+    if todo.any():
+        print(f"embedding {todo.sum()} images ({(~todo).sum()} cached)")
+        embs[todo] = embed_images([p for p, t in zip(paths, todo) if t])
+        if cache_path:
+            with open(cache_path, "wb") as f:
+                np.savez(f, paths=np.array(paths), mtimes=mtimes, embs=embs, backend=EMBEDDER_BACKEND)
+    return embs
+
+
+def pair_histograms(embs, labels, bins=4000, block=4096):
+    """Histograms of cosine distance (range [0, 2]) over all genuine and all
+    impostor pairs i < j."""
+    genuine = np.zeros(bins, dtype=np.int64)
+    impostor = np.zeros(bins, dtype=np.int64)
+    n = len(embs)
+    for i in range(0, n, block):
+        a, la = embs[i:i + block], labels[i:i + block]
+        for j in range(i, n, block):
+            b, lb = embs[j:j + block], labels[j:j + block]
+            d = 1.0 - a @ b.T
+            idx = np.clip((d * (bins / 2.0)).astype(np.int64), 0, bins - 1)
+            same = la[:, None] == lb[None, :]
+            if i == j:
+                upper = np.triu(np.ones(same.shape, dtype=bool), k=1)
+                genuine += np.bincount(idx[same & upper], minlength=bins)
+                impostor += np.bincount(idx[~same & upper], minlength=bins)
+            else:
+                genuine += np.bincount(idx[same], minlength=bins)
+                impostor += np.bincount(idx[~same], minlength=bins)
+    return genuine, impostor
+
+
+def roc_from_histograms(genuine, impostor):
+    bins = len(genuine)
+    # accept when distance <= upper edge of the bin
+    thresholds = (np.arange(1, bins + 1) * (2.0 / bins))
+    tar = np.cumsum(genuine) / max(genuine.sum(), 1)
+    far = np.cumsum(impostor) / max(impostor.sum(), 1)
+    return thresholds, tar, far
+
+
+def metrics(genuine, impostor):
+    thr, tar, far = roc_from_histograms(genuine, impostor)
+    frr = 1.0 - tar
+    e = int(np.argmin(np.abs(far - frr)))
+    best = int(np.argmax(tar - far))  # Youden's J
+    out = {
+        "genuine_pairs": int(genuine.sum()),
+        "impostor_pairs": int(impostor.sum()),
+        "eer": float((far[e] + frr[e]) / 2.0),
+        "eer_threshold": {"cosine": float(thr[e]), "l2": float(np.sqrt(2.0 * thr[e]))},
+        "best_threshold": {"cosine": float(thr[best]), "l2": float(np.sqrt(2.0 * thr[best])),
+                           "tar": float(tar[best]), "far": float(far[best])},
+        "tar_at_far": {},
+        "current": {},
+    }
+    for target in FARS:
+        ok = np.flatnonzero(far <= target)
+        if len(ok) and impostor.sum() * target >= 1:
+            k = ok[-1]
+            out["tar_at_far"][f"{target:g}"] = {"tar": float(tar[k]), "cosine": float(thr[k]), "l2": float(np.sqrt(2.0 * thr[k]))}
+    for name, cos_thr in (("MATCH_THRESHOLD(cosine)", MATCH_THRESHOLD),
+                          ("recognize_l2_0.8", RECOGNIZE_L2_THRESHOLD ** 2 / 2.0)):
+        k = min(int(np.searchsorted(thr, cos_thr, side="right")) - 1, len(thr) - 1)
+        out["current"][name] = {"tar": float(tar[k]) if k >= 0 else 0.0, "far": float(far[k]) if k >= 0 else 0.0}
+    # ~200 points are plenty to plot
+    step = max(1, len(thr) // 200)
+    out["roc"] = {"cosine": thr[::step].round(5).tolist(), "tar": tar[::step].round(6).tolist(),
+                  "far": far[::step].round(8).tolist()}
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--images", default="gallery_images")
+    ap.add_argument("--layout", choices=["prefix", "dirs"], default="prefix")
+    ap.add_argument("--aligned", default=None, help="aligned crops (.npy) from data_prep.align instead of --images")
+    ap.add_argument("--cache", default=None, help="embedding cache (.npz); default <out>.emb.npz")
+    ap.add_argument("--out", default="eval.json")
+    ap.add_argument("--block", type=int, default=4096)
+    ap.add_argument("--bins", type=int, default=4000)
+    args = ap.parse_args()
+
+    if args.aligned:
+        embs, labels = embed_aligned(args.aligned)
+        paths = labels
+    else:
+        paths, labels = list_images(args.images, args.layout)
+        if not paths:
+            raise SystemExit(f"no images under {args.images}")
+        embs = load_embeddings(paths, args.cache or os.path.splitext(args.out)[0] + ".emb.npz")
+    ok = ~np.isnan(embs).any(axis=1)
+    print(f"{ok.sum()}/{len(paths)} images with a face, {len(set(np.array(labels)[ok]))} identities")
+    _, label_ids = np.unique(np.array(labels)[ok], return_inverse=True)
+
+    genuine, impostor = pair_histograms(embs[ok], label_ids, bins=args.bins, block=args.block)
+    report = metrics(genuine, impostor)
+    report.update({"images": len(paths), "faces": int(ok.sum()), "embedder": EMBEDDER_BACKEND})
+
+    print(f"pairs: {report['genuine_pairs']} genuine, {report['impostor_pairs']} impostor")
+    print(f"EER {report['eer']:.4f} at cosine {report['eer_threshold']['cosine']:.3f} / L2 {report['eer_threshold']['l2']:.3f}")
+    b = report["best_threshold"]
+    print(f"best threshold: cosine {b['cosine']:.3f} / L2 {b['l2']:.3f}  (TAR {b['tar']:.4f}, FAR {b['far']:.5f})")
+    for far, r in report["tar_at_far"].items():
+        print(f"TAR@FAR={far:<6s} {r['tar']:.4f}  (cosine {r['cosine']:.3f} / L2 {r['l2']:.3f})")
+    for name, r in report["current"].items():
+        print(f"{name:24s} TAR {r['tar']:.4f}  FAR {r['far']:.5f}")
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
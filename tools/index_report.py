@@ -0,0 +1,91 @@
+"""Recall vs latency of the gallery search backends.
+
+    python -m tools.index_report --n 100000 --nprobe 4 8 16 32
+    python -m tools.index_report --db faces.db
+
+Uses synthetic identity-clustered embeddings unless --db is given, in which
+case the gallery itself (with a little noise added) supplies the queries.
+The template backend is run at each --top-ids (identities re-ranked).
+"""
+import argparse
+import json
+import numpy as np
+from app.config import EMBED_DIM, TOP_K
+from app.gallery import GalleryIndex
+from app.index import IVFIndex, HNSWIndex, recall_report, hnswlib
+from app.templates import TemplateIndex
+from app.store import open_store
+
+
+def synthetic_gallery(n, dim=EMBED_DIM, per_identity=10, noise=0.6, seed=0, return_labels=False):
+    # unit identity centres, per-photo noise of norm ~`noise`
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // per_identity), dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    labels = rng.integers(0, len(centers), n)
+    embs = centers[labels] + noise * rng.standard_normal((n, dim)).astype(np.float32) / np.sqrt(dim)
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    return (embs, labels) if return_labels else embs
+
+
+def noisy_queries(embs, n_queries, noise=0.3, seed=1):
+    rng = np.random.default_rng(seed)
+    q = embs[rng.integers(0, len(embs), n_queries)]
+    q = q + noise * rng.standard_normal(q.shape).astype(np.float32) / np.sqrt(q.shape[1])
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", help="read embeddings from this faces DB instead of synthetic data")
+    ap.add_argument("--n", type=int, default=100000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=TOP_K)
+    ap.add_argument("--nlist", type=int, default=1024)
+    ap.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    ap.add_argument("--ef", type=int, nargs="+", default=[16, 64, 256])
+    ap.add_argument("--top-ids", type=int, nargs="+", default=[2, 8, 32])
+    args = ap.parse_args()
+
+    if args.db:
+        gallery = GalleryIndex().load_from_db(args.db, open_store(args.db))
+        embs, labels = gallery.embeddings.copy(), gallery.names.copy()
+    else:
+        embs, labels = synthetic_gallery(args.n, return_labels=True)
+    queries = noisy_queries(embs, args.queries)
+    print(f"gallery: {len(embs)} x {embs.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    reports = []
+    ivf = IVFIndex(nlist=args.nlist)
+    ivf.build(embs)
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        r = recall_report(ivf, embs, queries, k=args.k)
+        r["nprobe"] = nprobe
+        reports.append(r)
+    if hnswlib is not None:
+        hnsw = HNSWIndex(embs.shape[1])
+        hnsw.build(embs)
+        for ef in args.ef:
+            hnsw.ef_search = ef
+            r = recall_report(hnsw, embs, queries, k=args.k)
+            r["ef_search"] = ef
+            reports.append(r)
+    templates = TemplateIndex()
+    templates.build(embs, labels)
+    for top in args.top_ids:
+        templates.top_identities = top
+        r = recall_report(templates, embs, queries, k=args.k)
+        r["top_identities"] = top
+        reports.append(r)
+
+    for r in reports:
+        param = (f"nprobe={r['nprobe']}" if "nprobe" in r else f"ef={r['ef_search']}" if "ef_search" in r
+                 else f"top_ids={r['top_identities']}")
+        print(f"{r['backend']:8s} {param:12s} recall@{r['k']}={r['recall']:.3f}  "
+              f"{r['latency_ms']:.3f} ms/query  (flat {r['exact_latency_ms']:.3f} ms)")
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
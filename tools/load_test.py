@@ -0,0 +1,117 @@
+"""Concurrent load against a running API; reports tail latency.
+
+    python -m tools.load_test --clients 50 --duration 30
+    python -m tools.load_test --url http://127.0.0.1:8000 --endpoint recognize_batch --out load.json
+
+Each client thread loops over images from --images, posting to --endpoint
+with its own keep-alive session. A separate probe hits /health every
+--probe-ms: if heavy requests were blocking the event loop, its latency
+would track theirs instead of staying flat. 503s (the server's
+MAX_CONCURRENT_REQUESTS backpressure) are counted separately.
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+from collections import Counter
+import numpy as np
+import requests
+from app.config import GALLERY_DIR
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    p50, p95, p99 = np.percentile(np.asarray(samples) * 1000.0, [50, 95, 99])
+    return {"n": len(samples), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+            "max_ms": float(np.max(samples) * 1000.0)}
+
+
+def client(url, endpoint, blobs, deadline, ok, statuses, lock):
+    session = requests.Session()
+    for i in itertools.count():
+        if time.monotonic() >= deadline:
+            return
+        data = blobs[i % len(blobs)]
+        if endpoint == "recognize_batch":
+            files = [("files", (f"{j}.jpg", data, "image/jpeg")) for j in range(4)]
+        else:
+            files = {"file": ("face.jpg", data, "image/jpeg")}
+        t0 = time.perf_counter()
+        try:
+            status = session.post(f"{url}/{endpoint}", files=files, timeout=60).status_code
+        except requests.RequestException:
+            status = "error"
+        dt = time.perf_counter() - t0
+        with lock:
+            statuses[status] += 1
+            if status == 200:
+                ok.append(dt)
+
+
+def probe(url, deadline, interval, samples):
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        t0 = time.perf_counter()
+        try:
+            session.get(f"{url}/health", timeout=10)
+            samples.append(time.perf_counter() - t0)
+        except requests.RequestException:
+            pass
+        time.sleep(interval)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--endpoint", choices=["recognize", "recognize_batch"], default="recognize")
+    ap.add_argument("--clients", type=int, default=50)
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds")
+    ap.add_argument("--images", default=GALLERY_DIR)
+    ap.add_argument("--probe-ms", type=float, default=100.0)
+    ap.add_argument("--out", help="write results as JSON")
+    args = ap.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.images, "*.jpg")) + glob.glob(os.path.join(args.images, "*.png")))
+    if not paths:
+        raise SystemExit(f"no images in {args.images}")
+    blobs = [open(p, "rb").read() for p in paths[:64]]
+
+    ok, health, statuses, lock = [], [], Counter(), threading.Lock()
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=client, args=(args.url, args.endpoint, blobs, deadline, ok, statuses, lock))
+               for _ in range(args.clients)]
+    threads.append(threading.Thread(target=probe, args=(args.url, deadline, args.probe_ms / 1000.0, health)))
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    report = {
+        "endpoint": args.endpoint,
+        "clients": args.clients,
+        "seconds": elapsed,
+        "throughput_rps": len(ok) / elapsed,
+        "status": {str(k): v for k, v in statuses.items()},
+        "latency": percentiles(ok),
+        "health_latency": percentiles(health),
+    }
+    print(f"{args.clients} clients, {elapsed:.1f} s, {report['throughput_rps']:.1f} ok req/s")
+    print("status: " + ", ".join(f"{k}: {v}" for k, v in report["status"].items()))
+    for label, key in ((args.endpoint, "latency"), ("/health", "health_latency")):
+        r = report[key]
+        if r:
+            print(f"{label:16s} p50 {r['p50_ms']:8.1f} ms  p95 {r['p95_ms']:8.1f} ms  p99 {r['p99_ms']:8.1f} ms  max {r['max_ms']:8.1f} ms")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Accuracy and memory of quantized gallery codes against float32 search.
+
+    python -m tools.quant_report --db faces.db
+    python -m tools.quant_report --n 200000 --rerank 0 50 200
+
+For each codec reports recall@k and top-1 agreement with exact float32
+search, with and without exact re-ranking, plus bytes per gallery row.
+"""
+import argparse
+import json
+import time
+import numpy as np
+from app.config import TOP_K, PQ_M
+from app.gallery import GalleryIndex
+from app.index import FlatIndex
+from app.quantize import CODECS, QuantizedIndex, PQCodec
+from app.store import open_store
+from tools.index_report import synthetic_gallery, noisy_queries
+
+
+def compare(index, embs, queries, k, exact):
+    sq_norms = np.einsum("ij,ij->i", embs, embs)
+    t0 = time.perf_counter()
+    approx = index.search(embs, sq_norms, queries, k)
+    ms = 1000.0 * (time.perf_counter() - t0) / len(queries)
+    hits = sum(len(np.intersect1d(a[0], e[0])) for a, e in zip(approx, exact))
+    top1 = np.mean([a[0][0] == e[0][0] for a, e in zip(approx, exact)])
+    return {
+        "recall": hits / max(sum(len(e[0]) for e in exact), 1),
+        "top1_agreement": float(top1),
+        "latency_ms": ms,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", help="use this faces DB (and its .emb store) instead of synthetic data")
+    ap.add_argument("--n", type=int, default=100000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=TOP_K)
+    ap.add_argument("--pq-m", type=int, default=PQ_M)
+    ap.add_argument("--rerank", type=int, nargs="+", default=[0, 100])
+    args = ap.parse_args()
+
+    if args.db:
+        embs = np.array(GalleryIndex().load_from_db(args.db, open_store(args.db)).embeddings, dtype=np.float32)
+    else:
+        embs = synthetic_gallery(args.n)
+    queries = noisy_queries(embs, args.queries)
+    sq_norms = np.einsum("ij,ij->i", embs, embs)
+    exact = FlatIndex().search(embs, sq_norms, queries, args.k)
+    print(f"gallery: {len(embs)} x {embs.shape[1]}, float32 = {embs.shape[1] * 4} bytes/row")
+
+    reports = []
+    for name, codec_cls in CODECS.items():
+        codec = PQCodec(m=args.pq_m) if name == "pq" else codec_cls()
+        index = QuantizedIndex(codec)
+        index.build(embs)
+        for rerank in args.rerank:
+            # rerank 0 = codes only (the shortlist is just the top k)
+            index.rerank = rerank
+            r = compare(index, embs, queries, args.k, exact)
+            r.update({"codec": name, "rerank": max(rerank, args.k),
+                      "bytes_per_row": index.nbytes() / len(embs)})
+            reports.append(r)
+            print(f"{name:5s} rerank={r['rerank']:<5d} recall@{args.k}={r['recall']:.3f}  "
+                  f"top1={r['top1_agreement']:.3f}  {r['bytes_per_row']:.0f} B/row  {r['latency_ms']:.3f} ms/query")
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""INT8 post-training static quantization of the ONNX face embedder.
+
+    python -m tools.convert_onnx                 # models/facenet.onnx first
+    python -m tools.quantize_int8 --images gallery_images
+
+Calibrates activation ranges on the API's face crops (app/pipeline.py) from --images, writes the
+QDQ INT8 graph to ONNX_INT8_MODEL_PATH (use it with
+EMBEDDER_BACKEND=onnx-int8) and checks it against the float model:
+cosine agreement of the embeddings and agreement of the match / no-match
+decision for every pair of faces at --threshold (L2, as in /recognize).
+"""
+import argparse
+import glob
+import os
+import time
+import numpy as np
+from onnxruntime.quantization import (
+    CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_static,
+)
+from app.config import ONNX_MODEL_PATH, ONNX_INT8_MODEL_PATH
+from app.embedder import make_ort_session
+from app.pipeline import FacePipeline
+
+
+def load_crops(folder, limit=None):
+    # the facenet crops the exported network sees in the API
+    pipeline = FacePipeline(embedder=None, align=False, crops_for="onnx")
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(folder, f"**/*.{ext}"), recursive=True))
+    crops, names = [], []
+    for path in paths[:limit]:
+        with open(path, "rb") as f:
+            faces = pipeline.find_faces(f.read())
+        if len(faces):
+            crops.append(pipeline.crop(faces, [faces.largest()])[0])
+            names.append(path)
+    return np.stack(crops).astype(np.float32), names
+
+
+class CropReader(CalibrationDataReader):
+    def __init__(self, crops, input_name, batch_size=8):
+        self.batches = iter([{input_name: crops[i:i + batch_size]} for i in range(0, len(crops), batch_size)])
+
+    def get_next(self):
+        return next(self.batches, None)
+
+
+def embed(sess, crops, batch_size=32):
+    name = sess.get_inputs()[0].name
+    out = np.concatenate([sess.run(None, {name: crops[i:i + batch_size]})[0] for i in range(0, len(crops), batch_size)])
+    return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+
+def accuracy_report(fp32, int8, threshold):
+    cos = np.sum(fp32 * int8, axis=1)
+    # unit rows: ||a - b|| = sqrt(2 - 2 a.b)
+    d_fp32 = np.sqrt(np.maximum(2.0 - 2.0 * fp32 @ fp32.T, 0.0))
+    d_int8 = np.sqrt(np.maximum(2.0 - 2.0 * int8 @ int8.T, 0.0))
+    iu = np.triu_indices(len(fp32), k=1)
+    decisions = (d_fp32[iu] <= threshold) == (d_int8[iu] <= threshold)
+    # nearest other face under each model
+    np.fill_diagonal(d_fp32, np.inf)
+    np.fill_diagonal(d_int8, np.inf)
+    return {
+        "faces": len(fp32),
+        "cosine_mean": float(cos.mean()),
+        "cosine_min": float(cos.min()),
+        "pair_decision_agreement": float(decisions.mean()) if len(decisions) else 1.0,
+        "nearest_neighbour_agreement": float(np.mean(d_fp32.argmin(1) == d_int8.argmin(1))) if len(fp32) > 1 else 1.0,
+        "max_pair_distance_shift": float(np.abs(d_fp32[iu] - d_int8[iu]).max()) if len(decisions) else 0.0,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", default=ONNX_MODEL_PATH)
+    ap.add_argument("--out", default=ONNX_INT8_MODEL_PATH)
+    ap.add_argument("--images", default="gallery_images")
+    ap.add_argument("--limit", type=int, default=None, help="max images to read")
+    ap.add_argument("--calib-fraction", type=float, default=0.5,
+                    help="share of crops used for calibration; the rest are held out for the check")
+    ap.add_argument("--method", choices=["minmax", "entropy", "percentile"], default="minmax")
+    ap.add_argument("--threshold", type=float, default=0.8)
+    args = ap.parse_args()
+
+    crops, paths = load_crops(args.images, args.limit)
+    if len(crops) < 2:
+        raise SystemExit(f"need at least 2 detectable faces in {args.images}")
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(crops))
+    n_calib = max(1, int(len(crops) * args.calib_fraction))
+    calib, held_out = crops[order[:n_calib]], crops[order[n_calib:]]
+    if len(held_out) < 2:
+        held_out = crops
+    print(f"{len(crops)} faces: {len(calib)} for calibration, {len(held_out)} for the check")
+
+    fp32_sess = make_ort_session(args.model)
+    methods = {"minmax": CalibrationMethod.MinMax, "entropy": CalibrationMethod.Entropy,
+               "percentile": CalibrationMethod.Percentile}
+    quantize_static(
+        args.model, args.out, CropReader(calib, fp32_sess.get_inputs()[0].name),
+        quant_format=QuantFormat.QDQ, per_channel=True,
+        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+        calibrate_method=methods[args.method],
+    )
+    print(f"wrote {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB, "
+          f"float {os.path.getsize(args.model) / 1e6:.1f} MB)")
+
+    int8_sess = make_ort_session(args.out)
+    t0 = time.perf_counter()
+    fp32 = embed(fp32_sess, held_out)
+    t1 = time.perf_counter()
+    int8 = embed(int8_sess, held_out)
+    t2 = time.perf_counter()
+
+    report = accuracy_report(fp32, int8, args.threshold)
+    report["fp32_ms_per_face"] = 1000.0 * (t1 - t0) / len(held_out)
+    report["int8_ms_per_face"] = 1000.0 * (t2 - t1) / len(held_out)
+    for k, v in report.items():
+        print(f"{k:30s} {v:.4f}" if isinstance(v, float) else f"{k:30s} {v}")
+
+
+if __name__ == "__main__":
+    main()
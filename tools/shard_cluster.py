@@ -0,0 +1,102 @@
+"""Run a sharded gallery locally: N shard servers plus a coordinator.
+
+    python -m tools.shard_cluster --shards 4 --split faces.db
+    python -m tools.shard_cluster --shards 4 --base-port 8100 --dir shards
+
+Shard i serves shards/shard<i>.db on base-port + 1 + i (SHARD_INDEX=i,
+SHARD_COUNT=N); the coordinator serves the usual API on base-port with
+SHARD_URLS pointing at them. --split first partitions an existing gallery
+(database + embedding store) into the shard files by identity hash; shard
+files that already exist are appended to, skipping faces they already
+hold (same content hash, or same name and image for faces without one), so
+re-running --split is safe. Ctrl-C stops every process.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from app.db import open_db
+from app.shards import shard_for
+from app.store import open_store
+
+
+def shard_db_path(directory, shard):
+    return os.path.join(directory, f"shard{shard}.db")
+
+
+def split_gallery(source, n_shards, directory):
+    db = open_db(source)
+    view = open_store(db).view()
+    paths = {r[0]: r[2] for r in db.list_faces()}
+    hashes = db.face_hashes()
+    parts = [[] for _ in range(n_shards)]
+    for face_id, name, row in db.gallery_rows():
+        parts[shard_for(name, n_shards)].append((name, row, paths.get(face_id), hashes.get(face_id)))
+    os.makedirs(directory, exist_ok=True)
+    for shard, rows in enumerate(parts):
+        sdb = open_db(shard_db_path(directory, shard))
+        known = sdb.known_hashes()
+        known_paths = {(r[1], r[2]) for r in sdb.list_faces() if r[2] is not None}
+        new = [r for r in rows if not (r[3] in known if r[3] is not None else (r[0], r[2]) in known_paths)]
+        skipped = len(rows) - len(new)
+        if new:
+            embs = np.asarray(view[[r[1] for r in new]], dtype=np.float32)
+            # rows are written under the store lock, in store order
+            open_store(sdb).append_committed(embs, lambda first: sdb.insert_faces(
+                [(name, first + i, path, h) for i, (name, _, path, h) in enumerate(new)], embs))
+        sdb.close()
+        print(f"shard {shard}: {len(new)} faces added ({skipped} already there), "
+              f"{len({r[0].casefold() for r in new})} identities")
+
+
+def spawn(port, env, host):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", host, "--port", str(port)],
+        env=dict(os.environ, **env))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--shards", type=int, default=2)
+    ap.add_argument("--base-port", type=int, default=8000, help="coordinator port; shards follow it")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--dir", default="shards", help="where the shard databases live")
+    ap.add_argument("--split", default=None, help="partition this gallery database into the shards first")
+    ap.add_argument("--timeout-ms", type=float, default=None, help="coordinator SHARD_TIMEOUT_MS")
+    args = ap.parse_args()
+
+    if args.split:
+        split_gallery(args.split, args.shards, args.dir)
+
+    procs, urls = [], []
+    try:
+        for i in range(args.shards):
+            port = args.base_port + 1 + i
+            db_path = shard_db_path(args.dir, i)
+            procs.append(spawn(port, {
+                "FACE_DB": db_path, "INDEX_PATH": os.path.splitext(db_path)[0] + ".index",
+                "SHARD_INDEX": str(i), "SHARD_COUNT": str(args.shards),
+                # each shard gets its share of the cores
+                "TORCH_THREADS": str(max(1, (os.cpu_count() or 1) // (args.shards + 1))),
+            }, args.host))
+            urls.append(f"http://{args.host}:{port}")
+        coordinator = {"SHARD_URLS": ",".join(urls)}
+        if args.timeout_ms is not None:
+            coordinator["SHARD_TIMEOUT_MS"] = str(args.timeout_ms)
+        procs.append(spawn(args.base_port, coordinator, args.host))
+        print(f"coordinator http://{args.host}:{args.base_port} -> {', '.join(urls)}")
+        while all(p.poll() is None for p in procs):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+
+
+if __name__ == "__main__":
+    main()
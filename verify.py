@@ -1,32 +1,33 @@
 import sqlite3
 import numpy as np
-import torch
-from PIL import Image
-from facenet_pytorch import MTCNN, InceptionResnetV1
+from app.cache import EmbeddingCache
+from app.pipeline import FacePipeline
+from app.store import open_store
 
-# Load models
-mtcnn = MTCNN(image_size=160, margin=0)
-resnet = InceptionResnetV1(pretrained='vggface2').eval()
+# Load models (DETECTOR_BACKEND / EMBEDDER_BACKEND); set EMBED_CACHE_DIR to
+# reuse embeddings across runs
+pipeline = FacePipeline(cache=EmbeddingCache())
 
 # Load DB
+store = open_store('faces.db')
 conn = sqlite3.connect('faces.db')
 cursor = conn.cursor()
-cursor.execute("SELECT name, embedding FROM faces")
+cursor.execute("SELECT name, emb_row FROM faces WHERE emb_row IS NOT NULL")
 rows = cursor.fetchall()
 conn.close()
 
+embs = store.view()
 known_faces = []
-for name, emb_blob in rows:
-    known_faces.append((name, np.frombuffer(emb_blob, dtype=np.float32)))
+for name, emb_row in rows:
+    known_faces.append((name, np.asarray(embs[emb_row], dtype=np.float32)))
 
 # Test recognition
-img = Image.open("gallery_images/kinnu_63dd0e1c30ed06f9.jpg")
-face = mtcnn(img)
-if face is None:
+with open("gallery_images/kinnu_63dd0e1c30ed06f9.jpg", "rb") as f:
+    faces = pipeline.find_faces(f.read())
+if not len(faces):
     print("No face detected in test image.")
 else:
-    with torch.no_grad():
-        emb = resnet(face.unsqueeze(0)).numpy().flatten()
+    emb = pipeline.embed(pipeline.crop(faces, [faces.largest()]))[0]
 
     for name, known_emb in known_faces:
         dist = np.linalg.norm(emb - known_emb)